@@ -26,6 +26,47 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     });
 
+    // Username availability (GET /api/auth/username-available/).
+    // Advisory only: the server still rejects a taken name on submit.
+    const usernameInput = document.getElementById("username");
+    const usernameStatus = document.getElementById("usernameStatus");
+    let probeTimer = null;
+    let probeSeq = 0;
+
+    const showUsernameStatus = (text, ok) => {
+        if (!usernameStatus) return;
+        usernameStatus.textContent = text;
+        usernameStatus.classList.toggle("hidden", !text);
+        usernameStatus.classList.toggle("text-emerald-600", ok === true);
+        usernameStatus.classList.toggle("text-red-500", ok === false);
+    };
+
+    const probeUsername = async (username) => {
+        const seq = ++probeSeq;
+        try {
+            const response = await fetch(`/api/auth/username-available/?username=${encodeURIComponent(username)}`);
+            // Throttled or offline: say nothing rather than guess
+            if (!response.ok) return showUsernameStatus("");
+            const data = await response.json();
+            if (seq !== probeSeq) return; // a newer keystroke won
+            showUsernameStatus(data.available ? "Username is available" : "Username is already taken", data.available);
+        } catch (err) {
+            showUsernameStatus("");
+        }
+    };
+
+    if (usernameInput) {
+        usernameInput.addEventListener("input", () => {
+            clearTimeout(probeTimer);
+            const username = usernameInput.value.trim();
+            if (username.length < 3) {
+                probeSeq++;
+                return showUsernameStatus("");
+            }
+            probeTimer = setTimeout(() => probeUsername(username), 400);
+        });
+    }
+
     if (registerForm) {
         registerForm.addEventListener("submit", (e) => {
             e.preventDefault();
@@ -0,0 +1,79 @@
+"""
+JWT authentication that keeps the user query off the hot path.
+
+GET/HEAD/OPTIONS requests carrying a claims token (see tokens.py) get a
+TokenUser built from the claims, so role and approval permission checks
+never touch the database. That needs a cache every worker shares: with a
+process-local one a revocation or deactivation elsewhere would go unseen
+for the token's lifetime, so those requests load the user like the rest. Other requests, and tokens issued before claims
+existed, get the full user (with its dealer profile) from the cache,
+loaded at most once per AUTH_USER_CACHE_TIMEOUT. signals.py drops the
+cached copy whenever the User or its DealerProfile is saved or deleted;
+bulk updates call ``invalidate_cached_users`` themselves.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+
+from config.accounts.models import TokenUser, User
+from config.accounts.tokens import CLAIM_FIELDS, cache_is_shared, is_revoked
+
+USER_CACHE_KEY = 'auth:user:{}'
+
+
+def get_cached_user(user_id):
+    key = USER_CACHE_KEY.format(user_id)
+    user = cache.get(key)
+    if user is None:
+        user = User.objects.select_related('dealer_profile').filter(pk=user_id).first()
+        if user is not None:
+            cache.set(key, user, getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 60))
+    return user
+
+
+def invalidate_cached_user(user_id):
+    cache.delete(USER_CACHE_KEY.format(user_id))
+
+
+def invalidate_cached_users(user_ids):
+    """Drop cached users after their rows (or profiles) were changed with
+    queryset.update(), which the signals don't see; runs after commit"""
+    keys = [USER_CACHE_KEY.format(user_id) for user_id in user_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+
+    def authenticate(self, request):
+        self._read_only = request.method in SAFE_METHODS
+        return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        if is_revoked(validated_token):
+            raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+        if (getattr(self, '_read_only', False) and cache_is_shared()
+                and all(claim in validated_token for claim in CLAIM_FIELDS)):
+            return self.token_user(validated_token)
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            return super().get_user(validated_token)
+        user = get_cached_user(user_id)
+        if user is None:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return user
+
+    @staticmethod
+    def token_user(token):
+        values = {field: token[field] for field in CLAIM_FIELDS}
+        values.update(id=token[api_settings.USER_ID_CLAIM], is_active=True)
+        fields = [f.attname for f in TokenUser._meta.concrete_fields if f.attname in values]
+        return TokenUser.from_db(None, fields, [values[name] for name in fields])
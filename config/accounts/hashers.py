@@ -0,0 +1,18 @@
+"""
+Password hashers.
+
+PBKDF2PasswordHasher is Django's PBKDF2-SHA256 hasher with the work factor
+taken from PASSWORD_HASH_ITERATIONS, so it can be tuned per deployment
+(``manage.py bench_login`` shows the CPU cost per login). Stored hashes
+made with another iteration count or another hasher are re-encoded on the
+user's next successful login (see login.py).
+"""
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+
+    @property
+    def iterations(self):
+        return getattr(settings, 'PASSWORD_HASH_ITERATIONS', None) or hashers.PBKDF2PasswordHasher.iterations
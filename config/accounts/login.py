@@ -0,0 +1,101 @@
+"""
+Password checks for the login endpoint.
+
+Hashing is deliberately expensive, so a burst of login attempts (or a
+credential-stuffing run) could otherwise tie up every worker thread in
+PBKDF2. Here the user is looked up on the request thread, but the hash is
+computed in a small shared thread pool (hashlib releases the GIL while it
+works). At most LOGIN_MAX_CONCURRENT_HASHES checks may be running or
+queued per process; a request that can't get a slot within
+LOGIN_HASH_WAIT_SECONDS is turned away with LoginBusy instead of piling up.
+Unknown usernames still pay for one hash so response times don't reveal
+which accounts exist.
+
+After a successful check, a hash stored with another hasher or work
+factor is re-encoded with the preferred one (the first of
+PASSWORD_HASHERS).
+
+Attempts are rate limited before any of this by the token buckets in
+throttles.py.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model, user_login_failed
+from django.contrib.auth.hashers import check_password, get_hasher, identify_hasher, make_password
+
+User = get_user_model()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class LoginBusy(Exception):
+    """Every hashing slot is taken"""
+
+
+def _limits():
+    return (
+        getattr(settings, 'LOGIN_HASH_WORKERS', 4),
+        getattr(settings, 'LOGIN_MAX_CONCURRENT_HASHES', 16),
+    )
+
+
+def _get_pool():
+    """(executor, slots) sized from the current settings"""
+    global _pool
+    with _pool_lock:
+        limits = _limits()
+        if _pool is None or _pool[0] != limits:
+            workers, max_concurrent = limits
+            _pool = (
+                limits,
+                ThreadPoolExecutor(max_workers=workers, thread_name_prefix='login-hash'),
+                threading.BoundedSemaphore(max_concurrent),
+            )
+        return _pool[1], _pool[2]
+
+
+def run_hasher(func, *args):
+    """Run a hashing call in the login pool; raises LoginBusy when saturated"""
+    executor, slots = _get_pool()
+    wait = getattr(settings, 'LOGIN_HASH_WAIT_SECONDS', 2)
+    if not slots.acquire(timeout=wait):
+        raise LoginBusy
+    try:
+        return executor.submit(func, *args).result()
+    finally:
+        slots.release()
+
+
+def needs_upgrade(encoded):
+    """True if `encoded` wasn't made by the preferred hasher with its current settings"""
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        return False
+    preferred = get_hasher()
+    return hasher.algorithm != preferred.algorithm or preferred.must_update(encoded)
+
+
+def authenticate_credentials(request, username, password):
+    """The active user matching `username`/`password`, or None"""
+    user = User._default_manager.filter(**{User.USERNAME_FIELD: username}).first()
+    if user is None or not user.has_usable_password():
+        # Same cost as a real check (see ModelBackend.authenticate)
+        run_hasher(make_password, password)
+        valid = False
+    else:
+        valid = run_hasher(check_password, password, user.password)
+
+    if not valid or not user.is_active:
+        user_login_failed.send(
+            sender=__name__, credentials={'username': username}, request=request
+        )
+        return None
+
+    if needs_upgrade(user.password):
+        user.password = run_hasher(make_password, password)
+        user.save(update_fields=['password'])
+    return user
@@ -0,0 +1,82 @@
+"""
+CPU cost of logging in.
+
+Reports wall time and CPU per login through the login endpoint for each
+PBKDF2 work factor given, then fires a burst of concurrent password checks
+at the login hashing pool to show how many are served and how many are
+turned away once LOGIN_MAX_CONCURRENT_HASHES is reached.
+Usage: python manage.py bench_login --iterations 20 --work-factors 600000,260000 --burst 64
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+
+from config.accounts import login
+from config.accounts.hashers import PBKDF2PasswordHasher
+from config.benchmarks import rolled_back, measure
+
+User = get_user_model()
+
+PASSWORD = 'bench-login-password'
+
+
+class Command(BaseCommand):
+    help = 'Measure CPU per login and the login hashing pool under a burst'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--work-factors', default='', help='Comma-separated PBKDF2 iteration counts')
+        parser.add_argument('--burst', type=int, default=64, help='Concurrent password checks')
+
+    def handle(self, *args, **options):
+        factors = [int(f) for f in options['work_factors'].split(',') if f] or [PBKDF2PasswordHasher().iterations]
+        # Throttling would cut the run short
+        with override_settings(LOGIN_THROTTLE={}), rolled_back():
+            for factor in factors:
+                with override_settings(PASSWORD_HASH_ITERATIONS=factor):
+                    self._endpoint(factor, options['iterations'])
+            self._burst(options['burst'])
+
+    def _endpoint(self, factor, iterations):
+        User.objects.filter(username='bench_login').delete()
+        User.objects.create_user(username='bench_login', password=PASSWORD)
+        client = Client()
+        cache.clear()
+
+        def run():
+            response = client.post('/api/auth/login/', {'username': 'bench_login', 'password': PASSWORD})
+            assert response.status_code == 200, response.status_code
+
+        wall, cpu, rate = measure(run, iterations)
+        self.stdout.write(
+            f'pbkdf2 {factor:>8} iterations  {wall / iterations * 1000:7.1f} ms/login  '
+            f'cpu {cpu / iterations * 1000:7.1f} ms/login  {rate:6.1f} logins/s'
+        )
+
+    def _burst(self, size):
+        encoded = make_password(PASSWORD)
+        outcomes = {'ok': 0, 'busy': 0}
+
+        def attempt(_):
+            try:
+                login.run_hasher(check_password, PASSWORD, encoded)
+                return 'ok'
+            except login.LoginBusy:
+                return 'busy'
+
+        def run():
+            with ThreadPoolExecutor(max_workers=size) as clients:
+                for outcome in clients.map(attempt, range(size)):
+                    outcomes[outcome] += 1
+
+        wall, cpu, _ = measure(run, 1)
+        workers, max_concurrent = login._limits()
+        self.stdout.write(
+            f'burst of {size} ({workers} workers, {max_concurrent} slots): '
+            f'{outcomes["ok"]} checked, {outcomes["busy"]} turned away in {wall:.2f}s, '
+            f'cpu {cpu / max(outcomes["ok"], 1) * 1000:.1f} ms/check'
+        )
@@ -0,0 +1,64 @@
+"""
+Throughput of the subscription auto-renewal job.
+
+Seeds dealers whose plans end within the renewal window (a tenth of them
+without enough balance), runs renew_subscriptions over them and
+extrapolates the time a nightly run over 100k renewals would take.
+Usage: python manage.py bench_renewals --dealers 5000 --batch-size 500
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from config.accounts import provisioning
+from config.accounts.models import DealerProfile, EGPWallet, SubscriptionPlan
+from config.accounts.subscriptions import renew_subscriptions
+from config.benchmarks import rolled_back, measure
+
+TARGET = 100000
+
+
+class Command(BaseCommand):
+    help = 'Measure renewals/s of renew_subscriptions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dealers', type=int, default=5000)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        dealers = options['dealers']
+        with rolled_back():
+            plan, _ = SubscriptionPlan.objects.get_or_create(
+                name='pro', defaults={'price_egp': Decimal('100.00'), 'max_products': 50}
+            )
+            rows = ({'username': f'bench_renew_{i}', 'role': 'dealer'} for i in range(dealers))
+            for _ in provisioning.bulk_provision(rows, batch_size=2000):
+                pass
+            profiles = DealerProfile.objects.filter(user__username__startswith='bench_renew_')
+            profiles.update(
+                subscription_plan=plan, auto_renew=True,
+                subscription_end_date=timezone.now() + timedelta(hours=1),
+            )
+            user_ids = list(profiles.values_list('user_id', flat=True))
+            EGPWallet.objects.bulk_create([
+                EGPWallet(user_id=user_id, balance=Decimal('10.00') if n % 10 == 0 else Decimal('500.00'))
+                for n, user_id in enumerate(user_ids)
+            ], batch_size=2000)
+
+            outcome = {'renewed': 0, 'failed': 0}
+
+            def run():
+                for renewed, failed in renew_subscriptions(batch_size=options['batch_size']):
+                    outcome['renewed'] += renewed
+                    outcome['failed'] += failed
+
+            wall, cpu, _ = measure(run, 1)
+            processed = outcome['renewed'] + outcome['failed']
+            rate = processed / wall if wall else float('inf')
+            self.stdout.write(
+                f'{outcome["renewed"]} renewed, {outcome["failed"]} could not pay in {wall:.2f}s '
+                f'(cpu {cpu:.2f}s): {rate:,.0f} dealers/s, '
+                f'~{TARGET / rate / 60:.1f} min for {TARGET:,}'
+            )
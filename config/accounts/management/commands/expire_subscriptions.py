@@ -0,0 +1,24 @@
+"""
+End dealer subscriptions past their end date and suspend listings over the
+free tier. Schedule it (cron, systemd timer) hourly:
+    0 * * * * python manage.py expire_subscriptions
+"""
+from django.core.management.base import BaseCommand
+
+from config.accounts.subscriptions import expire_subscriptions
+
+
+class Command(BaseCommand):
+    help = 'Expire lapsed dealer subscriptions in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        dealers = suspended = 0
+        for batch_dealers, batch_suspended in expire_subscriptions(batch_size=options['batch_size']):
+            dealers += batch_dealers
+            suspended += batch_suspended
+        self.stdout.write(self.style.SUCCESS(
+            f'Expired {dealers} subscriptions, suspended {suspended} listings'
+        ))
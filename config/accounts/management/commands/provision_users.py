@@ -0,0 +1,52 @@
+"""
+Import users from a CSV file.
+
+Columns: username, email, first_name, last_name, role, password,
+phone_number, address (only username is required). Users are inserted with
+their dealer profiles in batches; existing usernames are skipped and rows
+without a password get an unusable one.
+Usage: python manage.py provision_users users.csv --batch-size 1000 --hash-workers 4
+"""
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from config.accounts.provisioning import bulk_provision
+
+COLUMNS = ('username', 'email', 'first_name', 'last_name', 'role', 'password', 'phone_number', 'address')
+
+
+class Command(BaseCommand):
+    help = 'Bulk-create users and dealer profiles from a CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--hash-workers', type=int, default=4, help='Threads hashing passwords')
+
+    def handle(self, *args, **options):
+        try:
+            fh = open(options['path'], newline='', encoding='utf-8')
+        except OSError as exc:
+            raise CommandError(exc)
+        with fh:
+            reader = csv.DictReader(fh)
+            if 'username' not in (reader.fieldnames or ()):
+                raise CommandError('CSV needs a username column')
+            rows = (self._row(line, number) for number, line in enumerate(reader, start=2))
+
+            created = skipped = 0
+            for batch_created, batch_skipped in bulk_provision(rows, options['batch_size'], options['hash_workers']):
+                created += batch_created
+                skipped += batch_skipped
+                self.stdout.write(f'{created} created, {skipped} skipped')
+        self.stdout.write(self.style.SUCCESS(f'Imported {created} users ({skipped} skipped)'))
+
+    def _row(self, line, number):
+        row = {column: (line.get(column) or '').strip() for column in COLUMNS if column in line}
+        if not row.get('username'):
+            raise CommandError(f'Line {number}: username is required')
+        row['role'] = row.get('role') or 'client'
+        if row['role'] not in ('client', 'dealer'):
+            raise CommandError(f"Line {number}: role must be client or dealer, not {row['role']!r}")
+        return row
@@ -0,0 +1,27 @@
+"""
+Delete delivered outbound email.
+
+Sent, skipped and failed OutboundEmail rows are kept for
+EMAIL_OUTBOX_RETENTION_DAYS (or --days) after their last attempt, then
+removed in bounded batches so the queue table stays small.
+Schedule it daily:
+    15 4 * * * python manage.py prune_outbox --batch-size 1000
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from config.accounts.outbox import prune_finished
+
+
+class Command(BaseCommand):
+    help = 'Delete sent, skipped and failed queued emails past their retention, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Retention (default EMAIL_OUTBOX_RETENTION_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        retention = timedelta(days=options['days']) if options['days'] is not None else None
+        count = sum(prune_finished(retention, options['batch_size']))
+        self.stdout.write(self.style.SUCCESS(f'Pruned {count} queued emails'))
@@ -0,0 +1,23 @@
+"""
+Delete expired JWT bookkeeping rows.
+
+Outstanding and blacklisted refresh tokens are only useful until they
+expire; this removes expired ones in bounded batches so the job never holds
+long locks on the tables refresh and logout use.
+Schedule it daily:
+    0 4 * * * python manage.py prune_tokens --batch-size 1000
+"""
+from django.core.management.base import BaseCommand
+
+from config.accounts.tokens import prune_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete expired outstanding and blacklisted refresh tokens in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = sum(prune_expired(options['batch_size']))
+        self.stdout.write(self.style.SUCCESS(f'Pruned {count} expired tokens'))
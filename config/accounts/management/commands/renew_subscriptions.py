@@ -0,0 +1,27 @@
+"""
+Renew auto_renew dealer subscriptions ending within the renewal window from
+their EGP wallets. Schedule it nightly, ahead of expire_subscriptions:
+    0 2 * * * python manage.py renew_subscriptions
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from config.accounts.subscriptions import renew_subscriptions
+
+
+class Command(BaseCommand):
+    help = 'Charge and extend subscriptions due for renewal, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--window-hours', type=int, default=None,
+                            help='Default: SUBSCRIPTION_RENEWAL_WINDOW_HOURS')
+
+    def handle(self, *args, **options):
+        window = timedelta(hours=options['window_hours']) if options['window_hours'] else None
+        renewed = failed = 0
+        for batch_renewed, batch_failed in renew_subscriptions(window=window, batch_size=options['batch_size']):
+            renewed += batch_renewed
+            failed += batch_failed
+        self.stdout.write(self.style.SUCCESS(f'Renewed {renewed} subscriptions, {failed} could not pay'))
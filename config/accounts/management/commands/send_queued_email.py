@@ -0,0 +1,37 @@
+"""
+Deliver the outbound email queue.
+
+Sends due OutboundEmail rows in batches over one SMTP connection per batch
+and reschedules failures with backoff. Run it from cron, or keep it
+running with --loop:
+    * * * * * python manage.py send_queued_email --batch-size 100
+    python manage.py send_queued_email --loop --interval 5
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from config.accounts import outbox
+
+
+class Command(BaseCommand):
+    help = 'Send queued emails (password reset, verification, notifications)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help='Keep polling the queue')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            totals = {}
+            for counts in outbox.drain(options['batch_size']):
+                for outcome, count in counts.items():
+                    totals[outcome] = totals.get(outcome, 0) + count
+            if totals:
+                self.stdout.write(', '.join(f'{count} {outcome}' for outcome, count in totals.items()))
+            if not options['loop']:
+                return
+            close_old_connections()
+            time.sleep(options['interval'])
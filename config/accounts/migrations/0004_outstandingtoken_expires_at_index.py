@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Index token_blacklist's expires_at so prune_tokens finds expired rows without a scan"""
+
+    dependencies = [
+        ('accounts', '0003_tokenuser'),
+        ('token_blacklist', '0013_alter_blacklistedtoken_options_and_more'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS token_blacklist_outstandingtoken_expires_at '
+            'ON token_blacklist_outstandingtoken (expires_at)',
+            'DROP INDEX IF EXISTS token_blacklist_outstandingtoken_expires_at',
+        ),
+    ]
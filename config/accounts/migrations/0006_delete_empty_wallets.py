@@ -0,0 +1,21 @@
+from decimal import Decimal
+
+from django.db import migrations
+
+
+def delete_empty_wallets(apps, schema_editor):
+    # Wallets are now created by the first credit; a zero-balance row says
+    # nothing a missing one doesn't
+    for name in ('EGPWallet', 'GoldWallet', 'MassWallet'):
+        apps.get_model('accounts', name).objects.filter(balance=Decimal('0.00')).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_outboundemail'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_empty_wallets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:42
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.functions.text
+
+
+def check_duplicate_emails(apps, schema_editor):
+    # Fail with the offending addresses rather than a bare IntegrityError;
+    # they have to be merged or changed by hand before the index can exist
+    User = apps.get_model('accounts', 'User')
+    duplicates = list(
+        User.objects.exclude(email='')
+        .values(email_key=django.db.models.functions.text.Lower('email'))
+        .annotate(n=Count('pk')).filter(n__gt=1)
+        .values_list('email_key', flat=True)[:20]
+    )
+    if duplicates:
+        raise RuntimeError(
+            'Email addresses used by more than one account (case-insensitive): ' + ', '.join(duplicates)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_delete_empty_wallets'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_emails, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='user',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('email'), condition=models.Q(('email', ''), _negated=True), name='accounts_user_email_ci_unique'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:46
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_active_products(apps, schema_editor):
+    DealerProfile = apps.get_model('accounts', 'DealerProfile')
+    Product = apps.get_model('products', 'Product')
+    approved = (
+        Product.objects.filter(dealer_id=OuterRef('user_id'), status='approved')
+        .order_by().values('dealer_id').annotate(n=Count('pk')).values('n')
+    )
+    DealerProfile.objects.update(active_products=Coalesce(Subquery(approved), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_email_ci_unique'),
+        ('products', '0009_productimage_position'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dealerprofile',
+            name='active_products',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_active_products, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_dealerprofile_active_products'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dealerprofile',
+            index=models.Index(condition=models.Q(('subscription_plan__isnull', False)), fields=['subscription_end_date'], name='dealer_subscription_due_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0009_dealer_subscription_due_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dealerprofile',
+            name='auto_renew',
+            field=models.BooleanField(default=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 07:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0010_dealerprofile_auto_renew'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='tokens_revoked_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
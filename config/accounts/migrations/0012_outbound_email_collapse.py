@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-19 07:32
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+def drop_duplicate_pending(apps, schema_editor):
+    # Keep the oldest unsent row per recipient and kind; the rest would
+    # have sent the same mail again
+    OutboundEmail = apps.get_model('accounts', 'OutboundEmail')
+    pending = OutboundEmail.objects.filter(
+        kind__in=('password_reset', 'email_verification'), status='pending', attempts=0
+    ).order_by('pk')
+    seen = set()
+    duplicates = []
+    for pk, kind, to_email in pending.values_list('pk', 'kind', 'to_email').iterator():
+        key = (kind, to_email.lower())
+        if key in seen:
+            duplicates.append(pk)
+        else:
+            seen.add(key)
+    for start in range(0, len(duplicates), 1000):
+        OutboundEmail.objects.filter(pk__in=duplicates[start:start + 1000]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0011_user_tokens_revoked_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_pending, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='outboundemail',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('to_email'), models.F('kind'), condition=models.Q(('attempts', 0), ('kind__in', ('password_reset', 'email_verification')), ('status', 'pending')), name='accounts_outbound_one_pending_per_recipient'),
+        ),
+    ]
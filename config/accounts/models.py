@@ -1,7 +1,9 @@
 from django.db import models
+from django.db.models.functions import Lower
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
 from django.db import transaction
+from django.utils import timezone
 from decimal import Decimal
 
 class User(AbstractUser):
@@ -17,17 +19,46 @@ class User(AbstractUser):
     email_verified = models.BooleanField(default=False)
     is_approved = models.BooleanField(default=True)  # For dealers, admin approval
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
+    # Tokens issued before this are rejected (see config/accounts/tokens.py)
+    tokens_revoked_at = models.DateTimeField(null=True, blank=True, editable=False)
     
     class Meta:
         indexes = [
             models.Index(fields=['role']),
             models.Index(fields=['is_approved']),
         ]
+        constraints = [
+            # Registration relies on this instead of looking the address up
+            models.UniqueConstraint(
+                Lower('email'), name='accounts_user_email_ci_unique', condition=~models.Q(email=''),
+            ),
+        ]
     
     def __str__(self):
         return f"{self.username} ({self.get_role_display()})"
 
 
+class TokenUser(User):
+    """User built from JWT claims; everything else loads on first access"""
+
+    class Meta:
+        proxy = True
+
+    def refresh_from_db(self, using=None, fields=None):
+        if fields is not None:
+            # Loading a deferred field: take every field the token didn't
+            # carry from the cached user instead of one query per field
+            from config.accounts.authentication import get_cached_user
+            cached = get_cached_user(self.pk)
+            if cached is not None:
+                for attname in self.get_deferred_fields():
+                    self.__dict__[attname] = cached.__dict__[attname]
+                if 'dealer_profile' in cached._state.fields_cache:
+                    self._state.fields_cache['dealer_profile'] = cached._state.fields_cache['dealer_profile']
+                return
+        super().refresh_from_db(using, fields)
+
+
 class SubscriptionPlan(models.Model):
     """Subscription plans for dealers - EGP based"""
     PLAN_CHOICES = (
@@ -61,27 +92,52 @@ class DealerProfile(models.Model):
     subscription_plan = models.ForeignKey(SubscriptionPlan, on_delete=models.SET_NULL, null=True, blank=True)
     subscription_start_date = models.DateTimeField(null=True, blank=True)
     subscription_end_date = models.DateTimeField(null=True, blank=True)
+    # Renewed from the EGP wallet by renew_subscriptions before it runs out
+    auto_renew = models.BooleanField(default=True)
     products_published = models.PositiveIntegerField(default=0)
+    # Approved products right now; maintained by config/products/quota.py
+    active_products = models.PositiveIntegerField(default=0, editable=False)
     has_used_free_product = models.BooleanField(default=False)  # Track if free product used
     rating = models.DecimalField(max_digits=3, decimal_places=2, default=Decimal('0.00'))
     total_sales = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            # expire_subscriptions scans only dealers still holding a plan
+            models.Index(
+                fields=['subscription_end_date'], name='dealer_subscription_due_idx',
+                condition=models.Q(subscription_plan__isnull=False),
+            ),
+        ]
+    
     def is_subscription_active(self):
         """Check if current subscription is valid"""
-        if not self.subscription_end_date:
+        # expire_subscriptions clears the plan once the end date has passed
+        if not self.subscription_plan_id or not self.subscription_end_date:
             return False
         from django.utils import timezone
         return timezone.now() <= self.subscription_end_date
     
+    def save(self, *args, **kwargs):
+        # active_products only moves through relative UPDATEs; writing back
+        # the value this instance loaded would undo concurrent transitions
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'active_products'
+            ]
+        super().save(*args, **kwargs)
+    
+    def get_plan(self):
+        """Current plan from the in-process registry (config/accounts/plans.py)"""
+        from config.accounts import plans
+        return plans.get(self.subscription_plan_id)
+    
     def get_active_product_count(self):
         """Get count of active published products"""
-        from config.products.models import Product
-        return Product.objects.filter(
-            dealer=self.user,
-            status='approved'
-        ).count()
+        return self.active_products
     
     def can_publish_product(self):
         """Check if dealer can publish a new product"""
@@ -90,16 +146,17 @@ class DealerProfile(models.Model):
             return True, "Free first product available"
         
         # After first product, need active subscription
-        if not self.subscription_plan:
+        plan = self.get_plan()
+        if not plan:
             return False, "Subscription required"
         
         if not self.is_subscription_active():
             return False, "Subscription expired"
         
         active_count = self.get_active_product_count()
-        if self.subscription_plan.max_products > 0:
-            if active_count >= self.subscription_plan.max_products:
-                return False, f"Max products ({self.subscription_plan.max_products}) reached"
+        if plan.max_products > 0:
+            if active_count >= plan.max_products:
+                return False, f"Max products ({plan.max_products}) reached"
         
         return True, "Can publish"
     
@@ -153,3 +210,48 @@ class MassWallet(models.Model):
     
     def __str__(self):
         return f"{self.user.username} - {self.balance:.2f} Mass"
+
+
+class OutboundEmail(models.Model):
+    """Email waiting to be sent by `manage.py send_queued_email` (see config/accounts/outbox.py)"""
+    KIND_CHOICES = (
+        ('message', 'Message'),
+        ('password_reset', 'Password reset'),
+        ('email_verification', 'Email verification'),
+    )
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('skipped', 'Skipped'),
+        ('failed', 'Failed'),
+    )
+    
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES, default='message')
+    to_email = models.EmailField()
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # Pending: not before this. Sending: the worker's lease runs out at this.
+    send_after = models.DateTimeField(default=timezone.now)
+    claim_id = models.UUIDField(null=True, blank=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['send_after']
+        indexes = [
+            models.Index(fields=['status', 'send_after']),
+        ]
+        constraints = [
+            # Asking for a reset or verification mail again before the
+            # first went out adds nothing (see outbox.COLLAPSED_KINDS)
+            models.UniqueConstraint(
+                Lower('to_email'), 'kind', name='accounts_outbound_one_pending_per_recipient',
+                condition=models.Q(kind__in=('password_reset', 'email_verification'), status='pending', attempts=0),
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} to {self.to_email} ({self.status})"
@@ -0,0 +1,227 @@
+"""
+Outbound email queue.
+
+Requests never talk to SMTP. They add an OutboundEmail row (in their own
+transaction, so mail for work that rolls back is never sent) and
+``manage.py send_queued_email`` delivers the queue in batches over one
+connection:
+
+* rows are claimed with a lease, so several workers can drain the queue
+  and a worker that dies mid-batch only delays its rows until the lease
+  runs out;
+* a failed send is retried with exponential backoff up to
+  EMAIL_OUTBOX_MAX_ATTEMPTS, then left as ``failed``.
+
+Password reset rows carry only the address the user typed. The account is
+looked up when the mail is rendered by the worker, so the endpoint does
+the same single INSERT whether or not the address belongs to anyone.
+Reset and verification mail is collapsed to one unsent row per recipient
+by a partial unique index, so repeating the request before the worker
+runs adds nothing.
+
+``prune_finished`` (``manage.py prune_outbox``) deletes sent, skipped and
+failed rows past EMAIL_OUTBOX_RETENTION_DAYS in batches.
+"""
+from datetime import timedelta
+import uuid
+
+from django.conf import settings
+from django.core import mail, signing
+from django.contrib.auth.tokens import default_token_generator
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from config.accounts.models import OutboundEmail, User
+
+VERIFY_EMAIL_SALT = 'email-verify'
+
+# At most one unsent row per recipient (see OutboundEmail.Meta.constraints)
+COLLAPSED_KINDS = ('password_reset', 'email_verification')
+FINISHED_STATUSES = ('sent', 'skipped', 'failed')
+
+
+def enqueue(kind, to_email, **payload):
+    email = OutboundEmail(kind=kind, to_email=to_email, payload=payload)
+    if kind in COLLAPSED_KINDS:
+        # Still one INSERT; a duplicate of a pending row is dropped
+        OutboundEmail.objects.bulk_create([email], ignore_conflicts=True)
+        return email
+    email.save()
+    return email
+
+
+def queue_message(to_email, subject, body):
+    return enqueue('message', to_email, subject=subject, body=body)
+
+
+def queue_messages(messages):
+    """Queue (to_email, subject, body) triples with one INSERT"""
+    return OutboundEmail.objects.bulk_create([
+        OutboundEmail(kind='message', to_email=to_email, payload={'subject': subject, 'body': body})
+        for to_email, subject, body in messages
+    ])
+
+
+def queue_password_reset(email):
+    return enqueue('password_reset', email)
+
+
+def queue_email_verification(user):
+    return enqueue('email_verification', user.email, user_id=user.pk)
+
+
+def _render_message(email):
+    return [(email.payload['subject'], email.payload['body'])]
+
+
+def _render_password_reset(email):
+    messages = []
+    for user in User.objects.filter(email__iexact=email.to_email, is_active=True):
+        if not user.has_usable_password():
+            continue
+        uid = urlsafe_base64_encode(force_bytes(user.pk))
+        token = default_token_generator.make_token(user)
+        reset_url = f"{settings.FRONTEND_URL}/reset-password/{uid}/{token}/"
+        messages.append(("Password Reset Request", f"""
+            Hello {user.first_name},
+
+            Click the link below to reset your password:
+            {reset_url}
+
+            This link will expire in 24 hours.
+
+            Best regards,
+            {settings.PLATFORM_NAME}
+            """))
+    return messages
+
+
+def _render_email_verification(email):
+    user = User.objects.filter(pk=email.payload['user_id'], email=email.to_email).first()
+    if user is None or user.email_verified:
+        return []
+    token = signing.dumps({'user_id': user.pk}, salt=VERIFY_EMAIL_SALT)
+    verify_url = f"{settings.FRONTEND_URL}/api/auth/verify-email/{token}/"
+    return [("Verify your email address", f"""
+            Hello {user.first_name},
+
+            Confirm your email address by opening the link below:
+            {verify_url}
+
+            This link will expire in 48 hours.
+
+            Best regards,
+            {settings.PLATFORM_NAME}
+            """)]
+
+
+RENDERERS = {
+    'message': _render_message,
+    'password_reset': _render_password_reset,
+    'email_verification': _render_email_verification,
+}
+
+
+def _claimable(now):
+    # A 'sending' row whose lease ran out belongs to a worker that died
+    return Q(status__in=('pending', 'sending'), send_after__lte=now)
+
+
+def claim_batch(size=100, lease_seconds=None):
+    """Lease up to `size` due emails to this worker; returns the claimed rows"""
+    lease_seconds = lease_seconds or getattr(settings, 'EMAIL_OUTBOX_LEASE_SECONDS', 300)
+    now = timezone.now()
+    claim_id = uuid.uuid4()
+    candidates = OutboundEmail.objects.filter(_claimable(now)).order_by('send_after')
+
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            ids = list(candidates.select_for_update(skip_locked=True).values_list('pk', flat=True)[:size])
+        else:
+            ids = candidates.values('pk')[:size]
+        OutboundEmail.objects.filter(_claimable(now), pk__in=ids).update(
+            status='sending', claim_id=claim_id, send_after=now + timedelta(seconds=lease_seconds)
+        )
+    return list(OutboundEmail.objects.filter(claim_id=claim_id, status='sending').order_by('pk'))
+
+
+def _retry_delay(attempts):
+    base = getattr(settings, 'EMAIL_OUTBOX_RETRY_SECONDS', 60)
+    return timedelta(seconds=base * 2 ** (attempts - 1))
+
+
+def _failed(email, exc, max_attempts):
+    email.last_error = f'{type(exc).__name__}: {exc}'
+    if email.attempts >= max_attempts:
+        email.status = 'failed'
+        return 'failed'
+    email.status = 'pending'
+    email.send_after = timezone.now() + _retry_delay(email.attempts)
+    return 'retry'
+
+
+def deliver(emails):
+    """Send claimed rows over one connection; returns {outcome: count}"""
+    max_attempts = getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 5)
+    counts = {'sent': 0, 'skipped': 0, 'retry': 0, 'failed': 0}
+    if not emails:
+        return counts
+
+    smtp = mail.get_connection()
+    try:
+        smtp.open()
+    except Exception as exc:
+        smtp = None
+        connect_error = exc
+    try:
+        for email in emails:
+            email.attempts += 1
+            try:
+                if smtp is None:
+                    raise connect_error
+                messages = RENDERERS[email.kind](email)
+                smtp.send_messages([
+                    mail.EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, [email.to_email])
+                    for subject, body in messages
+                ])
+            except Exception as exc:
+                outcome = _failed(email, exc, max_attempts)
+            else:
+                outcome = email.status = 'sent' if messages else 'skipped'
+                email.sent_at = timezone.now()
+                email.last_error = ''
+            counts[outcome] += 1
+            email.claim_id = None
+            email.save(update_fields=['status', 'attempts', 'last_error', 'send_after', 'sent_at', 'claim_id'])
+    finally:
+        if smtp is not None:
+            smtp.close()
+    return counts
+
+
+def prune_finished(retention=None, batch_size=1000):
+    """Delete finished rows whose last attempt is older than `retention`; yields batch sizes"""
+    if retention is None:
+        retention = timedelta(days=getattr(settings, 'EMAIL_OUTBOX_RETENTION_DAYS', 30))
+    # send_after is the last attempt's lease or retry time; on the status index
+    finished = OutboundEmail.objects.filter(
+        status__in=FINISHED_STATUSES, send_after__lt=timezone.now() - retention
+    ).order_by()
+    while True:
+        ids = list(finished.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return
+        OutboundEmail.objects.filter(pk__in=ids).delete()
+        yield len(ids)
+
+
+def drain(batch_size=100):
+    """Deliver due email batch by batch until none is left; yields per-batch counts"""
+    while True:
+        emails = claim_batch(batch_size)
+        if not emails:
+            return
+        yield deliver(emails)
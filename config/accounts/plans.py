@@ -0,0 +1,95 @@
+"""
+In-process registry of subscription plans.
+
+There are a handful of plans and they change a few times a year, yet they
+were read on every plan listing, purchase and dealer profile render. Each
+process now loads them once, together with their serialized form and the
+rendered plan list, and keeps them until the plans change:
+
+* saving or deleting a plan bumps the ``plans:version`` counter in the
+  shared cache, right away and again after commit (a process reloading in
+  between would still have read the old rows);
+* every lookup compares the process's snapshot with that counter - one
+  cache read - and reloads on a mismatch;
+* a snapshot older than PLAN_REGISTRY_MAX_AGE seconds is reloaded anyway.
+  With a process-local cache the counter is only bumped in the process
+  that saved the plan, so that is how the other workers catch up.
+
+Plan instances handed out are shared by every request in the process;
+treat them as read-only.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from config.products.cache import bump_generation, get_generation
+
+VERSION_KEY = 'plans:version'
+
+_lock = threading.Lock()
+_snapshot = None
+
+
+class _Snapshot:
+    def __init__(self, version):
+        from rest_framework.renderers import JSONRenderer
+        from config.accounts.models import SubscriptionPlan
+        from config.accounts.serializers import SubscriptionPlanSerializer
+
+        self.version = version
+        self.loaded_at = time.monotonic()
+        plans = list(SubscriptionPlan.objects.all())
+        self.by_id = {plan.pk: plan for plan in plans}
+        self.data = {plan.pk: SubscriptionPlanSerializer(plan).data for plan in plans}
+        active = [self.data[plan.pk] for plan in plans if plan.is_active]
+        # Same shape as the paginated list endpoint; there's never a second page
+        self.active_json = JSONRenderer().render(
+            {'count': len(active), 'next': None, 'previous': None, 'results': active}
+        )
+
+
+def _stale(snapshot, version):
+    return (
+        snapshot is None or snapshot.version != version
+        or time.monotonic() - snapshot.loaded_at > getattr(settings, 'PLAN_REGISTRY_MAX_AGE', 60)
+    )
+
+
+def _current():
+    global _snapshot
+    version = get_generation(VERSION_KEY)
+    snapshot = _snapshot
+    if _stale(snapshot, version):
+        with _lock:
+            if _stale(_snapshot, version):
+                _snapshot = _Snapshot(version)
+            snapshot = _snapshot
+    return snapshot
+
+
+def get(plan_id):
+    """The plan with this id, or None"""
+    return _current().by_id.get(plan_id) if plan_id is not None else None
+
+
+def get_active(plan_id):
+    plan = get(plan_id)
+    return plan if plan is not None and plan.is_active else None
+
+
+def data(plan_id):
+    """Serialized plan (SubscriptionPlanSerializer), or None"""
+    return _current().data.get(plan_id) if plan_id is not None else None
+
+
+def active_json():
+    """Rendered response body of the plan list endpoint"""
+    return _current().active_json
+
+
+def invalidate():
+    """Make every process reload the plans"""
+    bump_generation(VERSION_KEY)
+    transaction.on_commit(lambda: bump_generation(VERSION_KEY))
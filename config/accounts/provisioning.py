@@ -0,0 +1,109 @@
+"""
+Creating accounts together with their dealer profile.
+
+The post_save signal in signals.py sets up the dealer profile for dealers
+created anywhere else, with a get_or_create. The paths here write it
+themselves and mark the user so the signal stands down. Wallets aren't
+created up front at all: WalletManager creates one on its first credit.
+
+* ``create_account`` - one registration: the user and (for dealers) the
+  profile, inserted without lookups in one transaction.
+* ``bulk_provision`` - imports: users and profiles with bulk_create, a
+  batch per transaction. Passwords are hashed in a thread pool since that
+  dominates the cost; rows without a password get an unusable one (users
+  set it through password reset).
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.db.models.functions import Lower
+
+from config.accounts.models import DealerProfile, User
+
+# Set on a User instance to skip the dealer profile signal
+SKIP_SIGNALS_ATTR = '_provisioned'
+
+
+def _create_related(users):
+    dealers = [user for user in users if user.role == 'dealer']
+    if dealers:
+        DealerProfile.objects.bulk_create([DealerProfile(user=user) for user in dealers])
+
+
+@transaction.atomic
+def create_account(password, **fields):
+    """Create a user (and dealer profile) in one transaction"""
+    user = User(**_normalized(fields))
+    user.set_password(password)
+    setattr(user, SKIP_SIGNALS_ATTR, True)
+    user.save()
+    _create_related([user])
+    return user
+
+
+def _normalized(fields):
+    fields = dict(fields)
+    fields['username'] = User.normalize_username(fields['username'])
+    fields['email'] = User.objects.normalize_email(fields.get('email', ''))
+    return fields
+
+
+def _hash_all(passwords, workers):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda raw: make_password(raw or None), passwords))
+
+
+def bulk_provision(rows, batch_size=1000, hash_workers=4):
+    """Create users from dicts of User fields plus ``password``.
+
+    Rows whose username or email (ignoring case) already exists are
+    skipped. Yields (created, skipped) per batch.
+    """
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield _provision_batch(batch, hash_workers)
+            batch = []
+    if batch:
+        yield _provision_batch(batch, hash_workers)
+
+
+def _email_key(row):
+    return (row.get('email') or '').lower()
+
+
+def _provision_batch(rows, hash_workers):
+    usernames = [row['username'] for row in rows]
+    emails = [_email_key(row) for row in rows if _email_key(row)]
+    existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+    # One taken address would otherwise fail the whole bulk insert on the
+    # case-insensitive email index
+    taken = set(
+        User.objects.annotate(email_key=Lower('email'))
+        .filter(email_key__in=emails).values_list('email_key', flat=True)
+    ) if emails else set()
+    fresh = []
+    for row in rows:
+        email = _email_key(row)
+        if row['username'] not in existing and email not in taken:
+            existing.add(row['username'])
+            if email:
+                taken.add(email)
+            fresh.append(row)
+
+    passwords = _hash_all([row.get('password') for row in fresh], hash_workers)
+    users = []
+    for row, password in zip(fresh, passwords):
+        fields = _normalized({key: value for key, value in row.items() if key != 'password'})
+        fields.setdefault('is_approved', fields.get('role', 'client') != 'dealer')
+        users.append(User(password=password, **fields))
+
+    with transaction.atomic():
+        created = User.objects.bulk_create(users)
+        if created and created[0].pk is None:
+            # Backends that can't return ids from a bulk insert
+            created = list(User.objects.filter(username__in=[user.username for user in users]))
+        _create_related(created)
+    return len(created), len(rows) - len(created)
@@ -1,10 +1,15 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
 from config.accounts.models import (
     User, DealerProfile, SubscriptionPlan, 
     EGPWallet, GoldWallet, MassWallet
 )
 from config.wallet_utils import WalletManager
+from rest_framework_simplejwt import serializers as jwt_serializers
+from config.accounts import plans, provisioning
+from config.accounts.tokens import ClaimsRefreshToken
 
 User = get_user_model()
 
@@ -32,20 +37,24 @@ class WalletSerializer(serializers.Serializer):
 
 
 class DealerProfileSerializer(serializers.ModelSerializer):
-    subscription_plan = SubscriptionPlanSerializer(read_only=True)
+    subscription_plan = serializers.SerializerMethodField()
     can_publish = serializers.SerializerMethodField()
     is_subscription_active = serializers.SerializerMethodField()
     
     class Meta:
         model = DealerProfile
         fields = ('business_name', 'business_description', 'subscription_plan',
-                  'subscription_start_date', 'subscription_end_date', 'products_published',
-                  'has_used_free_product', 'rating', 'total_sales', 'can_publish',
+                  'subscription_start_date', 'subscription_end_date', 'auto_renew', 'products_published',
+                  'active_products', 'has_used_free_product', 'rating', 'total_sales', 'can_publish',
                   'is_subscription_active')
-        read_only_fields = ('products_published', 'has_used_free_product', 
+        read_only_fields = ('products_published', 'active_products', 'has_used_free_product', 
                            'rating', 'total_sales', 'subscription_start_date',
                            'subscription_end_date')
     
+    def get_subscription_plan(self, obj):
+        # Pre-serialized by the plan registry; no query per profile
+        return plans.data(obj.subscription_plan_id)
+    
     def get_can_publish(self, obj):
         can_publish, msg = obj.can_publish_product()
         return can_publish
@@ -54,7 +63,28 @@ class DealerProfileSerializer(serializers.ModelSerializer):
         return obj.is_subscription_active()
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UniqueAccountMixin:
+    """Let the database enforce unique usernames and emails.
+
+    No lookup before the write: the unique username column and the
+    case-insensitive email index (accounts_user_email_ci_unique) reject a
+    duplicate, and the IntegrityError becomes the usual 400.
+    """
+
+    def save(self, **kwargs):
+        try:
+            with transaction.atomic():
+                return super().save(**kwargs)
+        except IntegrityError as exc:
+            message = str(exc)
+            if 'email_ci_unique' in message:
+                raise serializers.ValidationError({'email': ["Email already registered"]})
+            if 'username' in message:
+                raise serializers.ValidationError({'username': ["Username already exists"]})
+            raise
+
+
+class UserSerializer(UniqueAccountMixin, serializers.ModelSerializer):
     """Comprehensive user serializer"""
     dealer_profile = DealerProfileSerializer(read_only=True)
     wallet = WalletSerializer(source='*', read_only=True)
@@ -65,9 +95,10 @@ class UserSerializer(serializers.ModelSerializer):
                   'phone_number', 'address', 'email_verified', 'is_approved',
                   'created_at', 'dealer_profile', 'wallet')
         read_only_fields = ('id', 'created_at', 'is_approved', 'email_verified', 'role')
+        extra_kwargs = {'username': {'validators': []}}
 
 
-class UserDetailSerializer(serializers.ModelSerializer):
+class UserDetailSerializer(UniqueAccountMixin, serializers.ModelSerializer):
     """User details with wallet info"""
     wallet = WalletSerializer(source='*', read_only=True)
     dealer_profile = DealerProfileSerializer(read_only=True)
@@ -80,7 +111,7 @@ class UserDetailSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'username', 'created_at', 'role')
 
 
-class RegisterSerializer(serializers.ModelSerializer):
+class RegisterSerializer(UniqueAccountMixin, serializers.ModelSerializer):
     """User registration serializer"""
     password = serializers.CharField(
         write_only=True,
@@ -106,18 +137,10 @@ class RegisterSerializer(serializers.ModelSerializer):
             'first_name': {'required': True},
             'last_name': {'required': True},
             'email': {'required': True},
+            # Checked by the database on insert (UniqueAccountMixin)
+            'username': {'validators': []},
         }
 
-    def validate_username(self, value):
-        if User.objects.filter(username=value).exists():
-            raise serializers.ValidationError("Username already exists")
-        return value
-
-    def validate_email(self, value):
-        if User.objects.filter(email=value).exists():
-            raise serializers.ValidationError("Email already registered")
-        return value
-
     def validate(self, data):
         if data['password'] != data['password2']:
             raise serializers.ValidationError({"password": "Password fields didn't match"})
@@ -125,7 +148,8 @@ class RegisterSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         validated_data.pop('password2')
-        user = User.objects.create_user(
+        # The dealer profile is inserted along with the user
+        user = provisioning.create_account(
             username=validated_data['username'],
             email=validated_data['email'],
             password=validated_data['password'],
@@ -137,16 +161,35 @@ class RegisterSerializer(serializers.ModelSerializer):
             is_approved=True if validated_data.get('role') == 'client' else False
         )
         
-        # Create wallets for user
-        WalletManager.get_or_create_wallets(user)
-        
-        # Create dealer profile if user is dealer
-        if validated_data.get('role') == 'dealer':
-            DealerProfile.objects.create(user=user)
-        
         return user
 
 
+class ProvisionUserSerializer(serializers.ModelSerializer):
+    """One row of a bulk import (see config/accounts/provisioning.py)"""
+    password = serializers.CharField(write_only=True, required=False, allow_blank=True, min_length=8)
+    role = serializers.ChoiceField(choices=['client', 'dealer'], default='client')
+
+    class Meta:
+        model = User
+        fields = ('username', 'email', 'password', 'first_name', 'last_name',
+                  'phone_number', 'address', 'role')
+        # Existing usernames are skipped by the import, not rejected
+        extra_kwargs = {'username': {'validators': []}}
+
+
+class BulkProvisionSerializer(serializers.Serializer):
+    users = ProvisionUserSerializer(many=True, allow_empty=False)
+
+    def validate_users(self, users):
+        # Every password is hashed before the response goes out
+        limit = getattr(settings, 'BULK_PROVISION_MAX_USERS', 200)
+        if len(users) > limit:
+            raise serializers.ValidationError(
+                f'At most {limit} users per request; import more with manage.py provision_users'
+            )
+        return users
+
+
 class LoginSerializer(serializers.Serializer):
     """User login serializer"""
     username = serializers.CharField(required=True)
@@ -182,7 +225,7 @@ class PasswordResetConfirmSerializer(serializers.Serializer):
         return data
 
 
-class UserUpdateSerializer(serializers.ModelSerializer):
+class UserUpdateSerializer(UniqueAccountMixin, serializers.ModelSerializer):
     """Update user profile information"""
     class Meta:
         model = User
@@ -201,3 +244,8 @@ class PasswordResetConfirmSerializer(serializers.Serializer):
         if data['new_password'] != data['new_password2']:
             raise serializers.ValidationError({"new_password": "Password fields didn't match."})
         return data
+
+
+class TokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    """Refresh with the cached blacklist check (see config/accounts/tokens.py)"""
+    token_class = ClaimsRefreshToken
@@ -1,26 +1,48 @@
 """
 Django signals for automatic initialization
 """
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
-from config.accounts.models import EGPWallet, GoldWallet, MassWallet, DealerProfile
+from config.accounts.models import DealerProfile, SubscriptionPlan, TokenUser
+from config.accounts import plans
+from config.accounts.authentication import invalidate_cached_user
+from config.accounts.provisioning import SKIP_SIGNALS_ATTR
+from config.accounts.tokens import remember_blacklisted
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
 from decimal import Decimal
 
 User = get_user_model()
 
 
-@receiver(post_save, sender=User)
-def create_user_wallets(sender, instance, created, **kwargs):
-    """Create wallets when user is created"""
-    if created:
-        EGPWallet.objects.get_or_create(user=instance)
-        GoldWallet.objects.get_or_create(user=instance)
-        MassWallet.objects.get_or_create(user=instance)
-
-
 @receiver(post_save, sender=User)
 def create_dealer_profile(sender, instance, created, **kwargs):
     """Create dealer profile when dealer user is created"""
-    if created and instance.role == 'dealer':
+    if created and instance.role == 'dealer' and not getattr(instance, SKIP_SIGNALS_ATTR, False):
         DealerProfile.objects.get_or_create(user=instance)
+
+
+@receiver([post_save, post_delete], sender=User)
+@receiver([post_save, post_delete], sender=TokenUser)
+def invalidate_user_cache(sender, instance, **kwargs):
+    """Drop the cached authenticated user (see config/accounts/authentication.py)"""
+    invalidate_cached_user(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=DealerProfile)
+def invalidate_dealer_user_cache(sender, instance, **kwargs):
+    """The cached user carries its dealer profile"""
+    invalidate_cached_user(instance.user_id)
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def cache_blacklisted_token(sender, instance, created, **kwargs):
+    """Refresh/logout blacklist checks are answered from the cache (see config/accounts/tokens.py)"""
+    if created:
+        remember_blacklisted([instance.token])
+
+
+@receiver([post_save, post_delete], sender=SubscriptionPlan)
+def reload_plans(sender, instance, **kwargs):
+    """Have every process rebuild its plan registry (see config/accounts/plans.py)"""
+    plans.invalidate()
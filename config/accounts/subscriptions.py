@@ -0,0 +1,224 @@
+"""
+Dealer subscription lifecycle.
+
+``expire_subscriptions`` (``manage.py expire_subscriptions``, from cron)
+ends subscriptions whose ``subscription_end_date`` has passed. Each batch
+of lapsed dealers:
+
+* gets a SubscriptionTransaction with status ``expired`` recording the plan
+  and period that ended;
+* loses its plan (``subscription_plan = NULL``) in one UPDATE, which also
+  drops it from the partial index the job scans, so a run costs time in the
+  number of lapsed dealers rather than all dealers;
+* keeps at most LAPSED_DEALER_PRODUCT_LIMIT approved listings (the oldest
+  published); the rest are suspended in one moderation UPDATE;
+* is told by email through the outbox.
+
+``renew_subscriptions`` (``manage.py renew_subscriptions``, nightly) renews
+``auto_renew`` subscriptions ending within the renewal window from the
+dealer's EGP wallet, a batch at a time:
+
+* wallet rows, then profile rows, are locked in user id order, the same
+  order a single purchase takes them, so batches and purchases running
+  concurrently can't deadlock;
+* balances are debited with one UPDATE per distinct plan price, the
+  Transaction and SubscriptionTransaction rows are bulk inserted and the
+  end dates are pushed back by each plan's duration in one UPDATE;
+* dealers who can't pay get a ``failed`` SubscriptionTransaction and an
+  email, and are retried on the next run until the subscription expires.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Q, When
+from django.utils import timezone
+
+from config.accounts import outbox
+from config.accounts.authentication import invalidate_cached_users
+from config.accounts.models import DealerProfile, EGPWallet
+
+
+def _due(now):
+    return DealerProfile.objects.filter(subscription_plan__isnull=False, subscription_end_date__lte=now)
+
+
+def _excess_listings(dealer_ids, keep):
+    from config.products.models import Product
+
+    approved = (
+        Product.objects.filter(dealer_id__in=dealer_ids, status='approved')
+        .order_by('dealer_id', 'publish_date', 'pk').values_list('pk', 'dealer_id')
+    )
+    kept = defaultdict(int)
+    excess = defaultdict(list)
+    for pk, dealer_id in approved.iterator():
+        if kept[dealer_id] < keep:
+            kept[dealer_id] += 1
+        else:
+            excess[dealer_id].append(pk)
+    return excess
+
+
+def _notice(profile, plan, suspended):
+    body = (
+        f"Hello {profile.user.first_name or profile.user.username},\n\n"
+        f"Your {plan.get_name_display()} subscription ended on "
+        f"{profile.subscription_end_date:%Y-%m-%d}.\n"
+    )
+    if suspended:
+        body += f"{suspended} of your listings were suspended to fit the free tier.\n"
+    body += f"Renew any time to publish again.\n\nBest regards,\n{settings.PLATFORM_NAME}"
+    return profile.user.email, "Your subscription has expired", body
+
+
+def _expire_batch(ids, now):
+    from config.payments.models import SubscriptionTransaction
+    from config.products import moderation
+    from config.products.models import Product
+
+    with transaction.atomic():
+        # Re-checked under lock: a renewal may have extended some meanwhile
+        profiles = list(
+            _due(now).filter(pk__in=ids).select_for_update(of=('self',))
+            .select_related('user', 'subscription_plan').order_by('pk')
+        )
+        if not profiles:
+            return 0, 0
+
+        SubscriptionTransaction.objects.bulk_create([
+            SubscriptionTransaction(
+                user_id=profile.user_id, plan=profile.subscription_plan, amount_egp=0,
+                status='expired', start_date=profile.subscription_start_date,
+                end_date=profile.subscription_end_date, completed_at=now,
+            )
+            for profile in profiles
+        ])
+        DealerProfile.objects.filter(pk__in=[profile.pk for profile in profiles]).update(
+            subscription_plan=None, updated_at=now
+        )
+        invalidate_cached_users([profile.user_id for profile in profiles])
+
+        keep = getattr(settings, 'LAPSED_DEALER_PRODUCT_LIMIT', 1)
+        excess = _excess_listings([profile.user_id for profile in profiles], keep)
+        suspended = moderation.suspend(
+            Product.objects.filter(pk__in=[pk for pks in excess.values() for pk in pks])
+        ) if excess else 0
+
+        outbox.queue_messages([
+            _notice(profile, profile.subscription_plan, len(excess.get(profile.user_id, ())))
+            for profile in profiles if profile.user.email
+        ])
+    return len(profiles), suspended
+
+
+def expire_subscriptions(now=None, batch_size=500):
+    """Expire lapsed subscriptions in batches; yields (dealers, listings suspended)"""
+    now = now or timezone.now()
+    while True:
+        ids = list(_due(now).order_by('subscription_end_date').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return
+        yield _expire_batch(ids, now)
+
+
+def _renewable(now, until):
+    return DealerProfile.objects.filter(
+        auto_renew=True, subscription_plan__isnull=False, subscription_plan__is_active=True,
+        subscription_end_date__gt=now, subscription_end_date__lte=until,
+    )
+
+
+def _renewal_failed_notice(profile, plan, balance):
+    body = (
+        f"Hello {profile.user.first_name or profile.user.username},\n\n"
+        f"We couldn't renew your {plan.get_name_display()} subscription: it costs "
+        f"{plan.price_egp} EGP and your wallet holds {balance} EGP.\n"
+        f"Top up before {profile.subscription_end_date:%Y-%m-%d} to keep your listings live.\n\n"
+        f"Best regards,\n{settings.PLATFORM_NAME}"
+    )
+    return profile.user.email, "Your subscription could not be renewed", body
+
+
+def _renew_batch(user_ids, now, until):
+    from config.payments.models import SubscriptionTransaction, Transaction
+
+    with transaction.atomic():
+        balances = dict(
+            EGPWallet.objects.select_for_update().filter(user_id__in=user_ids)
+            .order_by('user_id').values_list('user_id', 'balance')
+        )
+        # Re-checked under lock: a purchase may have moved some meanwhile
+        profiles = list(
+            _renewable(now, until).filter(user_id__in=user_ids).select_for_update(of=('self',))
+            .select_related('user', 'subscription_plan').order_by('user_id')
+        )
+        paid, unpaid = [], []
+        for profile in profiles:
+            balance = balances.get(profile.user_id, Decimal('0.00'))
+            (paid if balance >= profile.subscription_plan.price_egp else unpaid).append(profile)
+
+        by_price = defaultdict(list)
+        for profile in paid:
+            by_price[profile.subscription_plan.price_egp].append(profile.user_id)
+        for price, ids in by_price.items():
+            EGPWallet.objects.filter(user_id__in=ids).update(balance=F('balance') - price, updated_at=now)
+
+        payments = Transaction.objects.bulk_create([
+            Transaction(
+                user_id=profile.user_id, transaction_type='subscription', currency='egp',
+                amount=profile.subscription_plan.price_egp, status='completed', completed_at=now,
+                description=f"Subscription renewal: {profile.subscription_plan.get_name_display()}",
+            )
+            for profile in paid
+        ])
+        records = []
+        for profile, payment in zip(paid, payments):
+            plan = profile.subscription_plan
+            records.append(SubscriptionTransaction(
+                user_id=profile.user_id, plan=plan, amount_egp=plan.price_egp, status='completed',
+                # Left unlinked on backends that can't return ids from a bulk insert
+                transaction_id=payment.pk, start_date=profile.subscription_end_date,
+                end_date=profile.subscription_end_date + timedelta(days=plan.duration_days), completed_at=now,
+            ))
+        for profile in unpaid:
+            records.append(SubscriptionTransaction(
+                user_id=profile.user_id, plan=profile.subscription_plan,
+                amount_egp=profile.subscription_plan.price_egp, status='failed',
+            ))
+        SubscriptionTransaction.objects.bulk_create(records)
+
+        if paid:
+            durations = {profile.subscription_plan_id: profile.subscription_plan.duration_days for profile in paid}
+            DealerProfile.objects.filter(pk__in=[profile.pk for profile in paid]).update(
+                subscription_end_date=Case(*[
+                    When(subscription_plan_id=plan_id, then=F('subscription_end_date') + timedelta(days=days))
+                    for plan_id, days in durations.items()
+                ]),
+                updated_at=now,
+            )
+            invalidate_cached_users([profile.user_id for profile in paid])
+        outbox.queue_messages([
+            _renewal_failed_notice(profile, profile.subscription_plan, balances.get(profile.user_id, Decimal('0.00')))
+            for profile in unpaid if profile.user.email
+        ])
+    return len(paid), len(unpaid)
+
+
+def renew_subscriptions(now=None, window=None, batch_size=500):
+    """Renew subscriptions ending within `window`; yields (renewed, failed) per batch"""
+    now = now or timezone.now()
+    window = window or timedelta(hours=getattr(settings, 'SUBSCRIPTION_RENEWAL_WINDOW_HOURS', 24))
+    due = _renewable(now, now + window).order_by('subscription_end_date', 'pk')
+    after = Q()
+    while True:
+        # Keyset pagination along the end date index: renewed dealers leave
+        # the window but those who couldn't pay stay, so walk past them
+        batch = list(due.filter(after).values_list('subscription_end_date', 'pk', 'user_id')[:batch_size])
+        if not batch:
+            return
+        last_end, last_pk, _ = batch[-1]
+        after = Q(subscription_end_date__gt=last_end) | Q(subscription_end_date=last_end, pk__gt=last_pk)
+        yield _renew_batch([user_id for _, _, user_id in batch], now, now + window)
@@ -1,3 +1,819 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+import os
+import tempfile
+from urllib.parse import urlsplit
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.db import connection
+from django.contrib.auth.hashers import make_password
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+
+from config.accounts import login, outbox, plans, provisioning, subscriptions
+from config.accounts.authentication import ClaimsJWTAuthentication, get_cached_user
+from config.accounts.models import (
+    DealerProfile, EGPWallet, GoldWallet, MassWallet, OutboundEmail, SubscriptionPlan, TokenUser, User
+)
+from config.accounts.tokens import ClaimsRefreshToken
+from config.payments.models import SubscriptionTransaction
+from config.products.models import Category, Product
+from config.wallet_utils import WalletManager
+
+
+def use_shared_cache(test):
+    """Run `test` against a file-based cache, which every process sees"""
+    location = tempfile.TemporaryDirectory()
+    test.addCleanup(location.cleanup)
+    shared = override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location.name,
+    }})
+    shared.enable()
+    test.addCleanup(shared.disable)
+
+
+class ClaimsTokenTests(TestCase):
+    def setUp(self):
+        use_shared_cache(self)
+        cache.clear()
+        self.client = APIClient()
+        self.admin = User.objects.create_user(username='admin', password='pass12345', role='admin', is_staff=True)
+        self.dealer = User.objects.create_user(username='dealer', password='pass12345', role='dealer', is_approved=False)
+
+    def login(self, username):
+        response = self.client.post('/api/auth/login/', {'username': username, 'password': 'pass12345'})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def user_queries(self, queries):
+        return [q['sql'] for q in queries if 'FROM "accounts_user"' in q['sql']]
+
+    def test_read_only_permission_checks_skip_the_user_query(self):
+        access = self.login('admin')['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/admin/conversion-rates/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.user_queries(ctx.captured_queries), [])
+
+        access = self.login('dealer')['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/admin/conversion-rates/')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.user_queries(ctx.captured_queries), [])
+
+    def test_token_user_loads_missing_fields_in_one_query(self):
+        access = self.login('dealer')['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+
+        response = self.client.get('/api/auth/me/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['username'], 'dealer')
+
+        user = ClaimsJWTAuthentication.token_user(AccessToken(access))
+        self.assertIsInstance(user, TokenUser)
+        self.assertEqual((user.role, user.is_approved), ('dealer', False))
+        cache.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual((user.username, user.email, user.phone_number), ('dealer', '', None))
+
+    def test_writes_use_the_database_user(self):
+        access = self.login('admin')['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(f'/api/admin/users/{self.dealer.pk}/approve_dealer/')
+        self.assertTrue(self.user_queries(ctx.captured_queries))
+
+    def test_role_change_revokes_existing_tokens(self):
+        tokens = self.login('dealer')
+        admin_access = self.login('admin')['access']
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {admin_access}')
+        response = self.client.post(f'/api/admin/users/{self.dealer.pk}/approve_dealer/')
+        self.assertEqual(response.status_code, 200)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens["access"]}')
+        self.assertEqual(self.client.get('/api/auth/me/').status_code, 401)
+        self.client.credentials()
+        response = self.client.post('/api/auth/token/refresh/', {'refresh': tokens['refresh']})
+        self.assertEqual(response.status_code, 401)
+
+        # A fresh login carries the new claims
+        access = self.login('dealer')['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(self.client.get('/api/auth/me/').status_code, 200)
+        self.assertTrue(AccessToken(access)['is_approved'])
+
+    def test_suspended_user_is_locked_out(self):
+        tokens = self.login('dealer')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.login("admin")["access"]}')
+        self.client.post(f'/api/admin/users/{self.dealer.pk}/suspend_user/')
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens["access"]}')
+        self.assertEqual(self.client.get('/api/auth/me/').status_code, 401)
+
+    def test_revocation_outlives_the_cache(self):
+        access = self.login('dealer')['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.login("admin")["access"]}')
+        self.client.post(f'/api/admin/users/{self.dealer.pk}/suspend_user/')
+        self.dealer.refresh_from_db()
+        self.assertIsNotNone(self.dealer.tokens_revoked_at)
+
+        cache.clear()  # evicted, or revoked by another worker
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(self.client.get('/api/admin/conversion-rates/').status_code, 401)
+
+    def test_claims_path_needs_a_shared_cache(self):
+        access = self.login('admin')['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            User.objects.filter(pk=self.admin.pk).update(is_active=False)
+            self.assertEqual(self.client.get('/api/admin/conversion-rates/').status_code, 401)
+
+
+class CachedUserTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.dealer = User.objects.create_user(username='dealer', password='pass12345', role='dealer')
+        response = self.client.post('/api/auth/login/', {'username': 'dealer', 'password': 'pass12345'})
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {response.data["access"]}')
+
+    def user_lookups(self, queries):
+        return [q['sql'] for q in queries if 'FROM "accounts_user"' in q['sql']]
+
+    def test_authenticated_user_is_cached_between_requests(self):
+        self.client.get('/api/auth/me/')
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.patch('/api/auth/me/', {'first_name': 'Ali'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.user_lookups(ctx.captured_queries), [])
+
+        # The save invalidated the cache, so the next request sees the change
+        response = self.client.get('/api/auth/me/')
+        self.assertEqual(response.data['first_name'], 'Ali')
+
+    def test_token_user_fields_come_from_the_cache(self):
+        self.client.get('/api/auth/me/')
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/auth/me/')
+        self.assertEqual(response.data['username'], 'dealer')
+        self.assertEqual(self.user_lookups(ctx.captured_queries), [])
+
+    def test_dealer_profile_save_invalidates(self):
+        self.client.get('/api/auth/me/')
+        DealerProfile.objects.filter(user=self.dealer).update(business_name='Stale')
+        profile = DealerProfile.objects.get(user=self.dealer)
+        profile.business_name = 'Fresh'
+        profile.save()
+
+        response = self.client.get('/api/auth/me/')
+        self.assertEqual(response.data['dealer_profile']['business_name'], 'Fresh')
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.get('/api/auth/me/')
+        self.dealer.is_active = False
+        self.dealer.save()
+
+        response = self.client.patch('/api/auth/me/', {'first_name': 'Ali'})
+        self.assertEqual(response.status_code, 401)
+
+
+class LoginTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='client', password='pass12345')
+
+    def login(self, password='pass12345', username='client', ip='10.0.0.1'):
+        return self.client.post(
+            '/api/auth/login/', {'username': username, 'password': password}, REMOTE_ADDR=ip
+        )
+
+    def test_wrong_password_and_unknown_user(self):
+        self.assertEqual(self.login('nope').status_code, 401)
+        self.assertEqual(self.login(username='ghost').status_code, 401)
+        self.assertEqual(self.login().status_code, 200)
+
+    @override_settings(LOGIN_THROTTLE={'ip': {'capacity': 3, 'per_minute': 1}})
+    def test_ip_bucket(self):
+        for _ in range(3):
+            self.assertEqual(self.login('nope').status_code, 401)
+        response = self.login()
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        # Another address has its own bucket
+        self.assertEqual(self.login(ip='10.0.0.2').status_code, 200)
+
+    @override_settings(LOGIN_THROTTLE={'ip': {'capacity': 2, 'per_minute': 1}})
+    def test_forwarded_for_header_is_not_trusted(self):
+        for i in range(2):
+            self.client.post('/api/auth/login/', {'username': 'client', 'password': 'nope'},
+                             REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR=f'203.0.113.{i}')
+        response = self.client.post('/api/auth/login/', {'username': 'client', 'password': 'pass12345'},
+                                    REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='203.0.113.9')
+        self.assertEqual(response.status_code, 429)
+
+    @override_settings(LOGIN_THROTTLE={'username': {'capacity': 2, 'per_minute': 1}})
+    def test_username_bucket_spans_addresses(self):
+        self.login('nope', ip='10.0.0.1')
+        self.login('nope', ip='10.0.0.2')
+        self.assertEqual(self.login(ip='10.0.0.3').status_code, 429)
+        self.assertEqual(self.login(username='other', ip='10.0.0.3').status_code, 401)
+
+    def test_stored_hash_is_upgraded(self):
+        self.user.password = make_password('pass12345', hasher='pbkdf2_sha1')
+        self.user.save()
+
+        self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$'))
+        self.assertTrue(self.user.check_password('pass12345'))
+
+    @override_settings(PASSWORD_HASH_ITERATIONS=1000)
+    def test_work_factor_change_is_applied_on_login(self):
+        self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.password.split('$')[1], '1000')
+
+    @override_settings(LOGIN_MAX_CONCURRENT_HASHES=1, LOGIN_HASH_WAIT_SECONDS=0)
+    def test_saturated_pool_turns_logins_away(self):
+        _, slots = login._get_pool()
+        slots.acquire()
+        try:
+            response = self.login()
+        finally:
+            slots.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.login().status_code, 200)
+
+
+class TokenBlacklistTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='client', password='pass12345')
+
+    def blacklist_queries(self, queries):
+        return [q['sql'] for q in queries if 'token_blacklist_blacklistedtoken' in q['sql']]
+
+    def test_blacklist_check_is_cached(self):
+        use_shared_cache(self)
+        refresh = str(ClaimsRefreshToken.for_user(self.user))
+        self.client.post('/api/auth/token/refresh/', {'refresh': refresh})
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/auth/token/refresh/', {'refresh': refresh})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.blacklist_queries(ctx.captured_queries), [])
+
+    def test_local_cache_does_not_remember_a_negative(self):
+        refresh = str(ClaimsRefreshToken.for_user(self.user))
+        self.assertEqual(self.client.post('/api/auth/token/refresh/', {'refresh': refresh}).status_code, 200)
+
+        # Blacklisted by another worker: nothing reaches this process's cache
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=OutstandingToken.objects.get())])
+        self.assertEqual(self.client.post('/api/auth/token/refresh/', {'refresh': refresh}).status_code, 401)
+
+    def test_logout_overrides_a_cached_negative(self):
+        refresh = str(ClaimsRefreshToken.for_user(self.user))
+        self.client.post('/api/auth/token/refresh/', {'refresh': refresh})
+        access = self.client.post('/api/auth/token/refresh/', {'refresh': refresh}).data['access']
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(self.client.post('/api/auth/logout/', {'refresh_token': refresh}).status_code, 200)
+        self.client.credentials()
+        self.assertEqual(self.client.post('/api/auth/token/refresh/', {'refresh': refresh}).status_code, 401)
+
+    def test_prune_deletes_only_expired_tokens_in_batches(self):
+        tokens = [ClaimsRefreshToken.for_user(self.user) for _ in range(5)]
+        for token in tokens[:2]:
+            token.blacklist()
+        expired = [token['jti'] for token in tokens[1:4]]
+        OutstandingToken.objects.filter(jti__in=expired).update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        out = StringIO()
+        call_command('prune_tokens', batch_size=2, stdout=out)
+        self.assertIn('Pruned 3', out.getvalue())
+        self.assertEqual(
+            set(OutstandingToken.objects.values_list('jti', flat=True)),
+            {tokens[0]['jti'], tokens[4]['jti']},
+        )
+        self.assertEqual(BlacklistedToken.objects.get().token.jti, tokens[0]['jti'])
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, messages):
+        raise ConnectionRefusedError('SMTP is down')
+
+
+class EmailOutboxTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='client', email='client@example.com', password='pass12345', first_name='Mona'
+        )
+
+    def test_password_reset_does_the_same_work_for_unknown_addresses(self):
+        with CaptureQueriesContext(connection) as known:
+            response = self.client.post('/api/auth/password-reset/', {'email': 'client@example.com'})
+        self.assertEqual(response.status_code, 200)
+        with CaptureQueriesContext(connection) as unknown:
+            self.client.post('/api/auth/password-reset/', {'email': 'nobody@example.com'})
+        self.assertEqual(len(known.captured_queries), len(unknown.captured_queries))
+        self.assertEqual(len(mail.outbox), 0)
+
+        call_command('send_queued_email', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('/reset-password/', mail.outbox[0].body)
+        self.assertEqual(mail.outbox[0].to, ['client@example.com'])
+        self.assertEqual(
+            dict(OutboundEmail.objects.values_list('to_email', 'status')),
+            {'client@example.com': 'sent', 'nobody@example.com': 'skipped'},
+        )
+
+    def test_failures_are_retried_with_backoff(self):
+        outbox.queue_message('client@example.com', 'Hi', 'Body')
+        with override_settings(
+            EMAIL_BACKEND='config.accounts.tests.FailingEmailBackend', EMAIL_OUTBOX_MAX_ATTEMPTS=2
+        ):
+            self.assertEqual(list(outbox.drain()), [{'sent': 0, 'skipped': 0, 'retry': 1, 'failed': 0}])
+            email = OutboundEmail.objects.get()
+            self.assertEqual((email.status, email.attempts), ('pending', 1))
+            self.assertGreater(email.send_after, timezone.now())
+            self.assertIn('SMTP is down', email.last_error)
+            # Not due yet
+            self.assertEqual(list(outbox.drain()), [])
+
+            OutboundEmail.objects.update(send_after=timezone.now())
+            list(outbox.drain())
+            self.assertEqual(OutboundEmail.objects.get().status, 'failed')
+
+    def test_repeated_reset_requests_queue_one_mail(self):
+        for email in ('client@example.com', 'Client@Example.com'):
+            self.client.post('/api/auth/password-reset/', {'email': email})
+        self.assertEqual(OutboundEmail.objects.count(), 1)
+
+        call_command('send_queued_email', stdout=StringIO())
+        self.client.post('/api/auth/password-reset/', {'email': 'client@example.com'})
+        self.assertEqual(OutboundEmail.objects.filter(status='pending').count(), 1)
+
+    def test_finished_rows_are_pruned(self):
+        for _ in range(3):
+            outbox.queue_message('client@example.com', 'Hi', 'Body')
+        list(outbox.drain())
+        outbox.queue_message('client@example.com', 'Later', 'Body')
+        OutboundEmail.objects.update(send_after=timezone.now() - timedelta(days=31))
+
+        out = StringIO()
+        call_command('prune_outbox', batch_size=2, stdout=out)
+        self.assertIn('Pruned 3 queued emails', out.getvalue())
+        self.assertEqual(list(OutboundEmail.objects.values_list('status', flat=True)), ['pending'])
+
+    def test_prune_with_zero_retention(self):
+        outbox.queue_message('client@example.com', 'Hi', 'Body')
+        list(outbox.drain())
+        OutboundEmail.objects.update(send_after=timezone.now() - timedelta(minutes=1))
+
+        out = StringIO()
+        call_command('prune_outbox', days=0, stdout=out)
+        self.assertIn('Pruned 1 queued emails', out.getvalue())
+
+    def test_expired_lease_is_reclaimed(self):
+        outbox.queue_message('client@example.com', 'Hi', 'Body')
+        self.assertEqual(len(outbox.claim_batch()), 1)
+        self.assertEqual(outbox.claim_batch(), [])
+
+        OutboundEmail.objects.update(send_after=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(len(outbox.claim_batch()), 1)
+
+    def test_email_verification_flow(self):
+        response = self.client.post('/api/auth/register/', {
+            'username': 'newbie', 'email': 'newbie@example.com', 'password': 'Sup3r-secret!',
+            'password2': 'Sup3r-secret!', 'first_name': 'New', 'last_name': 'User', 'role': 'client',
+        })
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(len(mail.outbox), 0)
+
+        call_command('send_queued_email', stdout=StringIO())
+        link = next(line.strip() for line in mail.outbox[0].body.splitlines() if '/verify-email/' in line)
+        response = self.client.get(urlsplit(link).path)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(User.objects.get(username='newbie').email_verified)
+
+
+class ProvisioningTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def register(self, username, role):
+        return self.client.post('/api/auth/register/', {
+            'username': username, 'email': f'{username}@example.com', 'password': 'Sup3r-secret!',
+            'password2': 'Sup3r-secret!', 'first_name': 'New', 'last_name': 'User', 'role': role,
+        })
+
+    def test_registration_creates_everything_without_lookups(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.register('dealer', 'dealer')
+        self.assertEqual(response.status_code, 201, response.data)
+        inserts = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('INSERT')]
+        wallet_selects = [q['sql'] for q in ctx.captured_queries
+                          if q['sql'].startswith('SELECT') and 'wallet' in q['sql']]
+        self.assertEqual(len(inserts), 3)  # user, dealer profile, verification email
+        self.assertEqual(wallet_selects, [])
+
+        user = User.objects.get(username='dealer')
+        self.assertTrue(user.check_password('Sup3r-secret!'))
+        self.assertFalse(user.is_approved)
+        self.assertTrue(DealerProfile.objects.filter(user=user).exists())
+        # Wallets only appear with the first credit
+        for model in (EGPWallet, GoldWallet, MassWallet):
+            self.assertFalse(model.objects.filter(user=user).exists())
+
+    def test_bulk_provision_api(self):
+        admin = User.objects.create_user(username='admin', password='pass12345', role='admin', is_staff=True)
+        User.objects.create_user(username='taken', password='pass12345')
+        self.client.force_authenticate(admin)
+
+        users = [{'username': f'user{i}', 'email': f'user{i}@example.com', 'role': 'client'} for i in range(5)]
+        users += [{'username': 'shop', 'role': 'dealer', 'password': 'dealer-pass-1'}, {'username': 'taken'}]
+        response = self.client.post('/api/admin/users/bulk_provision/', {'users': users}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual((response.data['created'], response.data['skipped']), (6, 1))
+
+        shop = User.objects.get(username='shop')
+        self.assertTrue(shop.check_password('dealer-pass-1'))
+        self.assertFalse(shop.is_approved)
+        self.assertTrue(DealerProfile.objects.filter(user=shop).exists())
+        self.assertFalse(User.objects.get(username='user0').has_usable_password())
+
+    @override_settings(BULK_PROVISION_MAX_USERS=2)
+    def test_bulk_provision_api_caps_the_batch(self):
+        admin = User.objects.create_user(username='admin', password='pass12345', role='admin', is_staff=True)
+        self.client.force_authenticate(admin)
+
+        users = [{'username': f'user{i}', 'password': 'user-pass-1'} for i in range(3)]
+        response = self.client.post('/api/admin/users/bulk_provision/', {'users': users}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(User.objects.filter(username__startswith='user').exists())
+
+    def test_provision_users_command(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w') as fh:
+            fh.write('username,email,role\n')
+            for i in range(25):
+                fh.write(f'bulk{i},bulk{i}@example.com,{"dealer" if i % 5 == 0 else "client"}\n')
+        self.addCleanup(os.remove, path)
+
+        out = StringIO()
+        call_command('provision_users', path, batch_size=10, stdout=out)
+        self.assertIn('Imported 25 users', out.getvalue())
+        self.assertEqual(User.objects.filter(username__startswith='bulk').count(), 25)
+        self.assertEqual(DealerProfile.objects.filter(user__username__startswith='bulk').count(), 5)
+
+        call_command('provision_users', path, stdout=out)
+        self.assertIn('Imported 0 users (25 skipped)', out.getvalue())
+
+
+class LazyWalletTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='client', password='pass12345')
+
+    def test_reading_a_missing_wallet_writes_nothing(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(WalletManager.get_balance(self.user, 'gold'), Decimal('0.00'))
+        self.assertEqual([q['sql'] for q in ctx.captured_queries if not q['sql'].startswith('SELECT')], [])
+        self.assertFalse(GoldWallet.objects.exists())
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/auth/wallet/balance/')
+        self.assertEqual(response.data, {'egp': 0.0, 'gold': 0.0, 'mass': 0.0})
+        self.assertFalse(EGPWallet.objects.exists())
+
+    def test_first_credit_creates_the_wallet(self):
+        success, _, error = WalletManager.add_to_wallet(self.user, Decimal('50.00'), 'mass', 'Top up')
+        self.assertTrue(success, error)
+        self.assertEqual(MassWallet.objects.get(user=self.user).balance, Decimal('50.00'))
+        self.assertFalse(EGPWallet.objects.exists())
+
+        success, _, error = WalletManager.add_to_wallet(self.user, Decimal('25.00'), 'mass', 'Top up')
+        self.assertEqual(WalletManager.get_balance(self.user, 'mass'), Decimal('75.00'))
+
+    def test_debit_without_a_wallet_is_insufficient_balance(self):
+        success, txn, error = WalletManager.deduct_from_wallet(self.user, Decimal('10.00'), 'egp', 'Purchase')
+        self.assertFalse(success)
+        self.assertIsNone(txn)
+        self.assertEqual(error, 'Insufficient EGP balance. Required: 10.00, Available: 0.00')
+        self.assertFalse(EGPWallet.objects.exists())
+
+
+class RegistrationUniquenessTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        User.objects.create_user(username='existing', email='Existing@Example.com', password='pass12345')
+
+    def register(self, username, email):
+        return self.client.post('/api/auth/register/', {
+            'username': username, 'email': email, 'password': 'Sup3r-secret!',
+            'password2': 'Sup3r-secret!', 'first_name': 'New', 'last_name': 'User',
+        })
+
+    def test_registration_does_not_look_up_duplicates(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.register('fresh', 'fresh@example.com')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual([q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT')], [])
+
+    def test_duplicates_are_rejected_by_the_database(self):
+        response = self.register('other', 'existing@EXAMPLE.com')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'email': ['Email already registered']})
+
+        response = self.register('existing', 'someone@example.com')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'username': ['Username already exists']})
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_profile_update_to_a_taken_email(self):
+        user = User.objects.create_user(username='mover', email='mover@example.com', password='pass12345')
+        self.client.force_authenticate(user)
+        response = self.client.patch('/api/auth/me/', {'email': 'EXISTING@example.com'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'email': ['Email already registered']})
+        user.refresh_from_db()
+        self.assertEqual(user.email, 'mover@example.com')
+
+    def test_blank_emails_may_repeat(self):
+        User.objects.create_user(username='noemail1', password='pass12345')
+        User.objects.create_user(username='noemail2', password='pass12345')
+        self.assertEqual(User.objects.filter(email='').count(), 2)
+
+    def test_bulk_provision_skips_taken_emails(self):
+        rows = [
+            {'username': 'a', 'email': 'EXISTING@example.com'},
+            {'username': 'b', 'email': 'new@example.com'},
+            {'username': 'c', 'email': 'New@Example.com'},
+        ]
+        self.assertEqual(list(provisioning.bulk_provision(rows)), [(1, 2)])
+        self.assertTrue(User.objects.filter(username='b').exists())
+
+    def test_username_probe(self):
+        url = '/api/auth/username-available/'
+        self.assertEqual(self.client.get(url, {'username': 'existing'}).data,
+                         {'username': 'existing', 'available': False})
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertFalse(self.client.get(url, {'username': 'existing'}).data['available'])
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+        self.assertTrue(self.client.get(url, {'username': 'newcomer'}).data['available'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.register('newcomer', 'newcomer@example.com').status_code, 201)
+        # Registration marks the name taken straight away
+        self.assertFalse(self.client.get(url, {'username': 'newcomer'}).data['available'])
+        self.assertEqual(self.client.get(url).status_code, 400)
+
+    @override_settings(LOGIN_THROTTLE={'username_probe': {'capacity': 2, 'per_minute': 1}})
+    def test_username_probe_is_throttled(self):
+        url = '/api/auth/username-available/'
+        for name in ('one', 'two'):
+            self.assertEqual(self.client.get(url, {'username': name}).status_code, 200)
+        self.assertEqual(self.client.get(url, {'username': 'three'}).status_code, 429)
+
+
+class SubscriptionExpiryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.plan = SubscriptionPlan.objects.create(name='pro', price_egp=Decimal('100.00'), max_products=50)
+        self.category = Category.objects.create(name='Electronics', slug='electronics')
+        self.now = timezone.now()
+
+    def dealer(self, username, ends_in_days, listings=0):
+        user = User.objects.create_user(username=username, email=f'{username}@example.com',
+                                        password='pass12345', role='dealer')
+        DealerProfile.objects.filter(user=user).update(
+            subscription_plan=self.plan, has_used_free_product=True,
+            subscription_start_date=self.now - timedelta(days=30),
+            subscription_end_date=self.now + timedelta(days=ends_in_days),
+        )
+        for i in range(listings):
+            Product.objects.create(
+                category=self.category, dealer=user, name=f'{username} {i}', slug=f'{username}-{i}',
+                description='Test product', price_egp=Decimal('10.00'), image='products/test.jpg',
+                status='approved', publish_date=self.now - timedelta(days=10 - i),
+            )
+        return user
+
+    def test_lapsed_dealers_are_expired_in_batches(self):
+        lapsed = [self.dealer(f'lapsed{i}', -1, listings=3) for i in range(3)]
+        current = self.dealer('current', 5, listings=3)
+
+        out = StringIO()
+        call_command('expire_subscriptions', batch_size=2, stdout=out)
+        self.assertIn('Expired 3 subscriptions, suspended 6 listings', out.getvalue())
+
+        for user in lapsed:
+            profile = DealerProfile.objects.get(user=user)
+            self.assertIsNone(profile.subscription_plan)
+            self.assertEqual(profile.active_products, 1)
+            # The oldest listing stays up
+            self.assertEqual(Product.objects.get(dealer=user, status='approved').slug, f'{user.username}-0')
+            record = SubscriptionTransaction.objects.get(user=user)
+            self.assertEqual((record.status, record.plan, record.amount_egp), ('expired', self.plan, Decimal('0')))
+        self.assertEqual(DealerProfile.objects.get(user=current).subscription_plan, self.plan)
+        self.assertEqual(Product.objects.filter(dealer=current, status='approved').count(), 3)
+        self.assertFalse(SubscriptionTransaction.objects.filter(user=current).exists())
+
+        notices = OutboundEmail.objects.filter(kind='message')
+        self.assertEqual(sorted(notices.values_list('to_email', flat=True)),
+                         [f'lapsed{i}@example.com' for i in range(3)])
+        self.assertIn('2 of your listings were suspended', notices[0].payload['body'])
+
+        call_command('expire_subscriptions', stdout=out)
+        self.assertIn('Expired 0 subscriptions', out.getvalue())
+
+    def test_batch_cost_does_not_grow_with_listings(self):
+        self.dealer('a', -1, listings=2)
+        with CaptureQueriesContext(connection) as small:
+            list(subscriptions.expire_subscriptions())
+        for name in 'bcd':
+            self.dealer(name, -1, listings=5)
+        with CaptureQueriesContext(connection) as large:
+            list(subscriptions.expire_subscriptions())
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+    def test_cached_user_is_dropped(self):
+        user = self.dealer('lapsed', -1)
+        self.assertEqual(get_cached_user(user.pk).dealer_profile.subscription_plan_id, self.plan.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            list(subscriptions.expire_subscriptions())
+        self.assertIsNone(get_cached_user(user.pk).dealer_profile.subscription_plan_id)
+
+
+class SubscriptionRenewalTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.plans = {
+            'pro': SubscriptionPlan.objects.create(name='pro', price_egp=Decimal('100.00'), max_products=50),
+            'starter': SubscriptionPlan.objects.create(name='starter', price_egp=Decimal('40.00'),
+                                                       max_products=5, duration_days=7),
+        }
+        self.now = timezone.now()
+
+    def dealer(self, username, plan='pro', balance=None, ends_in_hours=5, **fields):
+        user = User.objects.create_user(username=username, email=f'{username}@example.com',
+                                        password='pass12345', role='dealer')
+        DealerProfile.objects.filter(user=user).update(
+            subscription_plan=self.plans[plan],
+            subscription_end_date=self.now + timedelta(hours=ends_in_hours), **fields
+        )
+        if balance is not None:
+            WalletManager.add_to_wallet(user, Decimal(balance), 'egp', 'Top up')
+        return user
+
+    def end_date(self, user):
+        return DealerProfile.objects.get(user=user).subscription_end_date
+
+    def test_due_subscriptions_are_charged_and_extended(self):
+        pro = self.dealer('pro', balance='150.00')
+        starter = self.dealer('starter', plan='starter', balance='40.00')
+        broke = self.dealer('broke', balance='99.99')
+        walletless = self.dealer('walletless')
+        opted_out = self.dealer('optedout', balance='500.00', auto_renew=False)
+        later = self.dealer('later', balance='500.00', ends_in_hours=72)
+
+        out = StringIO()
+        call_command('renew_subscriptions', batch_size=2, stdout=out)
+        self.assertIn('Renewed 2 subscriptions, 2 could not pay', out.getvalue())
+
+        self.assertEqual(WalletManager.get_balance(pro, 'egp'), Decimal('50.00'))
+        self.assertEqual(WalletManager.get_balance(starter, 'egp'), Decimal('0.00'))
+        self.assertEqual(self.end_date(pro), self.now + timedelta(hours=5, days=30))
+        self.assertEqual(self.end_date(starter), self.now + timedelta(hours=5, days=7))
+        record = SubscriptionTransaction.objects.get(user=pro)
+        self.assertEqual((record.status, record.amount_egp), ('completed', Decimal('100.00')))
+        self.assertEqual(record.transaction.amount, Decimal('100.00'))
+        self.assertEqual(record.transaction.transaction_type, 'subscription')
+
+        for user in (broke, walletless):
+            self.assertEqual(self.end_date(user), self.now + timedelta(hours=5))
+            self.assertEqual(SubscriptionTransaction.objects.get(user=user).status, 'failed')
+        self.assertEqual(WalletManager.get_balance(broke, 'egp'), Decimal('99.99'))
+        self.assertEqual(sorted(OutboundEmail.objects.values_list('to_email', flat=True)),
+                         ['broke@example.com', 'walletless@example.com'])
+        for user in (opted_out, later):
+            self.assertFalse(SubscriptionTransaction.objects.filter(user=user).exists())
+
+        # Renewed dealers have left the window; the rest are tried again
+        call_command('renew_subscriptions', stdout=out)
+        self.assertIn('Renewed 0 subscriptions, 2 could not pay', out.getvalue())
+
+    def test_batch_cost_does_not_grow_with_dealers(self):
+        self.dealer('a', balance='100.00')
+        with CaptureQueriesContext(connection) as small:
+            list(subscriptions.renew_subscriptions())
+        for name in 'bcd':
+            self.dealer(name, balance='100.00')
+        with CaptureQueriesContext(connection) as large:
+            list(subscriptions.renew_subscriptions())
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+    def test_cached_user_is_dropped(self):
+        user = self.dealer('pro', balance='100.00')
+        ends = get_cached_user(user.pk).dealer_profile.subscription_end_date
+        with self.captureOnCommitCallbacks(execute=True):
+            list(subscriptions.renew_subscriptions())
+        self.assertEqual(get_cached_user(user.pk).dealer_profile.subscription_end_date, ends + timedelta(days=30))
+
+    def test_purchase_records_a_subscription_transaction(self):
+        user = self.dealer('buyer', balance='100.00', ends_in_hours=-1)
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.post('/api/auth/subscription/purchase/', {'plan_id': self.plans['pro'].pk})
+        self.assertEqual(response.status_code, 200, response.data)
+        record = SubscriptionTransaction.objects.get(user=user)
+        self.assertEqual((record.status, record.plan), ('completed', self.plans['pro']))
+        self.assertEqual(record.end_date, self.end_date(user))
+        self.assertIsNotNone(record.transaction)
+
+
+class PlanRegistryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.pro = SubscriptionPlan.objects.create(name='pro', price_egp=Decimal('100.00'), max_products=50)
+        SubscriptionPlan.objects.create(name='starter', price_egp=Decimal('40.00'), max_products=5)
+        SubscriptionPlan.objects.create(name='enterprise', price_egp=Decimal('900.00'), max_products=0,
+                                        is_active=False)
+        self.client = APIClient()
+
+    def test_plan_list_is_rendered_once(self):
+        response = self.client.get('/api/auth/subscription/plans/')
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['count'], 2)
+        self.assertEqual([plan['name'] for plan in body['results']], ['starter', 'pro'])
+        self.assertEqual(body['results'][1]['price_egp'], '100.00')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/auth/subscription/plans/').content, response.content)
+
+    def test_saving_a_plan_reloads_the_registry(self):
+        self.client.get('/api/auth/subscription/plans/')
+        self.pro.price_egp = Decimal('120.00')
+        self.pro.save()
+        body = self.client.get('/api/auth/subscription/plans/').json()
+        self.assertEqual(body['results'][1]['price_egp'], '120.00')
+
+        self.pro.delete()
+        self.assertEqual(self.client.get('/api/auth/subscription/plans/').json()['count'], 1)
+
+    def test_snapshot_expires(self):
+        self.client.get('/api/auth/subscription/plans/')
+        # Changed by another worker: nothing bumps this process's counter
+        SubscriptionPlan.objects.filter(pk=self.pro.pk).update(price_egp=Decimal('130.00'))
+        self.assertEqual(plans.get(self.pro.pk).price_egp, Decimal('100.00'))
+        with override_settings(PLAN_REGISTRY_MAX_AGE=0):
+            self.assertEqual(plans.get(self.pro.pk).price_egp, Decimal('130.00'))
+
+    def test_dealer_profile_plan_comes_from_the_registry(self):
+        dealer = User.objects.create_user(username='dealer', password='pass12345', role='dealer')
+        DealerProfile.objects.filter(user=dealer).update(
+            subscription_plan=self.pro, subscription_end_date=timezone.now() + timedelta(days=3),
+        )
+        self.client.force_authenticate(dealer)
+        self.client.get('/api/auth/dealer/profile/')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/auth/dealer/profile/')
+        self.assertEqual(response.data['subscription_plan']['name'], 'pro')
+        self.assertFalse([q for q in ctx.captured_queries if 'subscriptionplan' in q['sql']])
+
+    def test_purchase_uses_the_registry(self):
+        dealer = User.objects.create_user(username='dealer', password='pass12345', role='dealer')
+        WalletManager.add_to_wallet(dealer, Decimal('100.00'), 'egp', 'Top up')
+        self.client.force_authenticate(dealer)
+        url = '/api/auth/subscription/purchase/'
+        inactive = SubscriptionPlan.objects.get(name='enterprise')
+        self.assertEqual(self.client.post(url, {'plan_id': inactive.pk}).status_code, 404)
+        self.assertEqual(self.client.post(url, {'plan_id': 'pro'}).status_code, 404)
+
+        response = self.client.post(url, {'plan_id': self.pro.pk})
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['plan']['name'], 'pro')
+        self.assertEqual(DealerProfile.objects.get(user=dealer).subscription_plan, self.pro)
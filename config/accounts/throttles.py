@@ -0,0 +1,78 @@
+"""
+Token-bucket throttles for the login endpoint and the register form's
+username check.
+
+Each bucket holds up to ``capacity`` attempts and refills at ``per_minute``
+attempts a minute, so a person retyping a password a few times is never
+slowed down while sustained guessing is held to the refill rate. Buckets
+live in the default cache, keyed by client IP and by the submitted username.
+Only a shared cache (Redis, Memcached) makes the limits hold across
+workers; with the default process-local one every worker keeps its own
+buckets and the effective limit is multiplied by the worker count (see
+``cache_is_shared`` in tokens.py). Configure them with LOGIN_THROTTLE;
+a missing entry disables that bucket. The client IP is DRF's get_ident,
+which only trusts X-Forwarded-For as far as REST_FRAMEWORK['NUM_PROXIES'].
+
+Updates are read-modify-write, not atomic: under heavy concurrency a few
+extra attempts can slip through, which is fine for a rate limit.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+
+class TokenBucketThrottle(BaseThrottle):
+    scope = None
+
+    def get_ident_key(self, request):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        rate = (getattr(settings, 'LOGIN_THROTTLE', None) or {}).get(self.scope)
+        ident = self.get_ident_key(request) if rate else None
+        if not ident:
+            return True
+        capacity, refill = rate['capacity'], rate['per_minute'] / 60
+        key = f'throttle:{self.scope}:{ident}'
+
+        now = time.time()
+        tokens, updated = cache.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * refill)
+        if tokens < 1:
+            self._wait = (1 - tokens) / refill
+            return False
+        cache.set(key, (tokens - 1, now), int(capacity / refill) + 1)
+        return True
+
+    def wait(self):
+        return getattr(self, '_wait', None)
+
+
+class LoginIPThrottle(TokenBucketThrottle):
+    scope = 'ip'
+
+    def get_ident_key(self, request):
+        return self.get_ident(request)
+
+
+class LoginUsernameThrottle(TokenBucketThrottle):
+    scope = 'username'
+
+    def get_ident_key(self, request):
+        username = request.data.get('username') if hasattr(request.data, 'get') else None
+        if not isinstance(username, str) or not username:
+            return None
+        # Hashed: usernames are arbitrary user input and end up in cache keys
+        return hashlib.sha256(username.encode()).hexdigest()
+
+
+class UsernameProbeThrottle(TokenBucketThrottle):
+    """Per-IP limit on username availability checks, so they can't be used
+    to enumerate accounts quickly"""
+    scope = 'username_probe'
+
+    def get_ident_key(self, request):
+        return self.get_ident(request)
@@ -0,0 +1,157 @@
+"""
+JWTs that carry the user's role.
+
+Access tokens issued at login carry the claims permission checks need
+(``role``, ``is_staff``, ``is_superuser``, ``is_approved``) plus
+``auth_time``, the moment the user logged in, which survives refreshes.
+ClaimsJWTAuthentication (authentication.py) trusts them on read-only
+requests instead of loading the user.
+
+Claims go stale when an admin changes a role, approves, suspends or
+reactivates someone, so those paths call ``revoke_user_tokens``: every
+refresh token of the user is blacklisted and access tokens with an older
+``auth_time`` are rejected until they would have expired anyway. The
+revocation time is stored on the user (``tokens_revoked_at``) and cached;
+a cache miss reads it back from the database. With a process-local cache
+another worker's cached copy can't be cleared, so it is only kept for
+AUTH_USER_CACHE_TIMEOUT, and the claims-only path in authentication.py is
+off altogether (``cache_is_shared``).
+
+Blacklist checks on refresh/logout are answered from the cache; the
+database is asked once per token. A cached "not blacklisted" is only ever
+added, never overwritten, and blacklisting always sets the key, so a check
+racing a logout can't hide it. It is only cached when the cache is shared:
+a worker with a local cache would keep accepting a token another worker
+has blacklisted. ``prune_expired`` deletes expired rows
+from both blacklist tables in batches (``manage.py prune_tokens``).
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+CLAIM_FIELDS = ('role', 'is_staff', 'is_superuser', 'is_approved')
+
+REVOKED_KEY = 'auth:revoked:{}'
+BLACKLISTED_KEY = 'auth:blacklisted:{}'
+
+# Backends whose entries only the current process sees
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def cache_is_shared():
+    """Whether every worker reads the same default cache"""
+    return settings.CACHES['default']['BACKEND'] not in LOCAL_CACHE_BACKENDS
+
+
+def user_claims(user):
+    return {field: getattr(user, field) for field in CLAIM_FIELDS}
+
+
+class ClaimsRefreshToken(RefreshToken):
+    """Refresh token whose access tokens carry the user's role claims"""
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token.payload.update(user_claims(user))
+        token['auth_time'] = time.time()
+        # The row is at hand, so is_revoked needn't read it back
+        revoked_at = user.tokens_revoked_at.timestamp() if user.tokens_revoked_at else 0
+        cache.add(REVOKED_KEY.format(user.pk), revoked_at, _revocation_timeout())
+        return token
+
+    def check_blacklist(self):
+        from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+        jti = self.payload[api_settings.JTI_CLAIM]
+        key = BLACKLISTED_KEY.format(jti)
+        blacklisted = cache.get(key)
+        if blacklisted is None:
+            blacklisted = BlacklistedToken.objects.filter(token__jti=jti).exists()
+            if blacklisted or cache_is_shared():
+                cache.add(key, blacklisted, _seconds_left(self.payload['exp']))
+        if blacklisted:
+            raise TokenError(_('Token is blacklisted'))
+
+
+def _seconds_left(exp):
+    return max(int(exp - time.time()), 1)
+
+
+def remember_blacklisted(tokens):
+    """Mark OutstandingToken rows as blacklisted in the cache"""
+    now = timezone.now()
+    for token in tokens:
+        timeout = max(int((token.expires_at - now).total_seconds()), 1)
+        cache.set(BLACKLISTED_KEY.format(token.jti), True, timeout)
+
+
+def _revocation_timeout():
+    if cache_is_shared():
+        # A refreshed access token keeps the original auth_time, so the
+        # value has to outlive the refresh token, not just the access token
+        return int(api_settings.REFRESH_TOKEN_LIFETIME.total_seconds())
+    return getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 60)
+
+
+def _remember_revoked(user_id, revoked_at):
+    cache.set(REVOKED_KEY.format(user_id), revoked_at, _revocation_timeout())
+
+
+def revoke_user_tokens(user):
+    """Invalidate every token issued to `user` so far"""
+    from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+    from config.accounts.models import User
+
+    now = timezone.now()
+    User.objects.filter(pk=user.pk).update(tokens_revoked_at=now)
+    user.tokens_revoked_at = now
+    # Again after commit: a miss meanwhile would have read the old row
+    _remember_revoked(user.pk, now.timestamp())
+    transaction.on_commit(lambda: _remember_revoked(user.pk, now.timestamp()))
+    outstanding = list(OutstandingToken.objects.filter(
+        user=user, expires_at__gt=now, blacklistedtoken__isnull=True
+    ))
+    BlacklistedToken.objects.bulk_create(
+        [BlacklistedToken(token=token) for token in outstanding], ignore_conflicts=True
+    )
+    # bulk_create skips post_save, which keeps the cache current otherwise
+    remember_blacklisted(outstanding)
+
+
+def is_revoked(token):
+    from config.accounts.models import User
+
+    user_id = token.get(api_settings.USER_ID_CLAIM)
+    revoked_at = cache.get(REVOKED_KEY.format(user_id))
+    if revoked_at is None:
+        stored = User.objects.filter(pk=user_id).values_list('tokens_revoked_at', flat=True).first()
+        # 0 stands for "never", so it is cached too. Only added: a revoke
+        # committing meanwhile has set the key and must win
+        revoked_at = stored.timestamp() if stored else 0
+        cache.add(REVOKED_KEY.format(user_id), revoked_at, _revocation_timeout())
+    return bool(revoked_at) and token.get('auth_time', 0) <= revoked_at
+
+
+def prune_expired(batch_size=1000):
+    """Delete expired outstanding tokens and their blacklist rows; yields batch sizes"""
+    from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+    expired = OutstandingToken.objects.filter(expires_at__lte=timezone.now()).order_by('pk')
+    while True:
+        ids = list(expired.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return
+        BlacklistedToken.objects.filter(token_id__in=ids).delete()
+        OutstandingToken.objects.filter(pk__in=ids).delete()
+        yield len(ids)
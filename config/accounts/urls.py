@@ -2,6 +2,7 @@ from django.urls import path, include
 from rest_framework_simplejwt.views import TokenRefreshView
 from config.accounts.views import (
     RegisterView,
+    UsernameAvailabilityView,
     LoginView,
     LogoutView,
     UserDetailView,
@@ -13,11 +14,14 @@ from config.accounts.views import (
     PasswordResetConfirmView,
     ChangePasswordView,
     WalletBalanceView,
+    EmailVerificationRequestView,
+    EmailVerificationConfirmView,
 )
 
 urlpatterns = [
     # Authentication
     path('register/', RegisterView.as_view(), name='register'),
+    path('username-available/', UsernameAvailabilityView.as_view(), name='username_available'),
     path('login/', LoginView.as_view(), name='login'),
     path('logout/', LogoutView.as_view(), name='logout'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
@@ -38,4 +42,8 @@ urlpatterns = [
     # Password Reset
     path('password-reset/', PasswordResetRequestView.as_view(), name='password_reset'),
     path('password-reset-confirm/', PasswordResetConfirmView.as_view(), name='password_reset_confirm'),
+    
+    # Email Verification
+    path('verify-email/', EmailVerificationRequestView.as_view(), name='verify_email'),
+    path('verify-email/<str:token>/', EmailVerificationConfirmView.as_view(), name='verify_email_confirm'),
 ]
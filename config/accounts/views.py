@@ -2,19 +2,19 @@ from rest_framework import generics, permissions, status, viewsets
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView
 from django.contrib.auth.tokens import default_token_generator
-from django.utils.encoding import force_bytes
-from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
+from django.utils.http import urlsafe_base64_decode
 from django.template.loader import render_to_string
-from django.core.mail import send_mail
 from django.conf import settings
 from django.shortcuts import get_object_or_404
-from django.contrib.auth import get_user_model, authenticate
+from django.http import Http404, HttpResponse
+from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.core import signing
 from django.db import transaction
+from django.core.cache import cache
+import hashlib
 
 from config.permissions import IsAdmin, IsDealer, IsClient, is_admin_user
 from config.wallet_utils import WalletManager
@@ -25,6 +25,10 @@ from .serializers import (
     SubscriptionPlanSerializer
 )
 from config.accounts.models import User, DealerProfile, SubscriptionPlan
+from config.accounts import outbox, plans
+from config.accounts.login import LoginBusy, authenticate_credentials
+from config.accounts.throttles import LoginIPThrottle, LoginUsernameThrottle, UsernameProbeThrottle
+from config.accounts.tokens import ClaimsRefreshToken
 
 User = get_user_model()
 
@@ -36,13 +40,55 @@ class RegisterView(generics.CreateAPIView):
     
     @transaction.atomic
     def perform_create(self, serializer):
-        return serializer.save()
+        user = serializer.save()
+        if user.email:
+            outbox.queue_email_verification(user)
+        transaction.on_commit(lambda: remember_username_taken(user.username))
+        return user
+
+
+# Username availability answers for the register form. A taken name stays
+# taken, so it is cached for long; a free one can be claimed any moment.
+USERNAME_TAKEN_KEY = 'auth:username-taken:{}'
+USERNAME_TAKEN_SECONDS = 3600
+USERNAME_FREE_SECONDS = 30
+
+
+def _username_key(username):
+    return USERNAME_TAKEN_KEY.format(hashlib.sha256(username.encode()).hexdigest())
+
+
+def remember_username_taken(username):
+    cache.set(_username_key(username), True, USERNAME_TAKEN_SECONDS)
+
+
+class UsernameAvailabilityView(APIView):
+    """Whether a username can still be registered.
+
+    Advisory only: registration itself relies on the unique column.
+    """
+    permission_classes = [permissions.AllowAny]
+    throttle_classes = [UsernameProbeThrottle]
+
+    def get(self, request):
+        username = User.normalize_username(request.query_params.get('username', '').strip())
+        max_length = User._meta.get_field('username').max_length
+        if not username or len(username) > max_length:
+            return Response({'detail': 'Enter a username.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        key = _username_key(username)
+        taken = cache.get(key)
+        if taken is None:
+            taken = User.objects.filter(username=username).exists()
+            cache.set(key, taken, USERNAME_TAKEN_SECONDS if taken else USERNAME_FREE_SECONDS)
+        return Response({'username': username, 'available': not taken}, status=status.HTTP_200_OK)
 
 
 class LoginView(generics.GenericAPIView):
     """User login endpoint with JWT and role-based redirect"""
     serializer_class = LoginSerializer
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [LoginIPThrottle, LoginUsernameThrottle]
     
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -51,7 +97,14 @@ class LoginView(generics.GenericAPIView):
         username = serializer.validated_data['username']
         password = serializer.validated_data['password']
         
-        user = authenticate(username=username, password=password)
+        try:
+            user = authenticate_credentials(request, username, password)
+        except LoginBusy:
+            return Response(
+                {'detail': 'Too many logins in progress, try again shortly'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': '1'}
+            )
         
         if user is None:
             return Response(
@@ -59,7 +112,7 @@ class LoginView(generics.GenericAPIView):
                 status=status.HTTP_401_UNAUTHORIZED
             )
         
-        refresh = RefreshToken.for_user(user)
+        refresh = ClaimsRefreshToken.for_user(user)
         
         # Determine redirect URL based on user role
         redirect_url = '/'
@@ -91,7 +144,7 @@ class LogoutView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            token = RefreshToken(refresh_token)
+            token = ClaimsRefreshToken(refresh_token)
             token.blacklist()
             
             return Response(
@@ -143,11 +196,13 @@ class DealerProfileView(generics.RetrieveUpdateAPIView):
         return DealerProfileSerializer
 
 
-class SubscriptionPlansView(generics.ListAPIView):
+class SubscriptionPlansView(APIView):
     """List all subscription plans"""
-    queryset = SubscriptionPlan.objects.filter(is_active=True)
-    serializer_class = SubscriptionPlanSerializer
     permission_classes = [permissions.AllowAny]
+    
+    def get(self, request):
+        # Rendered once per plan change by the registry
+        return HttpResponse(plans.active_json(), content_type='application/json')
 
 
 class PurchaseSubscriptionView(generics.CreateAPIView):
@@ -163,7 +218,12 @@ class PurchaseSubscriptionView(generics.CreateAPIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        plan = get_object_or_404(SubscriptionPlan, id=plan_id, is_active=True)
+        try:
+            plan = plans.get_active(int(plan_id))
+        except (TypeError, ValueError):
+            plan = None
+        if plan is None:
+            raise Http404('No active plan matches the given query.')
         user = request.user
         
         # Check if user is dealer
@@ -173,34 +233,43 @@ class PurchaseSubscriptionView(generics.CreateAPIView):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        # Deduct EGP from wallet
-        success, txn, error = WalletManager.deduct_from_wallet(
-            user,
-            plan.price_egp,
-            'egp',
-            f"Subscription: {plan.get_name_display()}",
-            transaction_type='subscription'
-        )
-        
-        if not success:
-            return Response(
-                {'detail': error},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Update dealer profile with subscription
         from django.utils import timezone
         from datetime import timedelta
+        from config.payments.models import SubscriptionTransaction
         
-        dealer_profile = DealerProfile.objects.get(user=user)
-        dealer_profile.subscription_plan = plan
-        dealer_profile.subscription_start_date = timezone.now()
-        dealer_profile.subscription_end_date = timezone.now() + timedelta(days=plan.duration_days)
-        dealer_profile.save()
+        # Wallet first, then profile: the order renew_subscriptions locks them in
+        with transaction.atomic():
+            # Deduct EGP from wallet
+            success, txn, error = WalletManager.deduct_from_wallet(
+                user,
+                plan.price_egp,
+                'egp',
+                f"Subscription: {plan.get_name_display()}",
+                transaction_type='subscription'
+            )
+            
+            if not success:
+                return Response(
+                    {'detail': error},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            # Update dealer profile with subscription
+            now = timezone.now()
+            dealer_profile = DealerProfile.objects.select_for_update().get(user=user)
+            dealer_profile.subscription_plan = plan
+            dealer_profile.subscription_start_date = now
+            dealer_profile.subscription_end_date = now + timedelta(days=plan.duration_days)
+            dealer_profile.save()
+            
+            SubscriptionTransaction.objects.create(
+                user=user, plan=plan, amount_egp=plan.price_egp, status='completed', transaction=txn,
+                start_date=now, end_date=dealer_profile.subscription_end_date, completed_at=now,
+            )
         
         return Response({
             'detail': f'Successfully subscribed to {plan.get_name_display()}',
-            'plan': SubscriptionPlanSerializer(plan).data,
+            'plan': plans.data(plan.pk),
             'expires_at': dealer_profile.subscription_end_date
         }, status=status.HTTP_200_OK)
 
@@ -215,31 +284,9 @@ class PasswordResetRequestView(generics.GenericAPIView):
         serializer.is_valid(raise_exception=True)
         email = serializer.validated_data['email']
         
-        try:
-            user = User.objects.get(email=email)
-            token = default_token_generator.make_token(user)
-            uid = urlsafe_base64_encode(force_bytes(user.pk))
-            
-            # Build reset URL
-            reset_url = f"{settings.FRONTEND_URL}/reset-password/{uid}/{token}/"
-            
-            subject = "Password Reset Request"
-            message = f"""
-            Hello {user.first_name},
-            
-            Click the link below to reset your password:
-            {reset_url}
-            
-            This link will expire in 24 hours.
-            
-            Best regards,
-            {settings.PLATFORM_NAME}
-            """
-            
-            send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [email])
-        
-        except User.DoesNotExist:
-            pass  # Don't reveal if email exists
+        # The account is looked up by the email worker, so this takes the
+        # same time whether or not the address is registered
+        outbox.queue_password_reset(email)
         
         return Response({
             'detail': 'Password reset email sent if account exists'
@@ -335,12 +382,26 @@ class WalletBalanceView(APIView):
         }, status=status.HTTP_200_OK)
         
 
+class EmailVerificationRequestView(APIView):
+    """Queue a verification email for the current user"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        user = request.user
+        if user.email_verified:
+            return Response({'detail': 'Email already verified.'}, status=status.HTTP_200_OK)
+        if not user.email:
+            return Response({'detail': 'Add an email address first.'}, status=status.HTTP_400_BAD_REQUEST)
+        outbox.queue_email_verification(user)
+        return Response({'detail': 'Verification email sent.'}, status=status.HTTP_202_ACCEPTED)
+
+
 class EmailVerificationConfirmView(APIView):
     permission_classes = [permissions.AllowAny]
 
     def get(self, request, token):
         try:
-            data = signing.loads(token, salt='email-verify', max_age=172800)
+            data = signing.loads(token, salt=outbox.VERIFY_EMAIL_SALT, max_age=172800)
             User = get_user_model()
             user = User.objects.get(id=data['user_id'])
             user.email_verified = True
@@ -10,10 +10,16 @@ from datetime import timedelta, datetime
 from config.permissions import IsAdmin
 from django_filters.rest_framework import DjangoFilterBackend
 from config.accounts.models import User, DealerProfile, SubscriptionPlan
-from config.accounts.serializers import UserDetailSerializer, DealerProfileSerializer, SubscriptionPlanSerializer
+from config.accounts import provisioning
+from config.accounts.serializers import (
+    BulkProvisionSerializer, UserDetailSerializer, DealerProfileSerializer, SubscriptionPlanSerializer
+)
+from config.accounts.tokens import CLAIM_FIELDS, revoke_user_tokens
 from config.payments.models import Transaction, FinancialReport, GoldMassConversionRate
 from config.payments.serializers import GoldMassConversionRateSerializer
 from config.products.models import Product
+from config.products import moderation
+from config.products.serializers import BulkModerationSerializer, ProductDetailSerializer
 from config.orders.models import Order
 
 
@@ -26,6 +32,29 @@ class AdminUserManagementViewSet(viewsets.ModelViewSet):
     filterset_fields = ['role', 'is_approved']
     ordering = ['-created_at']
     
+    def perform_update(self, serializer):
+        before = [getattr(serializer.instance, field) for field in CLAIM_FIELDS + ('is_active',)]
+        user = serializer.save()
+        # Tokens carry the old role claims; make the user log in again
+        if before != [getattr(user, field) for field in CLAIM_FIELDS + ('is_active',)]:
+            revoke_user_tokens(user)
+    
+    @action(detail=False, methods=['post'])
+    def bulk_provision(self, request):
+        """Create many users with their dealer profiles in batches"""
+        serializer = BulkProvisionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        created = skipped = 0
+        for batch_created, batch_skipped in provisioning.bulk_provision(serializer.validated_data['users']):
+            created += batch_created
+            skipped += batch_skipped
+        
+        return Response(
+            {'detail': f'{created} users created', 'created': created, 'skipped': skipped},
+            status=status.HTTP_201_CREATED
+        )
+    
     @action(detail=True, methods=['post'])
     def approve_dealer(self, request, pk=None):
         """Approve a dealer account"""
@@ -38,6 +67,7 @@ class AdminUserManagementViewSet(viewsets.ModelViewSet):
         
         user.is_approved = True
         user.save()
+        revoke_user_tokens(user)
         
         return Response({
             'detail': 'Dealer approved',
@@ -52,6 +82,7 @@ class AdminUserManagementViewSet(viewsets.ModelViewSet):
         
         user.is_active = False
         user.save()
+        revoke_user_tokens(user)
         
         return Response({
             'detail': f'User suspended: {reason}',
@@ -64,6 +95,7 @@ class AdminUserManagementViewSet(viewsets.ModelViewSet):
         user = self.get_object()
         user.is_active = True
         user.save()
+        revoke_user_tokens(user)
         
         return Response({
             'detail': 'User activated',
@@ -100,24 +132,29 @@ class AdminDealerManagementViewSet(viewsets.ModelViewSet):
 class AdminProductModerationViewSet(viewsets.ReadOnlyModelViewSet):
     """Admin product moderation"""
     queryset = Product.objects.all()
+    serializer_class = ProductDetailSerializer
     permission_classes = [IsAdmin]
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['status', 'category']
     ordering = ['created_at']
     
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            # Products another moderator has claimed aren't offered to anyone else
+            queryset = queryset.filter(moderation.available_to(self.request.user))
+        return queryset
+    
+    def handle_exception(self, exc):
+        if isinstance(exc, moderation.LeaseHeld):
+            return Response({'detail': str(exc), 'ids': exc.ids}, status=status.HTTP_409_CONFLICT)
+        return super().handle_exception(exc)
+    
     @action(detail=True, methods=['post'])
     def approve(self, request, pk=None):
         """Approve product"""
         product = self.get_object()
-        product.status = 'approved'
-        product.reviewed_by = request.user
-        product.reviewed_at = timezone.now()
-        product.publish_date = timezone.now()
-        
-        if product.listing_duration_days:
-            product.expires_at = timezone.now() + timedelta(days=product.listing_duration_days)
-        
-        product.save()
+        moderation.approve(Product.objects.filter(pk=product.pk), request.user)
         
         return Response({'detail': 'Product approved'})
     
@@ -127,13 +164,85 @@ class AdminProductModerationViewSet(viewsets.ReadOnlyModelViewSet):
         product = self.get_object()
         reason = request.data.get('reason', 'Not specified')
         
-        product.status = 'rejected'
-        product.rejection_reason = reason
-        product.reviewed_by = request.user
-        product.reviewed_at = timezone.now()
-        product.save()
+        moderation.reject(Product.objects.filter(pk=product.pk), request.user, reason)
         
         return Response({'detail': f'Product rejected: {reason}'})
+    
+    @action(detail=True, methods=['post'])
+    def suspend(self, request, pk=None):
+        """Suspend product"""
+        product = self.get_object()
+        reason = request.data.get('reason', 'Not specified')
+        
+        moderation.suspend(Product.objects.filter(pk=product.pk), request.user)
+        
+        return Response({'detail': f'Product suspended: {reason}'})
+    
+    def _bulk_selection(self, request):
+        serializer = BulkModerationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.get_queryset(), serializer.validated_data['reason']
+    
+    @action(detail=False, methods=['post'])
+    def bulk_approve(self, request):
+        """Approve every product matching `ids` and/or filters in one UPDATE"""
+        queryset, _ = self._bulk_selection(request)
+        count = moderation.approve(queryset, request.user)
+        
+        return Response({'detail': f'{count} products approved', 'count': count})
+    
+    @action(detail=False, methods=['post'])
+    def bulk_reject(self, request):
+        """Reject every product matching `ids` and/or filters in one UPDATE"""
+        queryset, reason = self._bulk_selection(request)
+        count = moderation.reject(queryset, request.user, reason)
+        
+        return Response({'detail': f'{count} products rejected: {reason}', 'count': count})
+    
+    @action(detail=False, methods=['post'])
+    def bulk_suspend(self, request):
+        """Suspend every product matching `ids` and/or filters in one UPDATE"""
+        queryset, reason = self._bulk_selection(request)
+        count = moderation.suspend(queryset, request.user)
+        
+        return Response({'detail': f'{count} products suspended: {reason}', 'count': count})
+    
+    @action(detail=False, methods=['post'], url_path='queue/claim')
+    def queue_claim(self, request):
+        """Lease the oldest unclaimed pending products to the requesting moderator"""
+        try:
+            size = min(max(int(request.data.get('size', 20)), 1), 100)
+        except (TypeError, ValueError):
+            return Response(
+                {'detail': 'size must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        products = moderation.claim_batch(request.user, size)
+        serializer = self.get_serializer(products, many=True)
+        return Response({'count': len(serializer.data), 'results': serializer.data})
+    
+    @action(detail=False, methods=['post'], url_path='queue/release')
+    def queue_release(self, request):
+        """Return claimed products (all, or the given `ids`) to the queue"""
+        count = moderation.release(request.user, request.data.get('ids'))
+        
+        return Response({'detail': f'{count} products released', 'count': count})
+    
+    @action(detail=False, methods=['get'], url_path='queue/stats')
+    def queue_stats(self, request):
+        """Per-moderator decisions and throughput over the last `hours` (default 24)"""
+        try:
+            hours = int(request.query_params.get('hours', 24))
+        except ValueError:
+            hours = 24
+        since = timezone.now() - timedelta(hours=hours)
+        
+        return Response({
+            'hours': hours,
+            'pending': Product.objects.filter(status='pending').count(),
+            'moderators': moderation.moderator_stats(since),
+        })
 
 
 class AdminFinancialReportView(generics.GenericAPIView):
@@ -0,0 +1,35 @@
+"""
+Helpers shared by the ``bench_*`` management commands.
+
+Benchmarks seed their own fixtures inside a transaction that is always
+rolled back, so they can be pointed at a development database safely.
+"""
+import time
+from contextlib import contextmanager
+
+from django.db import transaction
+
+
+class _Rollback(Exception):
+    pass
+
+
+@contextmanager
+def rolled_back():
+    """Run the block in a transaction and discard everything it wrote"""
+    try:
+        with transaction.atomic():
+            yield
+            raise _Rollback
+    except _Rollback:
+        pass
+
+
+def measure(func, iterations):
+    """Call func `iterations` times; return (wall seconds, CPU seconds, calls/s)"""
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    for _ in range(iterations):
+        func()
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    return wall, cpu, (iterations / wall if wall else float('inf'))
@@ -1,3 +1,163 @@
-from django.test import TestCase
+from decimal import Decimal
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from config.accounts.models import EGPWallet, User
+from config.orders.models import Order
+from config.payments import saga
+from config.payments.models import Payment, Transaction
+from config.payments.payment_gateway import MockPaymentGateway
+from config.payments.stub_server import StubGatewayServer
+
+
+class RecordingGateway(MockPaymentGateway):
+    """Mock gateway noting the transaction depth of each charge; `during`
+    runs inside the charge, standing in for a concurrent request"""
+    depths = []
+    during = None
+
+    def process_payment(self, *args, **kwargs):
+        RecordingGateway.depths.append(len(connection.atomic_blocks))
+        if RecordingGateway.during:
+            RecordingGateway.during()
+        return super().process_payment(*args, **kwargs)
+
+
+RECORDING = {'BACKEND': 'config.orders.tests.RecordingGateway', 'OPTIONS': {}}
+
+
+class OrderPaymentTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='buyer', password='pass12345')
+        self.client.force_authenticate(self.user)
+        EGPWallet.objects.create(user=self.user, balance=Decimal('500.00'))
+        self.order = Order.objects.create(user=self.user, total_amount=Decimal('100.00'))
+        RecordingGateway.depths = []
+        RecordingGateway.during = None
+
+    def pay(self):
+        return self.client.post(f'/api/orders/orders/{self.order.pk}/process_payment/')
+
+    def balance(self):
+        return EGPWallet.objects.get(user=self.user).balance
+
+    @override_settings(PAYMENT_GATEWAY=RECORDING)
+    def test_gateway_is_called_outside_transactions(self):
+        depth = len(connection.atomic_blocks)  # the test case's own
+        response = self.pay()
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(RecordingGateway.depths, [depth])
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'paid')
+        self.assertEqual(self.order.egp_amount, Decimal('100.00'))
+        self.assertEqual(self.balance(), Decimal('400.00'))
+
+    @override_settings(PAYMENT_GATEWAY=RECORDING)
+    def test_short_balance_is_not_charged(self):
+        EGPWallet.objects.filter(user=self.user).update(balance=Decimal('50.00'))
+        response = self.pay()
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Insufficient EGP balance', response.data['detail'])
+        self.assertEqual(RecordingGateway.depths, [])
+
+    @override_settings(PAYMENT_GATEWAY=RECORDING)
+    def test_order_cancelled_during_charge_is_refunded(self):
+        RecordingGateway.during = lambda: Order.objects.filter(pk=self.order.pk).update(status='cancelled')
+        response = self.pay()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['detail'], 'Order already processed')
+        self.assertEqual(response.data['payment']['status'], 'refunded')
+        self.assertEqual(self.balance(), Decimal('500.00'))
+
+    @override_settings(PAYMENT_GATEWAY=RECORDING)
+    def test_one_payment_at_a_time(self):
+        saga.reserve(self.order, self.user)  # a request still waiting on the gateway
+        response = self.pay()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['detail'], 'Payment already in progress')
+        self.assertEqual(RecordingGateway.depths, [])
+
+
+class OrderPaymentOverHTTPTests(TestCase):
+    def setUp(self):
+        self.server = StubGatewayServer().start()
+        self.addCleanup(self.server.stop)
+        settings = override_settings(PAYMENT_GATEWAY={
+            'BACKEND': 'config.payments.payment_gateway.HTTPPaymentGateway',
+            'OPTIONS': {'base_url': self.server.url},
+        })
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='buyer', password='pass12345')
+        self.client.force_authenticate(self.user)
+        EGPWallet.objects.create(user=self.user, balance=Decimal('500.00'))
+        self.order = Order.objects.create(user=self.user, total_amount=Decimal('100.00'))
+
+    def pay(self):
+        return self.client.post(f'/api/orders/orders/{self.order.pk}/process_payment/')
+
+    def balance(self):
+        return EGPWallet.objects.get(user=self.user).balance
+
+    def test_payment(self):
+        response = self.pay()
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(len(self.server.payments), 1)
+        self.assertEqual(self.balance(), Decimal('400.00'))
+
+    def test_provider_outage_is_left_to_the_worker(self):
+        self.server.fail_next(status=503)
+        response = self.pay()
+        self.assertEqual(response.status_code, 202, response.data)
+        self.assertEqual(response.data['payment']['status'], 'reserved')
+        self.assertEqual(self.balance(), Decimal('400.00'))  # held
+
+        Payment.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(list(saga.process_due()), [{'completed': 1}])
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'paid')
+        self.assertEqual(len(self.server.payments), 1)
+        self.assertEqual(self.balance(), Decimal('400.00'))
+
+    def test_decline_releases_the_funds(self):
+        self.server.fail_next(status=402)
+        response = self.pay()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['detail'], 'Payment failed: Simulated outage')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'pending')
+        self.assertEqual(self.balance(), Decimal('500.00'))
+        self.assertEqual(Transaction.objects.get(order=self.order).status, 'reversed')
+
+    def cancel(self):
+        return self.client.post(f'/api/orders/orders/{self.order.pk}/cancel/')
+
+    def test_cancel_between_reserve_and_charge(self):
+        payment, _ = saga.reserve(self.order, self.user)  # request about to call the gateway
+        response = self.cancel()
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['order']['status'], 'cancelled')
+        self.assertEqual(response.data['payment']['status'], 'reserved')
+
+        payment = saga.settle(payment)  # the request carries on
+        self.assertEqual(payment.status, 'refunded')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'cancelled')
+        (charge,) = self.server.payments.values()
+        self.assertEqual(charge['refunded'], Decimal('100.00'))
+        self.assertEqual(self.balance(), Decimal('500.00'))
+
+    def test_cancel_paid_order_refunds_the_charge(self):
+        self.assertEqual(self.pay().status_code, 200)
+        response = self.cancel()
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['payment']['status'], 'refunded')
+        (charge,) = self.server.payments.values()
+        self.assertEqual(charge['refunded'], Decimal('100.00'))
+        self.assertEqual(self.balance(), Decimal('500.00'))
+        self.assertEqual(self.cancel().data['detail'], 'Cannot cancel this order')
@@ -15,7 +15,8 @@ from config.orders.serializers import (
 from config.products.models import Product
 from config.wallet_utils import WalletManager
 from config.permissions import is_admin_user
-from config.payments.payment_gateway import payment_gateway
+from config.payments import saga
+from config.payments.models import Payment
 from decimal import Decimal
 from config.permissions import is_admin_user
 
@@ -184,7 +185,13 @@ class OrderViewSet(viewsets.ReadOnlyModelViewSet):
     
     @action(detail=True, methods=['post'])
     def process_payment(self, request, pk=None):
-        """Process payment for order using payment gateway"""
+        """Process payment for order using payment gateway.
+        
+        Runs the payment saga (see config/payments/saga.py): funds are held
+        in the wallet, the gateway is charged outside any transaction and
+        the result is recorded in a short one. If the gateway doesn't
+        answer, the payment is left to process_payments and 202 returned.
+        """
         order = self.get_object()
         
         if order.user != request.user and not is_admin_user(request.user):
@@ -199,70 +206,39 @@ class OrderViewSet(viewsets.ReadOnlyModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        payment_method = order.payment_method
-        total_amount = order.total_amount
+        payment, error = saga.reserve(order, request.user)
+        if payment is None:
+            return Response({'detail': error}, status=status.HTTP_400_BAD_REQUEST)
         
-        with transaction.atomic():
-            # Process payment through gateway
-            gateway_result = payment_gateway.process_payment(
-                total_amount,
-                payment_method,
-                f"Order #{order.id}",
-                metadata={'order_id': order.id, 'user_id': request.user.id}
-            )
-            
-            if not gateway_result.success:
-                return Response(
-                    {'detail': f'Payment failed: {gateway_result.error}'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            # Deduct from wallet after successful gateway processing
-            success, txn, error = WalletManager.deduct_from_wallet(
-                request.user,
-                total_amount,
-                payment_method,
-                f"Order #{order.id} - Gateway: {gateway_result.transaction_id}",
-                transaction_type='purchase',
-                order=order
-            )
-            
-            if not success:
-                # Payment gateway succeeded but wallet deduction failed
-                # In production, refund via gateway here
-                return Response(
-                    {'detail': f'Wallet deduction failed: {error}'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            # Update order status
-            order.status = 'paid'
-            order.paid_at = timezone.now()
-            
-            # Store payment amount by currency
-            if payment_method == 'egp':
-                order.egp_amount = total_amount
-            elif payment_method == 'gold':
-                order.gold_amount = total_amount
-            elif payment_method == 'mass':
-                order.mass_amount = total_amount
-            
-            order.save()
+        payment = saga.settle(payment)
+        payment_data = {
+            'id': payment.id,
+            'gateway_transaction': payment.gateway_transaction_id,
+            'status': payment.status,
+            'amount': float(payment.amount),
+            'currency': payment.currency
+        }
         
-        return Response({
-            'detail': 'Payment processed successfully',
-            'order': OrderDetailSerializer(order).data,
-            'payment': {
-                'gateway_transaction': gateway_result.transaction_id,
-                'status': 'completed',
-                'amount': float(total_amount),
-                'currency': payment_method
-            }
-        }, status=status.HTTP_200_OK)
+        if payment.status == 'completed':
+            order.refresh_from_db()
+            return Response({
+                'detail': 'Payment processed successfully',
+                'order': OrderDetailSerializer(order).data,
+                'payment': payment_data
+            }, status=status.HTTP_200_OK)
+        
+        if payment.status in Payment.ACTIVE_STATUSES:
+            return Response({
+                'detail': 'Payment is being processed',
+                'payment': payment_data
+            }, status=status.HTTP_202_ACCEPTED)
+        
+        detail = payment.last_error if payment.status == 'refunded' else f'Payment failed: {payment.last_error}'
+        return Response({'detail': detail, 'payment': payment_data}, status=status.HTTP_400_BAD_REQUEST)
     
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
-        """Cancel order and refund"""
+        """Cancel order and refund (see config/payments/saga.py)"""
         order = self.get_object()
         
         if order.user != request.user and not is_admin_user(request.user):
@@ -271,39 +247,16 @@ class OrderViewSet(viewsets.ReadOnlyModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        if order.status not in ['pending', 'paid']:
-            return Response(
-                {'detail': 'Cannot cancel this order'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        with transaction.atomic():
-            # Refund if paid
-            if order.status == 'paid':
-                amount = order.total_amount
-                payment_method = order.payment_method
-                
-                success, txn, error = WalletManager.add_to_wallet(
-                    order.user,
-                    amount,
-                    payment_method,
-                    f"Refund for Order #{order.id}",
-                    transaction_type='refund',
-                    order=order
-                )
-                
-                if not success:
-                    return Response(
-                        {'detail': error},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-            
-            # Update order status
-            order.status = 'cancelled'
-            order.save()
+        payment, error = saga.cancel(order)
+        if error:
+            return Response({'detail': error}, status=status.HTTP_400_BAD_REQUEST)
+        if payment is not None and payment.status == 'refunding':
+            payment = saga.settle(payment)
+        order.refresh_from_db()
         
         return Response({
             'detail': 'Order cancelled',
-            'order': OrderDetailSerializer(order).data
+            'order': OrderDetailSerializer(order).data,
+            'payment': {'id': payment.id, 'status': payment.status} if payment else None
         }, status=status.HTTP_200_OK)
 
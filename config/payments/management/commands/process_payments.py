@@ -0,0 +1,39 @@
+"""
+Finish order payments the request couldn't.
+
+Advances due payments in the saga (see config/payments/saga.py): charges
+that got no answer are retried with the same idempotency key, charges for
+orders cancelled meanwhile are refunded, and payments abandoned by a
+crashed request are picked up once their lease runs out. Run it from cron,
+or keep it running with --loop:
+    * * * * * python manage.py process_payments --batch-size 100
+    python manage.py process_payments --loop --interval 5
+"""
+from collections import Counter
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from config.payments import saga
+
+
+class Command(BaseCommand):
+    help = 'Retry, confirm or refund unfinished order payments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help='Keep polling for due payments')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            totals = Counter()
+            for counts in saga.process_due(options['batch_size']):
+                totals.update(counts)
+            if totals:
+                self.stdout.write(', '.join(f'{count} {status}' for status, count in totals.items()))
+            if not options['loop']:
+                return
+            close_old_connections()
+            time.sleep(options['interval'])
@@ -0,0 +1,33 @@
+"""
+Serve the local payment provider stand-in (config/payments/stub_server.py)
+in the foreground, e.g. to try HTTPPaymentGateway by hand:
+    python manage.py run_payment_stub --port 8099 --latency-ms 150
+and point PAYMENT_GATEWAY at it:
+    {'BACKEND': 'config.payments.payment_gateway.HTTPPaymentGateway',
+     'OPTIONS': {'base_url': 'http://127.0.0.1:8099'}}
+"""
+from django.core.management.base import BaseCommand
+
+from config.payments.stub_server import StubGatewayServer
+
+
+class Command(BaseCommand):
+    help = 'Run a local stand-in for the HTTP payment provider'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8099)
+        parser.add_argument('--latency-ms', type=int, default=0, help='Delay added to every response')
+        parser.add_argument('--api-key', default='', help='Require this bearer key')
+
+    def handle(self, *args, **options):
+        server = StubGatewayServer(
+            options['host'], options['port'], latency=options['latency_ms'] / 1000, api_key=options['api_key']
+        )
+        self.stdout.write(f'Payment stub listening on {server.url} (Ctrl+C to stop)')
+        try:
+            server.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.httpd.server_close()
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-19 07:06
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0002_cart_cartitem_alter_order_options_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('payments', '0002_subscriptiontransaction_expired'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Payment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(choices=[('egp', 'Egyptian Pound'), ('gold', 'Gold'), ('mass', 'Mass')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('status', models.CharField(choices=[('reserved', 'Funds reserved'), ('refunding', 'Refunding'), ('completed', 'Completed'), ('declined', 'Declined'), ('refunded', 'Refunded'), ('failed', 'Failed')], default='reserved', max_length=20)),
+                ('idempotency_key', models.CharField(editable=False, max_length=64, unique=True)),
+                ('gateway_transaction_id', models.CharField(blank=True, max_length=100)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('claim_id', models.UUIDField(blank=True, editable=False, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payments', to='orders.order')),
+                ('transaction', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='payment', to='payments.transaction')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payments', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='payments_pa_status_ac958e_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='payment',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ('reserved', 'refunding'))), fields=('order',), name='payments_one_active_payment_per_order'),
+        ),
+    ]
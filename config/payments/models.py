@@ -75,6 +75,53 @@ class Transaction(models.Model):
         return f"{self.user.username} - {self.transaction_type} {self.amount} {self.get_currency_display()}"
 
 
+class Payment(models.Model):
+    """One attempt to pay an order through the gateway (see config/payments/saga.py)"""
+    STATUS_CHOICES = (
+        ('reserved', 'Funds reserved'),
+        ('refunding', 'Refunding'),
+        ('completed', 'Completed'),
+        ('declined', 'Declined'),
+        ('refunded', 'Refunded'),
+        ('failed', 'Failed'),
+    )
+    # Still owned by the saga: charged, or to be charged or refunded
+    ACTIVE_STATUSES = ('reserved', 'refunding')
+    
+    order = models.ForeignKey('orders.Order', on_delete=models.CASCADE, related_name='payments')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='payments')
+    currency = models.CharField(max_length=20, choices=Transaction.CURRENCY_CHOICES)
+    amount = models.DecimalField(max_digits=15, decimal_places=2)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='reserved')
+    # The wallet debit holding the funds: pending, then completed or reversed
+    transaction = models.OneToOneField(Transaction, on_delete=models.CASCADE, related_name='payment')
+    # Sent with every charge (and, suffixed, refund) so retries are charged once
+    idempotency_key = models.CharField(max_length=64, unique=True, editable=False)
+    gateway_transaction_id = models.CharField(max_length=100, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # Active: the worker takes it up at this time (a lease while someone works on it)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim_id = models.UUIDField(null=True, blank=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['order'], condition=models.Q(status__in=('reserved', 'refunding')),
+                name='payments_one_active_payment_per_order',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"Order #{self.order_id} - {self.amount} {self.get_currency_display()} ({self.status})"
+
+
 class GoldMassConversionRate(models.Model):
     """Exchange rates for Gold and Mass"""
     # EGP to Gold rate: 1 EGP = ? Gold
@@ -110,7 +157,7 @@ class SubscriptionTransaction(models.Model):
     amount_egp = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(
         max_length=20,
-        choices=[('pending', 'Pending'), ('completed', 'Completed'), ('failed', 'Failed')],
+        choices=[('pending', 'Pending'), ('completed', 'Completed'), ('failed', 'Failed'), ('expired', 'Expired')],
         default='pending'
     )
     transaction = models.ForeignKey(Transaction, on_delete=models.SET_NULL, null=True, blank=True)
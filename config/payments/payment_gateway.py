@@ -1,14 +1,33 @@
 """
-Mock Payment Gateway for DeepProTeam Marketplace
+Payment Gateways for DeepProTeam Marketplace
 Provides a pluggable interface for payment processing.
-Replace MockPaymentGateway with real providers (Stripe, PayPal) by changing the import.
+Pick the implementation with the PAYMENT_GATEWAY setting and get it from
+get_payment_gateway():
+
+* MockPaymentGateway - in memory, for development;
+* HTTPPaymentGateway - a provider reached over HTTP(S) with pooled
+  keep-alive connections and connect/read timeouts. stub_server.py is a
+  local stand-in speaking the same protocol, for tests and benchmarks.
+
+Gateway calls are network round-trips: never make them inside
+transaction.atomic() or while holding row locks. Every gateway also offers
+async variants (aprocess_payment, arefund_payment).
 """
 
 from decimal import Decimal
 from enum import Enum
+from urllib.parse import urlsplit
+import http.client
+import json
+import queue
+import threading
 import uuid
 from datetime import datetime
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+
 
 class PaymentStatus(Enum):
     """Payment status enum"""
@@ -22,11 +41,14 @@ class PaymentResult:
     """Result object for payment operations"""
     
     def __init__(self, success: bool, transaction_id: str = None, 
-                 error: str = None, details: dict = None):
+                 error: str = None, details: dict = None, retryable: bool = False):
         self.success = success
         self.transaction_id = transaction_id or str(uuid.uuid4())
         self.error = error
         self.details = details or {}
+        # The outcome is unknown (timeout, connection lost): retrying with
+        # the same idempotency key is safe, giving up is not
+        self.retryable = retryable
         self.timestamp = datetime.utcnow().isoformat()
 
 
@@ -34,7 +56,8 @@ class BasePaymentGateway:
     """Base class for payment gateway implementations"""
     
     def process_payment(self, amount: Decimal, currency: str, 
-                       description: str, metadata: dict = None) -> PaymentResult:
+                       description: str, metadata: dict = None,
+                       idempotency_key: str = None) -> PaymentResult:
         """
         Process a payment.
         
@@ -43,24 +66,39 @@ class BasePaymentGateway:
             currency: Currency code ('egp', 'gold', 'mass')
             description: Payment description
             metadata: Optional metadata (user_id, order_id, etc.)
+            idempotency_key: Repeating a call with the same key returns the
+                first result instead of charging twice
         
         Returns:
             PaymentResult with success status and transaction ID
         """
         raise NotImplementedError
     
-    def refund_payment(self, transaction_id: str, amount: Decimal = None) -> PaymentResult:
+    def refund_payment(self, transaction_id: str, amount: Decimal = None,
+                       idempotency_key: str = None) -> PaymentResult:
         """
         Refund a payment.
         
         Args:
             transaction_id: Original transaction ID
             amount: Partial refund amount (None = full refund)
+            idempotency_key: As for process_payment
         
         Returns:
             PaymentResult
         """
         raise NotImplementedError
+    
+    async def aprocess_payment(self, *args, **kwargs) -> PaymentResult:
+        """process_payment for async callers (runs in a worker thread)"""
+        return await sync_to_async(self.process_payment, thread_sensitive=False)(*args, **kwargs)
+    
+    async def arefund_payment(self, *args, **kwargs) -> PaymentResult:
+        """refund_payment for async callers (runs in a worker thread)"""
+        return await sync_to_async(self.refund_payment, thread_sensitive=False)(*args, **kwargs)
+    
+    def close(self):
+        """Release pooled resources"""
 
 
 class MockPaymentGateway(BasePaymentGateway):
@@ -77,17 +115,26 @@ class MockPaymentGateway(BasePaymentGateway):
         )
     """
     
-    def __init__(self):
+    def __init__(self, **options):
         self.transactions = {}  # In-memory store for testing
         self.refunds = {}
+        self.results = {}  # idempotency key -> PaymentResult
     
     def process_payment(self, amount: Decimal, currency: str, 
-                       description: str, metadata: dict = None) -> PaymentResult:
+                       description: str, metadata: dict = None,
+                       idempotency_key: str = None) -> PaymentResult:
         """
         Mock payment processing.
         Returns success unless metadata['fail'] = True.
         """
-        metadata = metadata or {}
+        if idempotency_key in self.results:
+            return self.results[idempotency_key]
+        result = self._process(amount, currency, description, metadata or {})
+        if idempotency_key:
+            self.results[idempotency_key] = result
+        return result
+    
+    def _process(self, amount, currency, description, metadata):
         
         # Simulate failure if requested (for testing error paths)
         if metadata.get('fail'):
@@ -121,10 +168,19 @@ class MockPaymentGateway(BasePaymentGateway):
             }
         )
     
-    def refund_payment(self, transaction_id: str, amount: Decimal = None) -> PaymentResult:
+    def refund_payment(self, transaction_id: str, amount: Decimal = None,
+                       idempotency_key: str = None) -> PaymentResult:
         """
         Mock refund processing.
         """
+        if idempotency_key in self.results:
+            return self.results[idempotency_key]
+        result = self._refund(transaction_id, amount)
+        if idempotency_key:
+            self.results[idempotency_key] = result
+        return result
+    
+    def _refund(self, transaction_id, amount):
         if transaction_id not in self.transactions:
             return PaymentResult(
                 success=False,
@@ -165,9 +221,156 @@ class MockPaymentGateway(BasePaymentGateway):
         return self.transactions.get(transaction_id)
 
 
-# Production gateway would be imported conditionally:
-# from config.payments.stripe_gateway import StripePaymentGateway
-# Or from config.payments.paypal_gateway import PayPalPaymentGateway
+class GatewayUnavailable(Exception):
+    """No pooled connection became free within the pool timeout"""
+
+
+class ConnectionPool:
+    """
+    Keep-alive connections to one gateway host, shared by all threads.
+    
+    At most `size` requests are in flight; a caller waits up to
+    `pool_timeout` seconds for a free connection. Connections are reused
+    until the server closes them, so a request skips the TCP (and TLS)
+    handshake.
+    """
+    
+    def __init__(self, base_url, size=10, connect_timeout=3.0, read_timeout=10.0, pool_timeout=5.0):
+        parts = urlsplit(base_url)
+        self.connection_class = (
+            http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        )
+        self.host, self.port = parts.hostname, parts.port
+        self.prefix = parts.path.rstrip('/')
+        self.connect_timeout, self.read_timeout, self.pool_timeout = connect_timeout, read_timeout, pool_timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+        self.created = 0  # connections opened so far
+    
+    def _connect(self):
+        conn = self.connection_class(self.host, self.port, timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        self.created += 1
+        return conn
+    
+    def request(self, method, path, body=None, headers=None):
+        """Send a request; returns (status, parsed JSON body)"""
+        if not self._slots.acquire(timeout=self.pool_timeout):
+            raise GatewayUnavailable(f'No free gateway connection within {self.pool_timeout}s')
+        try:
+            try:
+                conn, reused = self._idle.get_nowait(), True
+            except queue.Empty:
+                conn, reused = self._connect(), False
+            try:
+                return self._send(conn, method, path, body, headers)
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                conn.close()
+                if not reused:
+                    raise
+                # The server dropped an idle keep-alive connection. Sending
+                # again is safe: every request carries an idempotency key
+                conn = self._connect()
+                return self._send(conn, method, path, body, headers)
+            except BaseException:
+                conn.close()
+                raise
+        finally:
+            self._slots.release()
+    
+    def _send(self, conn, method, path, body, headers):
+        conn.request(method, self.prefix + path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        data = response.read()
+        if response.will_close:
+            conn.close()
+        else:
+            self._idle.put(conn)
+        return response.status, json.loads(data or b'{}')
+    
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class HTTPPaymentGateway(BasePaymentGateway):
+    """
+    Payment provider reached over HTTP(S).
+    
+    Protocol (JSON bodies, bearer API key, Idempotency-Key header):
+        POST /payments                {amount, currency, description, metadata}
+             201 {id, status} | 402 {error}
+        POST /payments/<id>/refunds   {amount}
+             201 {id, status} | 4xx {error}
+    
+    Timeouts and lost connections come back as a failed PaymentResult with
+    retryable=True: the provider may or may not have acted on the request.
+    """
+    
+    def __init__(self, base_url, api_key='', pool_size=10, connect_timeout=3.0,
+                 read_timeout=10.0, pool_timeout=5.0):
+        self.api_key = api_key
+        self.pool = ConnectionPool(base_url, pool_size, connect_timeout, read_timeout, pool_timeout)
+    
+    def _call(self, path, payload, idempotency_key):
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {self.api_key}',
+            'Idempotency-Key': idempotency_key or uuid.uuid4().hex,
+        }
+        try:
+            status, data = self.pool.request('POST', path, json.dumps(payload), headers)
+        except GatewayUnavailable as e:
+            # Nothing was sent
+            return PaymentResult(success=False, error=str(e))
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            return PaymentResult(success=False, error=f'Gateway unreachable: {e}', retryable=True)
+        if status >= 500:
+            return PaymentResult(success=False, error=data.get('error', f'Gateway error {status}'),
+                                 details=data, retryable=True)
+        if status >= 400:
+            return PaymentResult(success=False, error=data.get('error', f'Gateway error {status}'), details=data)
+        return PaymentResult(success=True, transaction_id=data['id'], details=data)
+    
+    def process_payment(self, amount: Decimal, currency: str, 
+                       description: str, metadata: dict = None,
+                       idempotency_key: str = None) -> PaymentResult:
+        return self._call('/payments', {
+            'amount': str(amount),
+            'currency': currency,
+            'description': description,
+            'metadata': metadata or {},
+        }, idempotency_key)
+    
+    def refund_payment(self, transaction_id: str, amount: Decimal = None,
+                       idempotency_key: str = None) -> PaymentResult:
+        return self._call(
+            f'/payments/{transaction_id}/refunds',
+            {'amount': str(amount) if amount is not None else None},
+            idempotency_key,
+        )
+    
+    def close(self):
+        self.pool.close()
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
 
-# For now, default to mock
-payment_gateway = MockPaymentGateway()
+def get_payment_gateway() -> BasePaymentGateway:
+    """The gateway configured by PAYMENT_GATEWAY, shared by the process"""
+    global _gateway
+    config = getattr(settings, 'PAYMENT_GATEWAY', None) or {}
+    key = json.dumps(config, sort_keys=True, default=str)
+    with _gateway_lock:
+        if _gateway is None or _gateway[0] != key:
+            if _gateway is not None:
+                _gateway[1].close()
+            backend = import_string(config.get('BACKEND', 'config.payments.payment_gateway.MockPaymentGateway'))
+            _gateway = (key, backend(**config.get('OPTIONS', {})))
+        return _gateway[1]
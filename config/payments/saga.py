@@ -0,0 +1,264 @@
+"""
+Order payments as a saga.
+
+Paying an order takes a gateway charge and a wallet debit, and the charge
+is a network call that mustn't run inside a transaction. So a Payment row
+carries the payment through these steps, each its own short transaction:
+
+1. ``reserve`` locks the order and the wallet, debits the amount as a
+   ``pending`` Transaction and records the Payment as ``reserved``. The
+   funds are held before anything is charged, so a charge can't meet an
+   empty wallet afterwards.
+2. ``advance`` charges the gateway under the payment's idempotency key,
+   with no transaction open, and records the outcome:
+
+   * charged and the order still pending: the debit is ``completed``, the
+     order ``paid`` and the payment ``completed``;
+   * charged but the order moved on meanwhile (cancelled): ``refunding``;
+     the next step refunds the charge and gives the funds back
+     (``refunded``);
+   * declined: the funds go back to the wallet (``declined``);
+   * no answer (timeout, 5xx): nothing changes, it's tried again later.
+
+``cancel`` takes the same order lock, so an order is either paid or
+cancelled, never both. Cancelling a paid order moves its payment to
+``refunding``; cancelling during a charge leaves the refund to the step
+that records the charge.
+
+The Payment table doubles as the outbox: every ``reserved``/``refunding``
+row has a ``next_attempt_at``, and ``manage.py process_payments`` claims
+the due ones and advances them. A request that dies anywhere after step 1
+leaves a row the worker finishes once its lease runs out; the replay
+carries the same idempotency key, so a charge that went through is picked
+up rather than made twice. Unanswered calls are retried with exponential
+backoff; after PAYMENT_MAX_ATTEMPTS (or a refund the gateway refuses) the
+payment is marked ``failed`` with its funds still held, to be reconciled
+with the provider by hand.
+"""
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+import logging
+import uuid
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from config.payments.models import Payment, Transaction
+from config.payments.payment_gateway import get_payment_gateway
+from config.wallet_utils import WalletManager
+
+logger = logging.getLogger(__name__)
+
+
+def _lease():
+    return timezone.now() + timedelta(seconds=getattr(settings, 'PAYMENT_LEASE_SECONDS', 120))
+
+
+def reserve(order, user):
+    """Hold the order total in `user`'s wallet; returns (payment, error)"""
+    from config.orders.models import Order
+
+    with transaction.atomic():
+        order = Order.objects.select_for_update().get(pk=order.pk)
+        if order.status != 'pending':
+            return None, 'Order already processed'
+        if Payment.objects.filter(order=order, status__in=Payment.ACTIVE_STATUSES).exists():
+            return None, 'Payment already in progress'
+
+        currency, amount = order.payment_method, order.total_amount
+        model = WalletManager.WALLET_MODELS.get(currency)
+        if model is None:
+            return None, f"Invalid currency: {currency}"
+        wallet = model.objects.select_for_update().filter(user=user).first()
+        available = wallet.balance if wallet else Decimal('0.00')
+        if available < amount:
+            label = 'EGP' if currency == 'egp' else currency.title()
+            return None, (f"Wallet deduction failed: Insufficient {label} balance. "
+                          f"Required: {amount}, Available: {available}")
+        if wallet:
+            model.objects.filter(pk=wallet.pk).update(balance=F('balance') - amount, updated_at=timezone.now())
+
+        debit = Transaction.objects.create(
+            user=user, transaction_type='purchase', currency=currency, amount=amount,
+            status='pending', order=order, description=f"Order #{order.id}",
+        )
+        payment = Payment.objects.create(
+            order=order, user=user, currency=currency, amount=amount, transaction=debit,
+            idempotency_key=f'order-{order.id}-{uuid.uuid4().hex}',
+            # The caller advances it right away; the worker only if it doesn't
+            next_attempt_at=_lease(),
+        )
+    return payment, None
+
+
+def advance(payment):
+    """Take `payment` one step further; returns it updated. Call it with no
+    transaction open: it talks to the gateway"""
+    gateway = get_payment_gateway()
+    if payment.status == 'reserved':
+        result = gateway.process_payment(
+            payment.amount, payment.currency, f"Order #{payment.order_id}",
+            metadata={'order_id': payment.order_id, 'user_id': payment.user_id},
+            idempotency_key=payment.idempotency_key,
+        )
+        if result.success:
+            return _charged(payment, result.transaction_id)
+        if not result.retryable:
+            return _release(payment, 'declined', result.error)
+        return _retry(payment, result.error)
+    if payment.status == 'refunding':
+        result = gateway.refund_payment(
+            payment.gateway_transaction_id, idempotency_key=f'{payment.idempotency_key}-refund'
+        )
+        if result.success:
+            return _release(payment, 'refunded', payment.last_error)
+        return _retry(payment, result.error, give_up=not result.retryable)
+    return payment
+
+
+def settle(payment):
+    """Advance `payment` until it's finished or has to wait for a retry"""
+    previous = None
+    while payment.status in Payment.ACTIVE_STATUSES and payment.status != previous:
+        previous = payment.status
+        payment = advance(payment)
+    return payment
+
+
+def cancel(order):
+    """Cancel `order`; returns (payment, error). Money taken for it goes back
+    through the saga: a completed payment moves to ``refunding`` (returned,
+    for the caller to settle), and a charge still in flight is refunded by
+    whoever records it, since the order is no longer pending by then."""
+    from config.orders.models import Order
+
+    with transaction.atomic():
+        order = Order.objects.select_for_update().get(pk=order.pk)
+        if order.status not in ('pending', 'paid'):
+            return None, 'Cannot cancel this order'
+        payment = (
+            Payment.objects.select_for_update()
+            .filter(order=order, status__in=Payment.ACTIVE_STATUSES + ('completed',))
+            .order_by('-pk').first()
+        )
+        if payment is not None and payment.status == 'completed':
+            payment.status, payment.last_error = 'refunding', 'Order cancelled'
+            payment.attempts = 0
+            payment.next_attempt_at = _lease()
+            payment.save()
+        elif payment is None and order.status == 'paid':
+            # Paid before payments were tracked: no gateway charge on record
+            success, _, error = WalletManager.add_to_wallet(
+                order.user, order.total_amount, order.payment_method,
+                f"Refund for Order #{order.id}", transaction_type='refund', order=order,
+            )
+            if not success:
+                return None, error
+        Order.objects.filter(pk=order.pk, status=order.status).update(status='cancelled', updated_at=timezone.now())
+    return payment, None
+
+
+def _locked(payment):
+    """`payment` re-read under lock, or None if it moved on meanwhile"""
+    return Payment.objects.select_for_update().filter(pk=payment.pk, status=payment.status).first()
+
+
+def _charged(payment, gateway_transaction_id):
+    from config.orders.models import Order
+
+    now = timezone.now()
+    with transaction.atomic():
+        order = Order.objects.select_for_update().get(pk=payment.order_id)
+        current = _locked(payment)
+        if current is None:
+            return Payment.objects.get(pk=payment.pk)
+        current.gateway_transaction_id = gateway_transaction_id
+        current.attempts = 0
+        if order.status != 'pending':
+            # Cancelled while the charge was in flight: give the money back
+            current.status, current.last_error = 'refunding', 'Order already processed'
+            current.next_attempt_at = _lease()
+        else:
+            current.status, current.last_error = 'completed', ''
+            Transaction.objects.filter(pk=current.transaction_id).update(
+                status='completed', completed_at=now,
+                description=f"Order #{order.id} - Gateway: {gateway_transaction_id}",
+            )
+            order.status = 'paid'
+            order.paid_at = now
+            setattr(order, f'{current.currency}_amount', current.amount)
+            order.save()
+        current.save()
+    return current
+
+
+def _release(payment, status, error):
+    """Give the held funds back and finish the payment as `status`"""
+    now = timezone.now()
+    with transaction.atomic():
+        current = _locked(payment)
+        if current is None:
+            return Payment.objects.get(pk=payment.pk)
+        WalletManager.WALLET_MODELS[current.currency].objects.filter(user_id=current.user_id).update(
+            balance=F('balance') + current.amount, updated_at=now
+        )
+        Transaction.objects.filter(pk=current.transaction_id).update(status='reversed', completed_at=now)
+        current.status, current.last_error = status, error or ''
+        current.save()
+    return current
+
+
+def _retry_delay(attempts):
+    base = getattr(settings, 'PAYMENT_RETRY_SECONDS', 30)
+    return timedelta(seconds=base * 2 ** (attempts - 1))
+
+
+def _retry(payment, error, give_up=False):
+    max_attempts = getattr(settings, 'PAYMENT_MAX_ATTEMPTS', 8)
+    with transaction.atomic():
+        current = _locked(payment)
+        if current is None:
+            return Payment.objects.get(pk=payment.pk)
+        current.attempts += 1
+        current.last_error = error or ''
+        if give_up or current.attempts >= max_attempts:
+            logger.error(
+                'Payment %s for order %s failed while %s, funds still held: %s',
+                current.pk, current.order_id, current.status, current.last_error
+            )
+            current.status = 'failed'
+        else:
+            current.next_attempt_at = timezone.now() + _retry_delay(current.attempts)
+        current.save()
+    return current
+
+
+def _due(now):
+    return Q(status__in=Payment.ACTIVE_STATUSES, next_attempt_at__lte=now)
+
+
+def claim_batch(size=100):
+    """Lease up to `size` due payments to this worker; returns the claimed rows"""
+    now = timezone.now()
+    claim_id = uuid.uuid4()
+    candidates = Payment.objects.filter(_due(now)).order_by('next_attempt_at')
+
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            ids = list(candidates.select_for_update(skip_locked=True).values_list('pk', flat=True)[:size])
+        else:
+            ids = candidates.values('pk')[:size]
+        Payment.objects.filter(_due(now), pk__in=ids).update(claim_id=claim_id, next_attempt_at=_lease())
+    return list(Payment.objects.filter(claim_id=claim_id, status__in=Payment.ACTIVE_STATUSES).order_by('pk'))
+
+
+def process_due(batch_size=100):
+    """Settle due payments batch by batch; yields {status: count} per batch"""
+    while True:
+        payments = claim_batch(batch_size)
+        if not payments:
+            return
+        yield Counter(settle(payment).status for payment in payments)
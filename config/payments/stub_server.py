@@ -0,0 +1,139 @@
+"""
+Local stand-in for an HTTP payment provider.
+
+Speaks the protocol HTTPPaymentGateway expects (see payment_gateway.py),
+keeps connections alive like a real provider and can be told to be slow or
+to fail, so the gateway and the payment flow can be tested end to end
+without the network:
+
+    server = StubGatewayServer(latency=0.05).start()
+    ... PAYMENT_GATEWAY = {'BACKEND': '...HTTPPaymentGateway', 'OPTIONS': {'base_url': server.url}}
+    server.stop()
+
+``manage.py run_payment_stub`` serves one in the foreground for manual runs.
+A payment whose metadata has ``"fail": true`` is declined (402), like
+MockPaymentGateway.
+"""
+from decimal import Decimal, InvalidOperation
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import re
+import sys
+import threading
+import time
+import uuid
+
+REFUND_PATH = re.compile(r'^/payments/(?P<payment_id>[\w-]+)/refunds$')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        stub = self.server.stub
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._reply(400, {'error': 'Invalid JSON'})
+        if stub.api_key and self.headers.get('Authorization') != f'Bearer {stub.api_key}':
+            return self._reply(401, {'error': 'Invalid API key'})
+
+        if stub.latency:
+            time.sleep(stub.latency)
+        status, body = stub.handle(self.path, payload, self.headers.get('Idempotency-Key'))
+        self._reply(status, body)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients that gave up waiting (read timeouts) aren't worth a traceback
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubGatewayServer:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, api_key=''):
+        self.latency = latency
+        self.api_key = api_key
+        self.payments = {}
+        self.refunds = {}
+        self.requests = 0
+        self._replies = {}  # idempotency key -> (status, body)
+        self._failures = []  # statuses to answer the next requests with
+        self._lock = threading.Lock()
+        self.httpd = _Server((host, port), _Handler)
+        self.httpd.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def fail_next(self, count=1, status=503):
+        """Answer the next `count` requests with `status` without acting on them"""
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def handle(self, path, payload, idempotency_key):
+        with self._lock:
+            self.requests += 1
+            if self._failures:
+                return self._failures.pop(0), {'error': 'Simulated outage'}
+            if idempotency_key and idempotency_key in self._replies:
+                return self._replies[idempotency_key]
+            if path == '/payments':
+                reply = self._pay(payload)
+            elif REFUND_PATH.match(path):
+                reply = self._refund(REFUND_PATH.match(path).group('payment_id'), payload)
+            else:
+                reply = 404, {'error': 'Not found'}
+            if idempotency_key and reply[0] < 500:
+                self._replies[idempotency_key] = reply
+            return reply
+
+    def _pay(self, payload):
+        try:
+            amount = Decimal(payload['amount'])
+        except (KeyError, TypeError, InvalidOperation):
+            return 400, {'error': 'amount is required'}
+        if (payload.get('metadata') or {}).get('fail'):
+            return 402, {'error': f"Simulated payment failure for {payload.get('description', '')}"}
+        payment_id = f'pay_{uuid.uuid4().hex[:16]}'
+        self.payments[payment_id] = {'amount': amount, 'currency': payload.get('currency'), 'refunded': Decimal('0')}
+        return 201, {'id': payment_id, 'status': 'completed', 'amount': str(amount)}
+
+    def _refund(self, payment_id, payload):
+        payment = self.payments.get(payment_id)
+        if payment is None:
+            return 404, {'error': f'Payment {payment_id} not found'}
+        amount = Decimal(payload['amount']) if payload.get('amount') else payment['amount'] - payment['refunded']
+        if amount <= 0 or payment['refunded'] + amount > payment['amount']:
+            return 400, {'error': f"Refund amount {amount} exceeds original {payment['amount']}"}
+        payment['refunded'] += amount
+        refund_id = f'refund_{uuid.uuid4().hex[:16]}'
+        self.refunds[refund_id] = {'payment': payment_id, 'amount': amount}
+        return 201, {'id': refund_id, 'status': 'refunded', 'amount': str(amount)}
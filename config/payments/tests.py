@@ -1,3 +1,169 @@
-from django.test import TestCase
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from config.accounts.models import EGPWallet, User
+from config.orders.models import Order
+from config.payments import saga
+from config.payments.models import Payment
+from config.payments.payment_gateway import HTTPPaymentGateway, MockPaymentGateway, get_payment_gateway
+from config.payments.stub_server import StubGatewayServer
+
+
+class HTTPPaymentGatewayTests(SimpleTestCase):
+    def setUp(self):
+        self.server = StubGatewayServer(api_key='sk_test').start()
+        self.addCleanup(self.server.stop)
+        self.gateway = HTTPPaymentGateway(self.server.url, api_key='sk_test', read_timeout=2)
+        self.addCleanup(self.gateway.close)
+
+    def test_payment_and_refund_reuse_one_connection(self):
+        results = [self.gateway.process_payment(Decimal('25.00'), 'egp', f'Order #{i}') for i in range(5)]
+        self.assertTrue(all(result.success for result in results))
+        refund = self.gateway.refund_payment(results[0].transaction_id, Decimal('10.00'))
+        self.assertTrue(refund.success, refund.error)
+        self.assertEqual(refund.details['amount'], '10.00')
+        self.assertEqual(self.gateway.pool.created, 1)
+
+    def test_idempotency_key_charges_once(self):
+        first = self.gateway.process_payment(Decimal('25.00'), 'egp', 'Order #1', idempotency_key='order-1')
+        again = self.gateway.process_payment(Decimal('25.00'), 'egp', 'Order #1', idempotency_key='order-1')
+        self.assertEqual(first.transaction_id, again.transaction_id)
+        self.assertEqual(len(self.server.payments), 1)
+
+    def test_declines_and_outages(self):
+        declined = self.gateway.process_payment(Decimal('25.00'), 'egp', 'Order #1', metadata={'fail': True})
+        self.assertFalse(declined.success)
+        self.assertFalse(declined.retryable)
+
+        self.server.fail_next(status=503)
+        outage = self.gateway.process_payment(Decimal('25.00'), 'egp', 'Order #2')
+        self.assertFalse(outage.success)
+        self.assertTrue(outage.retryable)
+
+        bad_key = HTTPPaymentGateway(self.server.url, api_key='wrong')
+        self.addCleanup(bad_key.close)
+        self.assertEqual(bad_key.process_payment(Decimal('1.00'), 'egp', 'x').error, 'Invalid API key')
+
+    def test_timeout_is_retryable(self):
+        self.server.latency = 0.5
+        gateway = HTTPPaymentGateway(self.server.url, api_key='sk_test', read_timeout=0.1)
+        self.addCleanup(gateway.close)
+        result = gateway.process_payment(Decimal('25.00'), 'egp', 'Order #1')
+        self.assertFalse(result.success)
+        self.assertTrue(result.retryable)
+
+    def test_pool_bounds_concurrent_calls(self):
+        self.server.latency = 0.3
+        gateway = HTTPPaymentGateway(self.server.url, api_key='sk_test', pool_size=1, pool_timeout=0.1)
+        self.addCleanup(gateway.close)
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            results = list(pool.map(lambda i: gateway.process_payment(Decimal('1.00'), 'egp', str(i)), range(2)))
+        self.assertEqual(sorted(result.success for result in results), [False, True])
+        busy = next(result for result in results if not result.success)
+        self.assertIn('No free gateway connection', busy.error)
+        self.assertFalse(busy.retryable)
+
+    def test_async_calls(self):
+        async def pay_both():
+            return await asyncio.gather(
+                self.gateway.aprocess_payment(Decimal('5.00'), 'egp', 'a'),
+                self.gateway.aprocess_payment(Decimal('6.00'), 'egp', 'b'),
+            )
+        self.assertTrue(all(result.success for result in asyncio.run(pay_both())))
+        self.assertEqual(len(self.server.payments), 2)
+
+    def test_gateway_follows_the_setting(self):
+        self.assertIsInstance(get_payment_gateway(), MockPaymentGateway)
+        options = {'base_url': self.server.url, 'api_key': 'sk_test'}
+        with override_settings(PAYMENT_GATEWAY={
+            'BACKEND': 'config.payments.payment_gateway.HTTPPaymentGateway', 'OPTIONS': options,
+        }):
+            gateway = get_payment_gateway()
+            self.assertIsInstance(gateway, HTTPPaymentGateway)
+            self.assertIs(get_payment_gateway(), gateway)
+        self.assertIsInstance(get_payment_gateway(), MockPaymentGateway)
+
+
+class PaymentSagaTests(TestCase):
+    def setUp(self):
+        self.server = StubGatewayServer().start()
+        self.addCleanup(self.server.stop)
+        settings = override_settings(PAYMENT_GATEWAY={
+            'BACKEND': 'config.payments.payment_gateway.HTTPPaymentGateway',
+            'OPTIONS': {'base_url': self.server.url},
+        })
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user(username='buyer', password='pass12345')
+        EGPWallet.objects.create(user=self.user, balance=Decimal('500.00'))
+        self.order = Order.objects.create(user=self.user, total_amount=Decimal('100.00'))
+
+    def balance(self):
+        return EGPWallet.objects.get(user=self.user).balance
+
+    def run_worker(self, **kwargs):
+        Payment.objects.filter(status__in=Payment.ACTIVE_STATUSES).update(next_attempt_at=timezone.now())
+        return list(saga.process_due(**kwargs))
+
+    def test_reserve_holds_funds(self):
+        payment, error = saga.reserve(self.order, self.user)
+        self.assertIsNone(error)
+        self.assertEqual((payment.status, payment.transaction.status), ('reserved', 'pending'))
+        self.assertEqual(self.balance(), Decimal('400.00'))
+        self.assertEqual(saga.reserve(self.order, self.user), (None, 'Payment already in progress'))
+
+        Order.objects.filter(pk=self.order.pk).update(total_amount=Decimal('450.00'))
+        other = Order.objects.create(user=self.user, total_amount=Decimal('450.00'))
+        payment, error = saga.reserve(other, self.user)
+        self.assertIsNone(payment)
+        self.assertIn('Insufficient EGP balance', error)
+
+    def test_worker_waits_for_the_lease(self):
+        # The request died before calling the gateway
+        saga.reserve(self.order, self.user)
+        self.assertEqual(list(saga.process_due()), [])
+        self.assertEqual(self.run_worker(), [{'completed': 1}])
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'paid')
+
+    def test_charge_made_before_a_crash_is_not_repeated(self):
+        payment, _ = saga.reserve(self.order, self.user)
+        charged = get_payment_gateway().process_payment(
+            payment.amount, payment.currency, 'Order', idempotency_key=payment.idempotency_key
+        )
+        # ...and the process died before recording it
+        self.assertEqual(self.run_worker(), [{'completed': 1}])
+        payment.refresh_from_db()
+        self.assertEqual(payment.gateway_transaction_id, charged.transaction_id)
+        self.assertEqual(len(self.server.payments), 1)
+        self.assertEqual(self.balance(), Decimal('400.00'))
+
+    def test_refund_is_retried(self):
+        payment, _ = saga.reserve(self.order, self.user)
+        Order.objects.filter(pk=self.order.pk).update(status='cancelled')
+        payment = saga.advance(payment)  # charged, for an order that's gone
+        self.assertEqual(payment.status, 'refunding')
+        self.server.fail_next()
+        payment = saga.advance(payment)
+        self.assertEqual((payment.status, payment.attempts), ('refunding', 1))
+        self.assertEqual(self.balance(), Decimal('400.00'))
+
+        self.assertEqual(self.run_worker(), [{'refunded': 1}])
+        (charge,) = self.server.payments.values()
+        self.assertEqual(charge['refunded'], Decimal('100.00'))
+        self.assertEqual(self.balance(), Decimal('500.00'))
+
+    @override_settings(PAYMENT_MAX_ATTEMPTS=2)
+    def test_gives_up_after_max_attempts(self):
+        payment, _ = saga.reserve(self.order, self.user)
+        self.server.fail_next(count=2)
+        payment = saga.settle(payment)
+        self.assertEqual((payment.status, payment.attempts), ('reserved', 1))
+        self.assertGreater(payment.next_attempt_at, timezone.now())
+        with self.assertLogs('config.payments.saga', 'ERROR'):
+            self.assertEqual(self.run_worker(), [{'failed': 1}])
+        self.assertEqual(self.balance(), Decimal('400.00'))  # held until reconciled
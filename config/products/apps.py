@@ -3,3 +3,6 @@ from django.apps import AppConfig
 class ProductsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'config.products'
+
+    def ready(self):
+        import config.products.signals
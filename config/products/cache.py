@@ -0,0 +1,104 @@
+"""
+Response cache for the anonymous product catalog.
+
+Anonymous list/detail responses are identical for every visitor, so the
+serialized payload is cached under a key built from the normalized query
+string. Keys embed generation counters instead of being deleted one by one:
+bumping a counter makes every key built from the old value unreachable and
+lets the entries age out on their own.
+
+- ``catalog:gen:all``            bumped on category changes (nested everywhere)
+- ``catalog:gen:list``           bumped when any listed product/review changes
+- ``catalog:gen:product:<slug>`` bumped when a single product's detail changes
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+GENERATION_ALL = 'catalog:gen:all'
+GENERATION_LIST = 'catalog:gen:list'
+GENERATION_PRODUCT = 'catalog:gen:product:{slug}'
+
+# Query params that change a list response; anything else (cache busters,
+# tracking params, ?format=) is left out of the key.
+LIST_PARAMS = ('category', 'dealer', 'status', 'is_featured', 'search', 'ordering', 'page')
+
+
+def is_enabled():
+    return getattr(settings, 'CATALOG_CACHE_ENABLED', True)
+
+
+def get_generation(key):
+    """Current value of a generation counter, initializing it if missing"""
+    generation = cache.get(key)
+    if generation is None:
+        # Seed from the clock so an evicted counter never reuses an old value
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(key):
+    """Advance a generation counter, orphaning every key built from it"""
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def invalidate_catalog():
+    bump_generation(GENERATION_ALL)
+
+
+def invalidate_listings():
+    bump_generation(GENERATION_LIST)
+
+
+def invalidate_product(slug, listings=True):
+    if listings:
+        bump_generation(GENERATION_LIST)
+    if slug:
+        bump_generation(GENERATION_PRODUCT.format(slug=slug))
+
+
+def _digest(parts):
+    return hashlib.sha256('|'.join(str(p) for p in parts).encode()).hexdigest()
+
+
+def _normalized_params(query_params):
+    """Sorted, de-duplicated (name, values) pairs with empty values dropped"""
+    params = []
+    for name in sorted(query_params.keys()):
+        if name not in LIST_PARAMS:
+            continue
+        values = sorted({v for v in query_params.getlist(name) if v != ''})
+        if values:
+            params.append(f"{name}={','.join(values)}")
+    return params
+
+
+def list_key(request):
+    parts = [
+        request.scheme, request.get_host(),
+        get_generation(GENERATION_ALL), get_generation(GENERATION_LIST),
+    ] + _normalized_params(request.query_params)
+    return f'catalog:list:{_digest(parts)}'
+
+
+def detail_key(request, slug):
+    parts = [
+        request.scheme, request.get_host(), slug,
+        get_generation(GENERATION_ALL),
+        get_generation(GENERATION_PRODUCT.format(slug=slug)),
+    ]
+    return f'catalog:detail:{_digest(parts)}'
+
+
+def get_cached(key):
+    return cache.get(key)
+
+
+def set_cached(key, data):
+    cache.set(key, data, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300))
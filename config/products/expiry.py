@@ -0,0 +1,47 @@
+"""
+Listing expiry.
+
+Approval stamps ``expires_at``; this job flips approved listings past that
+point to ``status='expired'`` so public queries can stay on the partial
+live-catalog indexes instead of comparing timestamps on every request.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from config.products import cache as catalog_cache, quota, snapshots
+from config.products.models import Product
+
+
+def expire_listings(now=None, batch_size=500):
+    """Expire due listings in batches; returns the number of products expired.
+
+    Each batch is picked by a range scan on the (status, expires_at) index
+    and flipped with a single UPDATE, so the job never holds more than
+    `batch_size` rows locked.
+    """
+    now = now or timezone.now()
+    total = 0
+    while True:
+        due = list(
+            Product.objects.filter(status='approved', expires_at__lte=now)
+            .order_by('expires_at')
+            .values_list('pk', 'category_id')[:batch_size]
+        )
+        if not due:
+            break
+
+        ids = [pk for pk, _ in due]
+        with transaction.atomic():
+            batch = Product.objects.filter(pk__in=ids, status='approved')
+            previous = quota.lock_statuses(batch)
+            expired = batch.update(status='expired', updated_at=now)
+            quota.adjust(quota.transition(previous, 'expired'))
+            # update() skips post_save, so invalidate once for the whole batch
+            transaction.on_commit(catalog_cache.invalidate_catalog)
+            for category_id in {category_id for _, category_id in due}:
+                snapshots.refresh_category_on_commit(category_id)
+
+        total += expired
+        if len(due) < batch_size:
+            break
+    return total
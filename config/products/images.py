@@ -0,0 +1,145 @@
+"""
+Product image variants.
+
+Uploads are stored untouched; resized WebP variants are rendered with Pillow
+in a small thread pool after the upload's transaction commits, so requests
+never pay for decoding or resizing. Variants are recorded on the row:
+
+    image_variants = {'source': 'products/a.jpg',
+                      'thumb': 'products/variants/a_thumb.webp',
+                      'medium': 'products/variants/a_medium.webp'}
+
+``source`` is the image the variants were rendered from; a row whose image
+no longer matches it is stale and gets re-rendered.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import logging
+import os
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# name -> bounding box; aspect ratio is preserved
+VARIANT_SIZES = {
+    'thumb': (320, 320),
+    'medium': (800, 800),
+}
+WEBP_QUALITY = 80
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMAGE_PROCESSING_WORKERS', 2),
+                thread_name_prefix='image-variants',
+            )
+    return _executor
+
+
+def needs_processing(instance):
+    name = instance.image.name if instance.image else ''
+    return bool(name) and (instance.image_variants or {}).get('source') != name
+
+
+def variant_url(instance, variant):
+    """Storage URL of a rendered variant, falling back to the original"""
+    name = (instance.image_variants or {}).get(variant)
+    if name and instance.image_variants.get('source') == instance.image.name:
+        return default_storage.url(name)
+    return instance.image.url if instance.image else None
+
+
+def schedule(instance):
+    """Render variants for `instance` once the current transaction commits"""
+    label, pk = instance._meta.label, instance.pk
+    if getattr(settings, 'IMAGE_PROCESSING_ASYNC', True):
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_worker, label, pk))
+    else:
+        transaction.on_commit(lambda: process(label, pk))
+
+
+def _run_in_worker(label, pk, force=False):
+    try:
+        return process(label, pk, force)
+    finally:
+        # Worker threads hold their own connection; don't leak it
+        close_old_connections()
+
+
+def variant_name(source, variant):
+    root, _ = os.path.splitext(source)
+    directory, filename = os.path.split(root)
+    return f'{directory}/variants/{filename}_{variant}.webp'
+
+
+def render_variants(source):
+    """Render every variant of the stored image `source`; returns {variant: name}"""
+    with default_storage.open(source, 'rb') as fh:
+        image = Image.open(fh)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    names = {}
+    for variant, size in VARIANT_SIZES.items():
+        resized = image.copy()
+        resized.thumbnail(size, Image.LANCZOS)
+        buffer = BytesIO()
+        resized.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+        name = variant_name(source, variant)
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        names[variant] = default_storage.save(name, ContentFile(buffer.getvalue()))
+    return names
+
+
+def process(label, pk, force=False):
+    """Render and record variants for one Product/ProductImage row"""
+    model = apps.get_model(label)
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None or not instance.image or not (force or needs_processing(instance)):
+        return False
+
+    source = instance.image.name
+    existing = {variant: variant_name(source, variant) for variant in VARIANT_SIZES}
+    if not force and all(default_storage.exists(name) for name in existing.values()):
+        # Content-addressed sources are shared; so are their variants
+        variants = existing
+    else:
+        try:
+            variants = render_variants(source)
+        except Exception:
+            logger.exception('Could not render variants for %s %s (%s)', label, pk, source)
+            return False
+
+    variants['source'] = source
+    # Only record them if the image wasn't replaced while we were rendering
+    updated = model.objects.filter(pk=pk, image=source).update(image_variants=variants)
+    if updated:
+        _invalidate(instance)
+    return bool(updated)
+
+
+def _invalidate(instance):
+    # update() skips post_save, so refresh the catalog caches ourselves
+    from config.products import cache as catalog_cache, snapshots
+    from config.products.models import Product
+
+    product = instance if isinstance(instance, Product) else instance.product
+    catalog_cache.invalidate_product(product.slug, listings=product is instance)
+    if product is instance:
+        snapshots.discard_category(product.category_id)
@@ -0,0 +1,68 @@
+"""
+Load script for the anonymous product catalog.
+
+Seeds throwaway products, then hammers the public list/detail endpoints with
+the catalog cache disabled and enabled and reports requests per second.
+Usage: python manage.py bench_catalog --products 500 --requests 1000
+"""
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+
+from config.benchmarks import rolled_back, measure
+from config.products.models import Category, Product
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Measure anonymous catalog req/s with and without the response cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument('--requests', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            self._seed(options['products'])
+            self._run(options['requests'])
+
+    def _seed(self, count):
+        dealer = User.objects.create_user(username='bench_catalog_dealer', password=None, role='dealer')
+        category = Category.objects.create(name='Bench', slug='bench-catalog')
+        Product.objects.bulk_create([
+            Product(
+                category=category,
+                dealer=dealer,
+                name=f'Bench product {i}',
+                slug=f'bench-catalog-{i}',
+                description='Benchmark fixture',
+                price_egp=Decimal(10 + i % 90),
+                image='products/bench.jpg',
+                status='approved',
+            )
+            for i in range(count)
+        ])
+        self.stdout.write(f'Seeded {count} approved products')
+
+    def _run(self, iterations):
+        client = Client()
+        paths = [
+            '/api/shop/products/',
+            '/api/shop/products/?ordering=price_egp&page=2',
+            '/api/shop/products/bench-catalog-1/',
+        ]
+        for enabled in (False, True):
+            cache.clear()
+            with override_settings(CATALOG_CACHE_ENABLED=enabled):
+                for path in paths:
+                    client.get(path)  # warm up (and fill the cache when enabled)
+                    wall, cpu, rate = measure(lambda: client.get(path), iterations)
+                    label = 'cached' if enabled else 'uncached'
+                    self.stdout.write(
+                        f'{label:9} {path:50} {rate:9.1f} req/s  '
+                        f'{cpu / iterations * 1000:.2f} ms CPU/req'
+                    )
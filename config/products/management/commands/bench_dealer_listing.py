@@ -0,0 +1,93 @@
+"""
+Benchmark the dealer product listing query.
+
+Seeds throwaway dealers/products with a realistic status mix and compares the
+legacy query, ProductQuerySet.visible_to_dealer and an explicit
+``pk IN (public UNION own)`` variant, printing the query plan of each.
+Usage: python manage.py bench_dealer_listing --dealers 100 --products 10000
+"""
+import random
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from config.benchmarks import rolled_back, measure
+from config.products.models import Category, Product
+
+User = get_user_model()
+
+STATUS_MIX = ['approved'] * 7 + ['pending', 'rejected', 'suspended']
+
+
+class Command(BaseCommand):
+    help = 'Compare dealer product listing query plans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dealers', type=int, default=100)
+        parser.add_argument('--products', type=int, default=10000, help='Total products across all dealers')
+        parser.add_argument('--iterations', type=int, default=50)
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            dealers = self._seed(options['dealers'], options['products'])
+            self._run(dealers[0], options['iterations'])
+
+    def _seed(self, dealer_count, product_count):
+        User.objects.bulk_create([
+            User(username=f'bench_dealer_{i}', role='dealer') for i in range(dealer_count)
+        ])
+        dealers = list(User.objects.filter(username__startswith='bench_dealer_'))
+        category = Category.objects.create(name='Bench', slug='bench-dealer-listing')
+        rng = random.Random(0)
+        Product.objects.bulk_create([
+            Product(
+                category=category,
+                dealer=dealers[i % len(dealers)],
+                name=f'Bench product {i}',
+                slug=f'bench-dealer-listing-{i}',
+                description='Benchmark fixture',
+                price_egp=Decimal('10.00'),
+                image='products/bench.jpg',
+                status=rng.choice(STATUS_MIX),
+                is_active=rng.random() > 0.05,
+            )
+            for i in range(product_count)
+        ], batch_size=1000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')  # give the planner real statistics
+        self.stdout.write(f'Seeded {dealer_count} dealers x {product_count} products')
+        return dealers
+
+    def _run(self, dealer, iterations):
+        queries = {
+            'legacy OR': lambda: (
+                Product.objects.filter(status__in=['approved', 'rejected', 'suspended'])
+                | Product.objects.filter(dealer=dealer)
+            ),
+            'per-branch': lambda: Product.objects.visible_to_dealer(dealer),
+            'UNION': lambda: Product.objects.filter(pk__in=(
+                Product.objects.public().order_by().values('pk')
+                .union(Product.objects.filter(dealer=dealer).order_by().values('pk'))
+            )),
+        }
+        for label, build in queries.items():
+            # What the list endpoint does: count + first page
+            def run():
+                queryset = build().order_by('-created_at')
+                queryset.count()
+                list(queryset[:10])
+
+            wall, cpu, rate = measure(run, iterations)
+            self.stdout.write(
+                f'{label:10} rows={build().count():6}  {wall / iterations * 1000:7.2f} ms/listing  {rate:8.1f} listings/s'
+            )
+            self.stdout.write(self._plan(build().order_by('-created_at')[:10]))
+
+    def _plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            return '\n'.join(f'    {row}' for row in cursor.fetchall())
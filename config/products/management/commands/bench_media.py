@@ -0,0 +1,111 @@
+"""
+Throughput benchmark for media serving.
+
+Writes a throwaway video under a temporary MEDIA_ROOT and serves it through
+django.views.static.serve (the old DEBUG route) and config.products.media in
+each mode. Streaming modes are drained the way a WSGI server would: by
+iterating the response, or by os.sendfile from the response's file as
+gunicorn's file_wrapper does.
+Usage: python manage.py bench_media --size 64 --iterations 20
+"""
+import os
+import random
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+from django.views.static import serve
+
+from config.benchmarks import rolled_back, measure
+from config.products.media import serve_media
+from config.products.models import Category, Product
+
+User = get_user_model()
+
+VIDEO = 'product_videos/bench.mp4'
+
+
+class Command(BaseCommand):
+    help = 'Compare media serving throughput (full files and byte ranges)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=64, help='File size in MB')
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--range-size', type=int, default=1024, help='Range request size in KB')
+
+    def handle(self, *args, **options):
+        media_root = tempfile.mkdtemp()
+        size = options['size'] * 1024 * 1024
+        try:
+            os.makedirs(os.path.join(media_root, 'product_videos'))
+            with open(os.path.join(media_root, VIDEO), 'wb') as fh:
+                for _ in range(options['size']):
+                    fh.write(os.urandom(1024 * 1024))
+            with override_settings(MEDIA_ROOT=media_root), rolled_back():
+                self._seed()
+                self._run(size, options['iterations'], options['range_size'] * 1024)
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+    def _seed(self):
+        dealer = User.objects.create_user(username='bench_media_dealer', password=None, role='dealer')
+        category = Category.objects.create(name='Bench', slug='bench-media')
+        Product.objects.create(
+            category=category, dealer=dealer, name='Bench video', slug='bench-media',
+            description='Benchmark fixture', price_egp=10, image='products/bench.jpg',
+            video=VIDEO, status='approved',
+        )
+
+    def _request(self, **headers):
+        request = RequestFactory().get('/media/' + VIDEO, **headers)
+        request.user = AnonymousUser()
+        return request
+
+    def _run(self, size, iterations, range_size):
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        rng = random.Random(0)
+
+        def iterate(response):
+            drained = sum(len(block) for block in response.streaming_content)
+            # Not response.close(): request_finished would close the DB connection
+            response.file_to_stream.close()
+            return drained
+
+        def sendfile(response):
+            # What wsgi.file_wrapper does under gunicorn
+            fh = response.file_to_stream
+            offset = os.lseek(fh.fileno(), 0, os.SEEK_CUR)
+            remaining = int(response['Content-Length'])
+            while remaining:
+                sent = os.sendfile(devnull, fh.fileno(), offset, remaining)
+                offset += sent
+                remaining -= sent
+            fh.close()
+
+        def random_range():
+            start = rng.randrange(0, size - range_size)
+            return {'HTTP_RANGE': f'bytes={start}-{start + range_size - 1}'}
+
+        cases = [
+            ('static.serve, iterate', size, lambda: iterate(serve(self._request(), VIDEO, settings.MEDIA_ROOT))),
+            ('media view, iterate', size, lambda: iterate(serve_media(self._request(), VIDEO))),
+            ('media view, sendfile', size, lambda: sendfile(serve_media(self._request(), VIDEO))),
+            ('range, iterate', range_size, lambda: iterate(serve_media(self._request(**random_range()), VIDEO))),
+            ('range, sendfile', range_size, lambda: sendfile(serve_media(self._request(**random_range()), VIDEO))),
+        ]
+        try:
+            for label, nbytes, run in cases:
+                wall, cpu, rate = measure(run, iterations)
+                self.stdout.write(
+                    f'{label:22} {nbytes * iterations / wall / 1024 ** 2:9.1f} MB/s  '
+                    f'{rate:8.1f} req/s  cpu {cpu / wall * 100:5.1f}%'
+                )
+            with override_settings(MEDIA_SERVE_MODE='x-accel'):
+                wall, cpu, rate = measure(lambda: serve_media(self._request(), VIDEO), iterations * 50)
+                self.stdout.write(f'{"x-accel (headers only)":22} {"-":>9}       {rate:8.1f} req/s')
+        finally:
+            os.close(devnull)
@@ -0,0 +1,28 @@
+"""
+Rebuild the per-category catalog snapshots.
+Usage: python manage.py build_catalog_snapshots [--pages 5] [--category <id>]
+"""
+from django.core.management.base import BaseCommand
+
+from config.products import snapshots
+
+
+class Command(BaseCommand):
+    help = 'Materialize the first pages of every active category into the cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=None,
+                            help='Pages per ordering (default: CATALOG_SNAPSHOT_PAGES)')
+        parser.add_argument('--category', type=int, default=None,
+                            help='Only rebuild this category id')
+
+    def handle(self, *args, **options):
+        if not snapshots.is_enabled():
+            self.stdout.write(self.style.WARNING('Snapshots need a shared cache; nothing built'))
+            return
+        if options['category']:
+            snapshots.refresh_category(options['category'], options['pages'])
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt snapshot for category {options['category']}"))
+            return
+        built = snapshots.refresh_all(options['pages'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt snapshots for {built} categories'))
@@ -0,0 +1,19 @@
+"""
+Delete chunked video uploads that were abandoned mid-way.
+Schedule it daily:
+    0 3 * * * python manage.py clear_stale_uploads --hours 24
+"""
+from django.core.management.base import BaseCommand
+
+from config.products.uploads import clear_stale
+
+
+class Command(BaseCommand):
+    help = 'Remove unfinished chunked uploads (rows and chunk files) older than --hours'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24)
+
+    def handle(self, *args, **options):
+        removed = clear_stale(options['hours'])
+        self.stdout.write(self.style.SUCCESS(f'Removed {removed} stale uploads'))
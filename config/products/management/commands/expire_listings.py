@@ -0,0 +1,19 @@
+"""
+Expire approved listings whose expires_at has passed.
+Schedule it (cron, systemd timer) every few minutes:
+    */5 * * * * python manage.py expire_listings
+"""
+from django.core.management.base import BaseCommand
+
+from config.products.expiry import expire_listings
+
+
+class Command(BaseCommand):
+    help = 'Flip approved listings past expires_at to expired, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        expired = expire_listings(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Expired {expired} listings'))
@@ -0,0 +1,51 @@
+"""
+Garbage-collect product media nobody references.
+Deletes content-addressed blobs whose refcount dropped to zero (and their
+image variants); --scan also walks the media tree for files no row knows.
+Run it once with --backfill after upgrading, so files stored before blobs
+existed get rows and are counted. Schedule it daily:
+    30 3 * * * python manage.py gc_media --scan
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from config.products import storage
+
+
+class Command(BaseCommand):
+    help = 'Delete unreferenced product media files, streaming in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=int, default=24,
+                            help='Leave files touched more recently than this alone')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--scan', action='store_true', help='Also delete untracked files in the media tree')
+        parser.add_argument('--dry-run', action='store_true')
+        parser.add_argument('--backfill', action='store_true',
+                            help='First create blob rows for referenced files stored before blobs existed')
+
+    def handle(self, *args, **options):
+        grace, batch_size, dry_run = timedelta(hours=options['grace_hours']), options['batch_size'], options['dry_run']
+        verb = 'Would delete' if dry_run else 'Deleted'
+
+        if options['backfill']:
+            count = sum(storage.backfill_blobs(batch_size))
+            self.stdout.write(self.style.SUCCESS(f'Registered {count} existing files'))
+
+        count = 0
+        for name in storage.collect_garbage(grace, batch_size, dry_run):
+            count += 1
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  {name}')
+        self.stdout.write(self.style.SUCCESS(f'{verb} {count} unreferenced blobs'))
+
+        if options['scan']:
+            count = 0
+            for name in storage.find_orphans(grace, batch_size):
+                if not dry_run and not storage.delete_untracked(name):
+                    continue
+                count += 1
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'  {name}')
+            self.stdout.write(self.style.SUCCESS(f'{verb} {count} untracked files'))
@@ -0,0 +1,40 @@
+"""
+Render thumbnail/WebP variants for product media uploaded before the
+pipeline existed (or whose variants are stale).
+Usage: python manage.py process_product_images --workers 4
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from config.products import images
+from config.products.models import Product, ProductImage
+
+
+class Command(BaseCommand):
+    help = 'Backfill resized WebP variants for product images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='1 renders in this thread')
+        parser.add_argument('--force', action='store_true', help='Re-render variants that are already up to date')
+
+    def handle(self, *args, **options):
+        force, workers = options['force'], options['workers']
+        for model in (Product, ProductImage):
+            label = model._meta.label
+            pending = self._pending(model, force)
+            if workers > 1:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    results = list(pool.map(lambda pk: images._run_in_worker(label, pk, force), pending))
+            else:
+                results = [images.process(label, pk, force) for pk in pending]
+            self.stdout.write(
+                self.style.SUCCESS(f'{model.__name__}: rendered {sum(results)} of {len(pending)} images')
+            )
+
+    def _pending(self, model, force):
+        rows = model.objects.exclude(image='').values_list('pk', 'image', 'image_variants').order_by('pk')
+        return [
+            pk for pk, image, variants in rows.iterator(chunk_size=2000)
+            if force or (variants or {}).get('source') != image
+        ]
@@ -0,0 +1,23 @@
+"""
+Recompute dealers' active-product counters from the products table and
+fix any that drifted (e.g. after raw SQL or a restore). Safe to run while
+the site is up; weekly is plenty:
+    0 4 * * 0 python manage.py recount_active_products
+"""
+from django.core.management.base import BaseCommand
+
+from config.products.quota import recount
+
+
+class Command(BaseCommand):
+    help = "Repair DealerProfile.active_products from the dealers' approved products, in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        checked = fixed = 0
+        for batch_checked, batch_fixed in recount(batch_size=options['batch_size']):
+            checked += batch_checked
+            fixed += batch_fixed
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} dealers, fixed {fixed} counters'))
@@ -0,0 +1,202 @@
+"""
+Serving the media/ tree.
+
+Every file under MEDIA_ROOT belongs to one or more products (stored files
+are deduplicated): as image, video, additional image or a rendered variant
+of those. Files of live products are public. Anything else is only served to the owning dealer and
+admins, and unreferenced files are never served. Owners are found by exact
+name on the indexed file columns; a variant is first mapped to the stored
+source it was rendered from through its MediaBlob row.
+
+MEDIA_SERVE_MODE picks who moves the bytes:
+
+* ``django`` - a FileResponse. WSGI servers with ``wsgi.file_wrapper``
+  (gunicorn, uWSGI) hand the open file to ``os.sendfile``; byte ranges are
+  served by positioning the file and bounding Content-Length, so seeking a
+  video is still zero-copy.
+* ``x-accel`` - the view only checks access; nginx serves the file from an
+  ``internal`` location at MEDIA_ACCEL_PREFIX (it handles Range itself).
+* ``x-sendfile`` - the same for Apache mod_xsendfile / lighttpd.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+from django.views.static import was_modified_since
+
+from config.permissions import is_admin_user
+from config.products.models import MediaBlob, Product, ProductImage
+
+# top-level media folder -> (model, file field)
+MEDIA_OWNERS = {
+    'products': (Product, 'image'),
+    'product_images': (ProductImage, 'image'),
+    'product_videos': (Product, 'video'),
+}
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class MediaFileResponse(FileResponse):
+    block_size = 64 * 1024
+
+
+class _RangeFile:
+    """Read at most `length` bytes of an already positioned file.
+
+    Exposes fileno() so file_wrapper/sendfile still applies; it sends
+    Content-Length bytes from the current offset.
+    """
+
+    def __init__(self, fh, length):
+        self._fh = fh
+        self._remaining = length
+        self.name = fh.name
+
+    def read(self, size=-1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._fh.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self._fh.fileno()
+
+    def close(self):
+        self._fh.close()
+
+
+def _request_user(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user
+    if 'HTTP_AUTHORIZATION' in request.META:
+        from config.accounts.authentication import ClaimsJWTAuthentication
+        try:
+            result = ClaimsJWTAuthentication().authenticate(request)
+        except Exception:
+            return None
+        return result[0] if result else None
+    return None
+
+
+def _variant_sources(directory, filename):
+    """Stored names the variant `directory/filename` may have been rendered from"""
+    # products/ab/cd/variants/<stem>_thumb.webp was rendered from products/ab/cd/<stem>.<ext>;
+    # '/' sorts right after '.', so the range stays on the unique name index
+    prefix = f"{posixpath.dirname(directory)}/{filename.rsplit('_', 1)[0]}."
+    names = MediaBlob.objects.filter(name__gte=prefix, name__lt=prefix[:-1] + '/').values_list('name', flat=True)
+    return [name for name in names if '/' not in name[len(prefix):]]
+
+
+def _owning_products(path):
+    """Products a media path belongs to (several, for deduplicated files)"""
+    folder = path.split('/', 1)[0]
+    if folder not in MEDIA_OWNERS:
+        return Product.objects.none()
+    model, field = MEDIA_OWNERS[folder]
+
+    directory, filename = posixpath.split(path)
+    if posixpath.basename(directory) == 'variants':
+        lookup = {f'{field}__in': _variant_sources(directory, filename)}
+    else:
+        lookup = {field: path}
+
+    if model is ProductImage:
+        lookup = {f'additional_images__{key}': value for key, value in lookup.items()}
+    return Product.objects.filter(**lookup)
+
+
+def can_view_unpublished(user, products):
+    """Media of products that aren't live: owning dealer or admin only"""
+    if user is None:
+        return False
+    if is_admin_user(user):
+        return products.exists()
+    return products.filter(dealer=user).exists()
+
+
+def _parse_range(header, size):
+    """(start, end) inclusive for a single satisfiable range, None to ignore, or False if unsatisfiable"""
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None  # multiple or malformed ranges: serve the whole file
+    first, last = match.groups()
+    if first == '' and last == '':
+        return None
+    if first == '':
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+@require_safe
+def serve_media(request, path):
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Not found')
+
+    products = _owning_products(path)
+    public = products.public().exists()
+    if not public and not can_view_unpublished(_request_user(request), products):
+        raise Http404('Not found')
+    try:
+        stat = os.stat(fullpath)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404('Not found')
+
+    cache_control = 'public, max-age=86400' if public else 'private, no-cache'
+
+    mode = getattr(settings, 'MEDIA_SERVE_MODE', 'django')
+    if mode in ('x-accel', 'x-sendfile'):
+        response = HttpResponse(content_type=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+        if mode == 'x-accel':
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX.rstrip('/') + '/' + path
+        else:
+            response['X-Sendfile'] = fullpath
+        response['Cache-Control'] = cache_control
+        return response
+
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime):
+        return HttpResponseNotModified()
+
+    size = stat.st_size
+    byte_range = None
+    if 'HTTP_RANGE' in request.META:
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if not if_range or if_range == http_date(stat.st_mtime):
+            byte_range = _parse_range(request.META['HTTP_RANGE'], size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    fh = open(fullpath, 'rb')
+    if byte_range:
+        start, end = byte_range
+        fh.seek(start)
+        response = MediaFileResponse(_RangeFile(fh, end - start + 1), status=206)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+    else:
+        response = MediaFileResponse(fh)
+    response['Accept-Ranges'] = 'bytes'
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = cache_control
+    return response
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_productimage_productreview_alter_product_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'is_active'], name='products_pr_status_c4a457_idx'),
+        ),
+    ]
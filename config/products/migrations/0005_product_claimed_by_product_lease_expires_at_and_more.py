@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:11
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('products', '0004_remove_product_products_pr_status_c4a457_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='claimed_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='claimed_products', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['created_at'], name='product_pending_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['reviewed_at', 'reviewed_by'], name='product_reviewed_idx'),
+        ),
+    ]
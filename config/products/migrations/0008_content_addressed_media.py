@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:21
+
+import config.products.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_videoupload'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='image',
+            field=models.ImageField(storage=config.products.storage.media_storage, upload_to='products/'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='video',
+            field=models.FileField(blank=True, null=True, storage=config.products.storage.media_storage, upload_to='product_videos/'),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(storage=config.products.storage.media_storage, upload_to='product_images/'),
+        ),
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('refcount', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['refcount', 'updated_at'], name='products_me_refcoun_4b5c87_idx')],
+            },
+        ),
+    ]
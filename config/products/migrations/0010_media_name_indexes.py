@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-19 07:46
+
+import config.products.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_productimage_position'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='image',
+            field=models.ImageField(db_index=True, storage=config.products.storage.media_storage, upload_to='products/'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='video',
+            field=models.FileField(blank=True, db_index=True, null=True, storage=config.products.storage.media_storage, upload_to='product_videos/'),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(db_index=True, storage=config.products.storage.media_storage, upload_to='product_images/'),
+        ),
+    ]
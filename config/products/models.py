@@ -1,7 +1,11 @@
 from django.db import models
+from django.db.models import Q
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from decimal import Decimal
+import uuid
+
+from config.products.storage import media_storage
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
@@ -19,12 +23,40 @@ class Category(models.Model):
         return self.name
 
 
+# Rows covered by the partial "live catalog" indexes
+LIVE_CONDITION = Q(status='approved', is_active=True)
+
+
+class ProductQuerySet(models.QuerySet):
+    """Visibility rules for product listings"""
+
+    def public(self):
+        """Products anyone may browse.
+
+        Matches LIVE_CONDITION exactly so the partial indexes apply; expired
+        listings are flipped to status='expired' by the expire_listings job
+        rather than filtered on expires_at here.
+        """
+        return self.filter(LIVE_CONDITION)
+
+    def visible_to_dealer(self, dealer):
+        """Public products plus every product the dealer owns, whatever its status.
+
+        Each side of the OR lines up with one index (the partial live-catalog
+        indexes and (dealer, status)), so the planner runs it per branch (SQLite
+        MULTI-INDEX OR, Postgres BitmapOr). bench_dealer_listing compares it
+        with the legacy query and an explicit ``pk IN (... UNION ...)``.
+        """
+        return self.filter(LIVE_CONDITION | Q(dealer=dealer))
+
+
 class Product(models.Model):
     STATUS_CHOICES = (
         ('pending', 'Pending Review'),
         ('approved', 'Approved'),
         ('rejected', 'Rejected'),
         ('suspended', 'Suspended'),
+        ('expired', 'Expired'),
     )
     
     PAYMENT_TYPE_CHOICES = (
@@ -48,8 +80,10 @@ class Product(models.Model):
     primary_payment_type = models.CharField(max_length=20, choices=PAYMENT_TYPE_CHOICES, default='egp')
     
     stock = models.PositiveIntegerField(default=1)
-    image = models.ImageField(upload_to='products/')
-    video = models.FileField(upload_to='product_videos/', blank=True, null=True)  # Videos only for Pro/Enterprise
+    # File columns are indexed: /media/ requests look their owners up by name (media.py)
+    image = models.ImageField(upload_to='products/', storage=media_storage, db_index=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)  # see config/products/images.py
+    video = models.FileField(upload_to='product_videos/', storage=media_storage, blank=True, null=True, db_index=True)  # Videos only for Pro/Enterprise
     
     # Moderation
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
@@ -63,6 +97,16 @@ class Product(models.Model):
     )
     reviewed_at = models.DateTimeField(null=True, blank=True)
     
+    # Moderation queue lease (see config/products/moderation.py)
+    claimed_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='claimed_products'
+    )
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    
     # Visibility and listing
     is_active = models.BooleanField(default=True)
     is_featured = models.BooleanField(default=False)
@@ -74,6 +118,8 @@ class Product(models.Model):
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
     publish_date = models.DateTimeField(null=True, blank=True)
     
+    objects = ProductQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-created_at']
         indexes = [
@@ -81,6 +127,15 @@ class Product(models.Model):
             models.Index(fields=['dealer', 'status']),
             models.Index(fields=['status']),
             models.Index(fields=['category']),
+            # expire_listings range-scans approved rows by expiry
+            models.Index(fields=['status', 'expires_at'], name='product_status_expires_idx'),
+            # Public listings only ever read live rows; keep their indexes partial
+            models.Index(fields=['-created_at'], condition=LIVE_CONDITION, name='product_live_created_idx'),
+            models.Index(fields=['category', '-created_at'], condition=LIVE_CONDITION,
+                         name='product_live_category_idx'),
+            # Moderation queue: oldest pending first, and per-moderator throughput
+            models.Index(fields=['created_at'], condition=Q(status='pending'), name='product_pending_queue_idx'),
+            models.Index(fields=['reviewed_at', 'reviewed_by'], name='product_reviewed_idx'),
         ]
     
     def clean(self):
@@ -115,17 +170,77 @@ class Product(models.Model):
 class ProductImage(models.Model):
     """Additional product images"""
     product = models.ForeignKey(Product, related_name='additional_images', on_delete=models.CASCADE)
-    image = models.ImageField(upload_to='product_images/')
+    image = models.ImageField(upload_to='product_images/', storage=media_storage, db_index=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     alt_text = models.CharField(max_length=255, blank=True)
+    position = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
     
     class Meta:
-        ordering = ['created_at']
+        ordering = ['position', 'created_at']
     
     def __str__(self):
         return f"Image for {self.product.name}"
 
 
+class MediaBlob(models.Model):
+    """A stored media file and how many fields reference it (see config/products/storage.py)"""
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    refcount = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            # gc_media scans unreferenced blobs past their grace period
+            models.Index(fields=['refcount', 'updated_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} ({self.refcount} refs)"
+
+
+class VideoUpload(models.Model):
+    """Resumable chunked upload of a product video (see config/products/uploads.py)"""
+    STATUS_CHOICES = (
+        ('uploading', 'Uploading'),
+        ('complete', 'Complete'),
+    )
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    product = models.ForeignKey(Product, related_name='video_uploads', on_delete=models.CASCADE)
+    dealer = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='video_uploads', on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'updated_at']),
+        ]
+    
+    @property
+    def total_chunks(self):
+        return max(1, -(-self.size // self.chunk_size))
+    
+    @property
+    def extension(self):
+        return self.filename.rsplit('.', 1)[-1].lower() if '.' in self.filename else ''
+    
+    def expected_chunk_size(self, index):
+        if index == self.total_chunks - 1:
+            return self.size - index * self.chunk_size
+        return self.chunk_size
+    
+    def __str__(self):
+        return f"Video upload {self.id} for {self.product.name}"
+
+
 class ProductReview(models.Model):
     """Product reviews"""
     product = models.ForeignKey(Product, related_name='reviews', on_delete=models.CASCADE)
@@ -0,0 +1,187 @@
+"""
+Product moderation transitions and the moderation queue.
+
+Every approve/reject/suspend - single product or bulk - is one UPDATE over
+a queryset. update() bypasses post_save, so catalog caches are invalidated
+once per call, category snapshots rebuilt once per affected category and
+the dealers' active-product counters adjusted for the rows it moved.
+
+Concurrent moderators take work from the pending queue by claiming a batch:
+claimed rows carry ``claimed_by`` and ``lease_expires_at`` and are skipped
+by other moderators until the lease runs out or a decision releases them.
+Leases are enforced: the admin list hides rows other moderators hold, and
+a decision on any of them raises LeaseHeld (409 in the views) without
+changing anything. Suspensions by the system (no moderator) ignore leases.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, When, Value, F, Q, Count
+from django.utils import timezone
+
+from config.products import cache as catalog_cache, quota, snapshots
+from config.products.models import Product
+
+
+class LeaseHeld(Exception):
+    """Some products are leased to another moderator"""
+
+    def __init__(self, ids):
+        super().__init__('Claimed by another moderator')
+        self.ids = ids
+
+
+def available_to(moderator, now=None):
+    """Rows `moderator` may decide: unleased, lease expired, or their own"""
+    now = now or timezone.now()
+    return Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lte=now) | Q(claimed_by=moderator)
+
+
+def _expires_at(queryset, now):
+    """expires_at = now + listing_duration_days, as a portable CASE expression.
+
+    Integer * interval arithmetic differs per backend, so branch on the
+    (few) distinct durations present in the batch instead.
+    """
+    durations = set(queryset.order_by().values_list('listing_duration_days', flat=True).distinct())
+    whens = [
+        When(listing_duration_days=days, then=Value(now + timedelta(days=days)))
+        for days in durations if days
+    ]
+    if not whens:
+        return F('expires_at')
+    # A zero duration keeps whatever expiry the product already had
+    return Case(*whens, default=F('expires_at'))
+
+
+def _apply(queryset, moderator, start_listing=False, **changes):
+    with transaction.atomic():
+        # The rows' statuses (for the counters) and leases, locked until commit
+        # so a claim can't slip in before the UPDATE
+        rows = list(queryset.select_for_update().order_by().values_list(
+            'pk', 'dealer_id', 'status', 'claimed_by_id', 'lease_expires_at'
+        ))
+        if moderator is not None:
+            now = timezone.now()
+            held = [
+                pk for pk, _, _, claimed_by_id, lease_expires_at in rows
+                if lease_expires_at and lease_expires_at > now and claimed_by_id != moderator.pk
+            ]
+            if held:
+                raise LeaseHeld(held)
+        previous = [(dealer_id, status) for _, dealer_id, status, _, _ in rows]
+        if start_listing:
+            changes['expires_at'] = _expires_at(queryset, changes['publish_date'])
+        category_ids = set(queryset.order_by().values_list('category_id', flat=True).distinct())
+        # A decision ends any lease on the row
+        count = queryset.update(
+            updated_at=timezone.now(), claimed_by=None, lease_expires_at=None, **changes
+        )
+        quota.adjust(quota.transition(previous, changes['status']))
+        transaction.on_commit(catalog_cache.invalidate_catalog)
+        for category_id in category_ids:
+            snapshots.refresh_category_on_commit(category_id)
+    return count
+
+
+def approve(queryset, reviewer):
+    """Approve products and start their listing period; returns rows updated"""
+    now = timezone.now()
+    return _apply(
+        queryset,
+        reviewer,
+        start_listing=True,
+        status='approved',
+        reviewed_by=reviewer,
+        reviewed_at=now,
+        publish_date=now,
+    )
+
+
+def reject(queryset, reviewer, reason):
+    return _apply(
+        queryset,
+        reviewer,
+        status='rejected',
+        rejection_reason=reason,
+        reviewed_by=reviewer,
+        reviewed_at=timezone.now(),
+    )
+
+
+def suspend(queryset, moderator=None):
+    return _apply(queryset, moderator, status='suspended')
+
+
+def _claimable(now):
+    return Q(status='pending') & (Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lte=now))
+
+
+def claim_batch(moderator, size=20, lease_seconds=None):
+    """Lease up to `size` of the oldest unclaimed pending products to a moderator.
+
+    On backends with SKIP LOCKED (Postgres) candidates are locked with
+    ``SELECT ... FOR UPDATE SKIP LOCKED`` so concurrent claims never wait on
+    each other. Elsewhere (SQLite) the claim is a single conditional UPDATE,
+    which the database serializes; the claimable condition is re-checked in
+    its WHERE clause so a row can only be won once.
+    """
+    lease_seconds = lease_seconds or getattr(settings, 'MODERATION_LEASE_SECONDS', 600)
+    now = timezone.now()
+    # (moderator, lease_expires_at) identifies this claim's rows afterwards
+    lease_expires_at = now + timedelta(seconds=lease_seconds)
+    candidates = Product.objects.filter(_claimable(now)).order_by('created_at')
+
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            ids = list(candidates.select_for_update(skip_locked=True).values_list('pk', flat=True)[:size])
+        else:
+            ids = candidates.values('pk')[:size]
+        Product.objects.filter(_claimable(now), pk__in=ids).update(
+            claimed_by=moderator, lease_expires_at=lease_expires_at
+        )
+    return Product.objects.filter(
+        claimed_by=moderator, lease_expires_at=lease_expires_at
+    ).order_by('created_at')
+
+
+def release(moderator, ids=None):
+    """Hand a moderator's undecided claims back to the queue"""
+    queryset = Product.objects.filter(claimed_by=moderator, status='pending')
+    if ids is not None:
+        queryset = queryset.filter(pk__in=ids)
+    return queryset.update(claimed_by=None, lease_expires_at=None)
+
+
+def moderator_stats(since):
+    """Decisions per moderator since `since`, plus leases currently held"""
+    now = timezone.now()
+    hours = max((now - since).total_seconds() / 3600, 1 / 60)
+    decided = (
+        Product.objects.filter(reviewed_at__gte=since, reviewed_by__isnull=False)
+        .values('reviewed_by', 'reviewed_by__username')
+        .annotate(
+            approved=Count('pk', filter=Q(status='approved')),
+            rejected=Count('pk', filter=Q(status='rejected')),
+            total=Count('pk'),
+        )
+    )
+    claimed = dict(
+        Product.objects.filter(status='pending', lease_expires_at__gt=now)
+        .values_list('claimed_by')
+        .annotate(count=Count('pk'))
+    )
+    stats = [
+        {
+            'moderator_id': row['reviewed_by'],
+            'moderator': row['reviewed_by__username'],
+            'approved': row['approved'],
+            'rejected': row['rejected'],
+            'total': row['total'],
+            'per_hour': round(row['total'] / hours, 2),
+            'claimed': claimed.get(row['reviewed_by'], 0),
+        }
+        for row in decided
+    ]
+    return sorted(stats, key=lambda row: row['total'], reverse=True)
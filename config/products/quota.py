@@ -0,0 +1,85 @@
+"""
+Active-listing counter behind the subscription quota.
+
+``DealerProfile.active_products`` holds the number of the dealer's products
+with status 'approved', so ``can_publish_product`` reads a field instead of
+counting products on every create and every profile render.
+
+The counter is only ever changed relatively (``active_products + n`` in one
+UPDATE), never by saving a profile instance, so concurrent transitions
+don't overwrite each other:
+
+* moderation (approve/reject/suspend) and the expiry job change status
+  with queryset.update() and adjust the counters for the rows they
+  touched, in the same transaction;
+* single-product saves and deletes go through the post_save/post_delete
+  signals in signals.py.
+
+``recount`` (``manage.py recount_active_products``) recomputes the counters
+from the products table in batches and fixes any that drifted.
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Value
+from django.db.models.functions import Greatest
+
+from config.accounts.models import DealerProfile
+from config.products.models import Product
+
+ACTIVE_STATUS = 'approved'
+
+
+def transition(rows, new_status):
+    """Counter deltas per dealer for moving `rows` ((dealer_id, old_status)
+    pairs) to `new_status`"""
+    deltas = Counter()
+    for dealer_id, old_status in rows:
+        deltas[dealer_id] += (new_status == ACTIVE_STATUS) - (old_status == ACTIVE_STATUS)
+    return deltas
+
+
+def adjust(deltas):
+    """Apply {dealer_id: delta}; one UPDATE per distinct delta"""
+    by_delta = defaultdict(list)
+    for dealer_id, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(dealer_id)
+    for delta, dealer_ids in by_delta.items():
+        # Clamped so a drifted counter can't trip the unsigned column check
+        DealerProfile.objects.filter(user_id__in=dealer_ids).update(
+            active_products=Greatest(F('active_products') + delta, Value(0))
+        )
+
+
+def lock_statuses(queryset):
+    """(dealer_id, status) of every row in `queryset`, locked until commit"""
+    return list(queryset.select_for_update().order_by().values_list('dealer_id', 'status'))
+
+
+def recount(batch_size=500):
+    """Recompute counters batch by batch; yields (checked, fixed) per batch"""
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            # Lock the profiles first: a transition committing meanwhile
+            # then waits and applies its delta on top of the recount
+            rows = list(
+                DealerProfile.objects.select_for_update().filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', 'user_id', 'active_products')[:batch_size]
+            )
+            if not rows:
+                return
+            last_pk = rows[-1][0]
+            profiles = {user_id: stored for _, user_id, stored in rows}
+            actual = dict(
+                Product.objects.filter(dealer_id__in=profiles, status=ACTIVE_STATUS)
+                .order_by().values('dealer_id').annotate(n=Count('pk')).values_list('dealer_id', 'n')
+            )
+            wrong = defaultdict(list)
+            for dealer_id, stored in profiles.items():
+                if stored != actual.get(dealer_id, 0):
+                    wrong[actual.get(dealer_id, 0)].append(dealer_id)
+            for count, dealer_ids in wrong.items():
+                DealerProfile.objects.filter(user_id__in=dealer_ids).update(active_products=count)
+        yield len(profiles), sum(len(ids) for ids in wrong.values())
@@ -1,5 +1,9 @@
 from rest_framework import serializers
-from config.products.models import Product, Category, ProductImage, ProductReview
+from django.conf import settings
+from django.db import transaction
+from config.products.models import Product, Category, ProductImage, ProductReview, VideoUpload
+from config.products import images, storage
+from config.products import cache as catalog_cache
 from config.permissions import is_admin_user
 from django.contrib.auth import get_user_model
 
@@ -12,10 +16,26 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'slug', 'description', 'is_active')
 
 
-class ProductImageSerializer(serializers.ModelSerializer):
+class ThumbnailMixin:
+    """`thumbnail` URL: the rendered WebP variant, or the original until it exists"""
+    
+    def get_thumbnail(self, obj):
+        return self._variant_url(obj, 'thumb')
+    
+    def _variant_url(self, obj, variant):
+        url = images.variant_url(obj, variant)
+        request = self.context.get('request')
+        if url and request:
+            return request.build_absolute_uri(url)
+        return url
+
+
+class ProductImageSerializer(ThumbnailMixin, serializers.ModelSerializer):
+    thumbnail = serializers.SerializerMethodField()
+    
     class Meta:
         model = ProductImage
-        fields = ('id', 'image', 'alt_text')
+        fields = ('id', 'image', 'thumbnail', 'alt_text', 'position')
 
 
 class ProductReviewSerializer(serializers.ModelSerializer):
@@ -27,17 +47,18 @@ class ProductReviewSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'user', 'is_verified_purchase', 'created_at')
 
 
-class ProductListSerializer(serializers.ModelSerializer):
+class ProductListSerializer(ThumbnailMixin, serializers.ModelSerializer):
     """Simplified product serializer for listing"""
     dealer = serializers.StringRelatedField(read_only=True)
     category = CategorySerializer(read_only=True)
+    thumbnail = serializers.SerializerMethodField()
     avg_rating = serializers.SerializerMethodField()
     review_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Product
         fields = ('id', 'name', 'slug', 'description', 'price_egp', 'price_gold', 'price_mass',
-                  'image', 'stock', 'category', 'dealer', 'is_featured', 'created_at',
+                  'image', 'thumbnail', 'stock', 'category', 'dealer', 'is_featured', 'created_at',
                   'avg_rating', 'review_count')
     
     def get_avg_rating(self, obj):
@@ -50,9 +71,11 @@ class ProductListSerializer(serializers.ModelSerializer):
         return obj.reviews.count()
 
 
-class ProductDetailSerializer(serializers.ModelSerializer):
+class ProductDetailSerializer(ThumbnailMixin, serializers.ModelSerializer):
     """Full product details serializer"""
     dealer = serializers.StringRelatedField(read_only=True)
+    thumbnail = serializers.SerializerMethodField()
+    image_medium = serializers.SerializerMethodField()
     dealer_id = serializers.IntegerField(source='dealer.id', read_only=True)
     category = CategorySerializer(read_only=True)
     additional_images = ProductImageSerializer(many=True, read_only=True)
@@ -64,7 +87,7 @@ class ProductDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = ('id', 'name', 'slug', 'description', 'price_egp', 'price_gold', 'price_mass',
-                  'primary_payment_type', 'image', 'video', 'stock', 'status', 'rejection_reason',
+                  'primary_payment_type', 'image', 'thumbnail', 'image_medium', 'video', 'stock', 'status', 'rejection_reason',
                   'category', 'dealer', 'dealer_id', 'is_featured', 'is_active', 'expires_at',
                   'created_at', 'updated_at', 'publish_date', 'additional_images', 'reviews',
                   'avg_rating', 'review_count', 'can_edit')
@@ -80,6 +103,9 @@ class ProductDetailSerializer(serializers.ModelSerializer):
     def get_review_count(self, obj):
         return obj.reviews.count()
     
+    def get_image_medium(self, obj):
+        return self._variant_url(obj, 'medium')
+    
     def get_can_edit(self, obj):
         request = self.context.get('request')
         if not request or not request.user:
@@ -87,24 +113,64 @@ class ProductDetailSerializer(serializers.ModelSerializer):
         return obj.dealer == request.user or is_admin_user(request.user)
 
 
+class BulkModerationSerializer(serializers.Serializer):
+    """Selects products for a bulk moderation action by ids and/or filters"""
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    status = serializers.ChoiceField(choices=Product.STATUS_CHOICES, required=False)
+    category = serializers.IntegerField(required=False)
+    dealer = serializers.IntegerField(required=False)
+    reason = serializers.CharField(required=False, default='Not specified')
+    
+    def validate(self, data):
+        """Refuse to moderate the whole catalog by accident"""
+        if not any(field in data for field in ('ids', 'status', 'category', 'dealer')):
+            raise serializers.ValidationError("Provide ids or at least one filter (status, category, dealer)")
+        return data
+    
+    def get_queryset(self):
+        data = self.validated_data
+        queryset = Product.objects.all()
+        if 'ids' in data:
+            queryset = queryset.filter(pk__in=data['ids'])
+        for field in ('status', 'category', 'dealer'):
+            if field in data:
+                queryset = queryset.filter(**{field: data[field]})
+        return queryset
+
+
 class ProductCreateUpdateSerializer(serializers.ModelSerializer):
     """Create/Update product serializer - for dealers"""
     category_id = serializers.IntegerField(write_only=True)
+    # Additional images are edited incrementally: new uploads are appended,
+    # listed ids are removed, and image_order sets the order of what remains.
     additional_images = serializers.ListField(
         child=serializers.ImageField(),
         required=False,
         write_only=True
     )
+    remove_image_ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        required=False,
+        write_only=True
+    )
+    image_order = serializers.ListField(
+        child=serializers.IntegerField(),
+        required=False,
+        write_only=True
+    )
     
     class Meta:
         model = Product
         fields = ('name', 'description', 'price_egp', 'price_gold', 'price_mass',
                   'primary_payment_type', 'image', 'video', 'stock', 'is_featured',
-                  'category_id', 'listing_duration_days', 'additional_images')
+                  'category_id', 'listing_duration_days', 'additional_images',
+                  'remove_image_ids', 'image_order')
     
     def validate(self, data):
-        """Ensure at least one price is set"""
-        if not any([data.get('price_egp'), data.get('price_gold'), data.get('price_mass')]):
+        """Ensure at least one price is set (partial updates keep the stored prices)"""
+        prices = [data.get(field, getattr(self.instance, field, None))
+                  for field in ('price_egp', 'price_gold', 'price_mass')]
+        if not any(prices):
             raise serializers.ValidationError("At least one price must be set")
         return data
     
@@ -114,6 +180,8 @@ class ProductCreateUpdateSerializer(serializers.ModelSerializer):
         from config.accounts.models import DealerProfile
         
         additional_images = validated_data.pop('additional_images', [])
+        validated_data.pop('remove_image_ids', None)
+        validated_data.pop('image_order', None)
         category_id = validated_data.pop('category_id')
         category = Category.objects.get(id=category_id)
         
@@ -140,41 +208,107 @@ class ProductCreateUpdateSerializer(serializers.ModelSerializer):
             dealer_profile.save()
         else:
             # Charge subscription if exists
-            if dealer_profile.subscription_plan:
+            if dealer_profile.subscription_plan_id:
                 # Subscription allows publishing, just update count
                 dealer_profile.products_published += 1
                 dealer_profile.save()
         
         # Add images
-        for image in additional_images:
-            ProductImage.objects.create(product=product, image=image)
+        self._update_images(product, add=additional_images)
         
         return product
     
     def update(self, instance, validated_data):
         """Update product"""
-        additional_images = validated_data.pop('additional_images', None)
+        additional_images = validated_data.pop('additional_images', [])
+        remove_image_ids = validated_data.pop('remove_image_ids', [])
+        image_order = validated_data.pop('image_order', None)
         category_id = validated_data.pop('category_id', None)
         
         # Update basic fields
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
         
+        previous_category_id = instance.category_id
         if category_id:
             instance.category_id = category_id
         
-        instance.save()
-        
-        # Update images if provided
-        if additional_images is not None:
-            instance.additional_images.all().delete()
-            for image in additional_images:
-                ProductImage.objects.create(product=instance, image=image)
+        with transaction.atomic():
+            instance.save()
+            self._update_images(instance, add=additional_images, remove=remove_image_ids, order=image_order)
+        if instance.category_id != previous_category_id:
+            # post_save only knows the new category; drop the old snapshot too
+            from config.products import snapshots
+            snapshots.discard_category(previous_category_id)
         
         return instance
-    dealer_name = serializers.CharField(source='dealer.username', read_only=True)
+    
+    def _update_images(self, product, add=(), remove=(), order=None):
+        """Apply an additional-images diff: one DELETE, one INSERT, one UPDATE at most.
+        
+        Images that are kept are never rewritten, so their files stay untouched.
+        """
+        if not (add or remove or order is not None):
+            return
+        current = dict(product.additional_images.values_list('id', 'position'))
+        unknown = (set(remove) | set(order or ())) - set(current)
+        if unknown:
+            raise serializers.ValidationError(
+                {'additional_images': f'Unknown image ids for this product: {sorted(unknown)}'}
+            )
+        
+        if remove:
+            # post_delete still releases each file's reference
+            product.additional_images.filter(id__in=remove).delete()
+        kept = {pk: position for pk, position in current.items() if pk not in set(remove)}
+        
+        if order is not None:
+            if sorted(order) != sorted(kept):
+                raise serializers.ValidationError(
+                    {'image_order': 'Must list every remaining image id exactly once'}
+                )
+            moved = [
+                ProductImage(id=pk, position=position)
+                for position, pk in enumerate(order) if kept[pk] != position
+            ]
+            ProductImage.objects.bulk_update(moved, ['position'])
+            kept = {pk: position for position, pk in enumerate(order)}
+        
+        if add:
+            start = max(kept.values(), default=-1) + 1
+            created = ProductImage.objects.bulk_create([
+                ProductImage(product=product, image=image, position=start + offset)
+                for offset, image in enumerate(add)
+            ])
+            # bulk_create skips post_save: count references and queue variants here
+            storage.acquire(image.image.name for image in created)
+            for image in created:
+                images.schedule(image)
+        
+        catalog_cache.invalidate_product(product.slug, listings=False)
+
 
+class VideoUploadSerializer(serializers.ModelSerializer):
+    """Starts a chunked video upload; the response tells the client how to chunk"""
+    product = serializers.SlugRelatedField(slug_field='slug', queryset=Product.objects.all())
+    total_chunks = serializers.IntegerField(read_only=True)
+    
     class Meta:
-        model = Product
-        fields = '__all__'
-        read_only_fields = ('dealer',)
+        model = VideoUpload
+        fields = ('id', 'product', 'filename', 'size', 'chunk_size', 'total_chunks', 'status', 'created_at')
+        read_only_fields = ('id', 'chunk_size', 'status', 'created_at')
+    
+    def validate_filename(self, value):
+        extension = value.rsplit('.', 1)[-1].lower() if '.' in value else ''
+        if extension not in settings.ALLOWED_VIDEO_EXTENSIONS:
+            raise serializers.ValidationError(
+                f"Unsupported video type. Allowed: {', '.join(settings.ALLOWED_VIDEO_EXTENSIONS)}"
+            )
+        return value
+    
+    def validate_size(self, value):
+        if not 0 < value <= settings.MAX_VIDEO_UPLOAD_SIZE:
+            raise serializers.ValidationError(
+                f"Video size must be between 1 and {settings.MAX_VIDEO_UPLOAD_SIZE} bytes"
+            )
+        return value
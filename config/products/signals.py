@@ -0,0 +1,103 @@
+"""
+Django signals keeping the catalog response cache, image variants, media
+reference counts and dealers' active-product counters coherent
+"""
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from config.products.models import Category, Product, ProductImage, ProductReview
+from config.products import cache as catalog_cache
+from config.products import snapshots
+from config.products import images
+from config.products import storage as media_storage
+from config.products import quota
+
+
+def _product_slug(product_id):
+    # Filter instead of instance.product: during a cascading product delete
+    # the parent row may already be gone.
+    return Product.objects.filter(pk=product_id).values_list('slug', flat=True).first()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_on_category_change(sender, instance, **kwargs):
+    """Categories are nested in every product payload"""
+    catalog_cache.invalidate_catalog()
+    snapshots.discard_category(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_on_product_change(sender, instance, **kwargs):
+    catalog_cache.invalidate_product(instance.slug)
+    snapshots.discard_category(instance.category_id)
+
+
+@receiver(post_save, sender=ProductReview)
+@receiver(post_delete, sender=ProductReview)
+def invalidate_on_review_change(sender, instance, **kwargs):
+    """Reviews feed avg_rating/review_count in both list and detail"""
+    catalog_cache.invalidate_product(_product_slug(instance.product_id))
+    category_id = Product.objects.filter(pk=instance.product_id).values_list('category_id', flat=True).first()
+    if category_id:
+        snapshots.discard_category(category_id)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def invalidate_on_image_change(sender, instance, **kwargs):
+    """Additional images only appear in the detail payload"""
+    catalog_cache.invalidate_product(_product_slug(instance.product_id), listings=False)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+def schedule_image_variants(sender, instance, raw=False, **kwargs):
+    """Render thumbnails/WebP for new or replaced uploads off the request thread"""
+    if not raw and images.needs_processing(instance):
+        images.schedule(instance)
+
+
+@receiver(post_init, sender=Product)
+@receiver(post_init, sender=ProductImage)
+def remember_stored_media(sender, instance, **kwargs):
+    instance._stored_media = media_storage.stored_names(instance)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+def count_media_references(sender, instance, created, **kwargs):
+    """Move MediaBlob references from the previous files to the current ones"""
+    previous = {} if created else instance._stored_media
+    current = media_storage.stored_names(instance)
+    changed = [field for field, name in current.items() if previous.get(field, name) != name or created]
+    media_storage.release(previous.get(field) for field in changed)
+    media_storage.acquire(current[field] for field in changed)
+    instance._stored_media = {**previous, **current}
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductImage)
+def release_media_references(sender, instance, **kwargs):
+    media_storage.release({**instance._stored_media, **media_storage.stored_names(instance)}.values())
+
+
+@receiver(post_init, sender=Product)
+def remember_status(sender, instance, **kwargs):
+    # None when the field is deferred: the transition can't be told then
+    instance._stored_status = instance.__dict__.get('status')
+
+
+@receiver(post_save, sender=Product)
+def count_active_products(sender, instance, created, raw=False, **kwargs):
+    """Bulk transitions adjust the counters themselves (see quota.py)"""
+    previous = None if created else instance._stored_status
+    if raw or (previous is None and not created):
+        return
+    quota.adjust(quota.transition([(instance.dealer_id, previous)], instance.status))
+    instance._stored_status = instance.status
+
+
+@receiver(post_delete, sender=Product)
+def uncount_deleted_product(sender, instance, **kwargs):
+    quota.adjust(quota.transition([(instance.dealer_id, instance.status)], None))
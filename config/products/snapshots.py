@@ -0,0 +1,152 @@
+"""
+Precomputed per-category catalog snapshots.
+
+The shop front lists products by category, so the first pages of every
+active category are materialized into the cache for the orderings the shop
+uses. A snapshot is one cache entry per category:
+
+    {None: {'count': 42, 'pages': [[...], [...]]}, 'price_egp': {...}}
+
+Image and thumbnail URLs are stored relative and made absolute per request. Moderation
+status changes rebuild the affected category; other edits only discard it
+(see signals.py) and the category is served live until the next rebuild.
+
+Keys carry the catalog generation (cache.py), so a catalog-wide bump drops
+every snapshot, and entries expire after CATALOG_CACHE_TIMEOUT. Snapshots
+are only used with a shared cache: a discard from another worker, the
+expiry job or ``build_catalog_snapshots`` never reaches a process-local
+copy.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from config.accounts.tokens import cache_is_shared
+from config.products.cache import GENERATION_ALL, LIST_PARAMS, get_generation
+from config.products.models import Category, Product
+from config.products.serializers import ProductListSerializer
+
+SNAPSHOT_KEY = 'catalog:snapshot:{generation}:{category_id}'
+
+# ?ordering= value -> queryset ordering; None is the viewset default
+SNAPSHOT_ORDERINGS = {
+    None: ['-created_at'],
+    'price_egp': ['price_egp'],
+}
+
+
+def is_enabled():
+    return cache_is_shared()
+
+
+def _key(category_id):
+    return SNAPSHOT_KEY.format(generation=get_generation(GENERATION_ALL), category_id=category_id)
+
+
+def _page_size():
+    return settings.REST_FRAMEWORK['PAGE_SIZE']
+
+
+def _page_count():
+    return getattr(settings, 'CATALOG_SNAPSHOT_PAGES', 5)
+
+
+def build_category_snapshot(category_id, pages=None):
+    """Serialize the first `pages` pages of a category for every ordering"""
+    pages = pages or _page_count()
+    page_size = _page_size()
+    queryset = Product.objects.public().filter(category_id=category_id)
+    count = queryset.count()
+
+    snapshot = {}
+    for ordering, order_by in SNAPSHOT_ORDERINGS.items():
+        products = queryset.order_by(*order_by)[:pages * page_size]
+        results = ProductListSerializer(products, many=True).data
+        snapshot[ordering] = {
+            'count': count,
+            'pages': [results[i:i + page_size] for i in range(0, len(results), page_size)],
+        }
+    return snapshot
+
+
+def refresh_category(category_id, pages=None):
+    """Rebuild one category's snapshot (or drop it if the category is inactive)"""
+    if not is_enabled():
+        return
+    if not Category.objects.filter(pk=category_id, is_active=True).exists():
+        discard_category(category_id)
+        return
+    cache.set(_key(category_id), build_category_snapshot(category_id, pages),
+              getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300))
+
+
+def refresh_category_on_commit(category_id):
+    transaction.on_commit(lambda: refresh_category(category_id))
+
+
+def discard_category(category_id):
+    cache.delete(_key(category_id))
+
+
+def refresh_all(pages=None):
+    """Rebuild snapshots for every active category; returns how many were built"""
+    if not is_enabled():
+        return 0
+    category_ids = list(Category.objects.filter(is_active=True).values_list('id', flat=True))
+    for category_id in category_ids:
+        refresh_category(category_id, pages)
+    return len(category_ids)
+
+
+def _match(query_params):
+    """(category_id, ordering, page) if the request is a plain category listing"""
+    if any(name in query_params for name in LIST_PARAMS if name not in ('category', 'ordering', 'page')):
+        return None
+    try:
+        category_id = int(query_params['category'])
+        page = int(query_params.get('page', 1))
+    except (KeyError, ValueError):
+        return None
+    ordering = query_params.get('ordering') or None
+    if ordering not in SNAPSHOT_ORDERINGS or page < 1:
+        return None
+    return category_id, ordering, page
+
+
+def get_page(request):
+    """Paginated response data for a request, or None to fall back to the live query"""
+    match = _match(request.query_params) if is_enabled() else None
+    if match is None:
+        return None
+    category_id, ordering, page = match
+
+    snapshot = cache.get(_key(category_id))
+    if snapshot is None:
+        return None
+    entry = snapshot[ordering]
+    if page > len(entry['pages']):
+        return None
+
+    results = []
+    for item in entry['pages'][page - 1]:
+        item = dict(item)
+        for field in ('image', 'thumbnail'):
+            if item.get(field):
+                item[field] = request.build_absolute_uri(item[field])
+        results.append(item)
+
+    url = request.build_absolute_uri()
+    has_next = page * _page_size() < entry['count']
+    if page == 1:
+        previous = None
+    elif page == 2:
+        previous = remove_query_param(url, 'page')
+    else:
+        previous = replace_query_param(url, 'page', page - 1)
+    return {
+        'count': entry['count'],
+        'next': replace_query_param(url, 'page', page + 1) if has_next else None,
+        'previous': previous,
+        'results': results,
+    }
@@ -0,0 +1,297 @@
+"""
+Content-addressed storage for product media.
+
+Product.image, Product.video and ProductImage.image are stored by the
+SHA-256 of their bytes:
+
+    products/3a/7b/3a7b...e1.jpg
+
+so uploading a file that is already stored (the same photo on several
+products, a re-submitted edit) writes nothing - the row just points at the
+existing name. Each stored file has a MediaBlob row whose ``refcount`` is
+the number of model fields pointing at it; signals.py keeps it current and
+``manage.py gc_media`` deletes blobs nobody references any more.
+
+Saving and collecting meet on the blob row: ``_save`` creates or locks it
+before looking for the file, and ``collect_garbage`` deletes the file while
+holding that lock. A save of the same content racing a collection waits,
+finds the row gone and writes the file again, instead of pointing at a
+file that's about to disappear.
+
+Files stored before blobs existed have no row; ``backfill_blobs``
+(``manage.py gc_media --backfill``) creates them so those files are
+counted and collected like the rest.
+"""
+from collections import Counter
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.core.files import File
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.db.models.fields.files import FieldFile
+from django.utils import timezone
+
+# model label -> file fields whose storage is content addressed
+MEDIA_FIELDS = {
+    'products.Product': ('image', 'video'),
+    'products.ProductImage': ('image',),
+}
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class LocalFile(File):
+    """A file already on local disk; storage moves it instead of copying"""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def content_name(directory, digest, extension):
+    return posixpath.join(directory, digest[:2], digest[2:4], digest + extension.lower())
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage that names files by content hash and never stores one twice"""
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is only known once the content is hashed in _save
+        return name
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in content.chunks(HASH_BLOCK_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+        directory, filename = posixpath.split(name)
+        name = content_name(directory, digest.hexdigest(), os.path.splitext(filename)[1])
+        with transaction.atomic():
+            # The row stays locked until the file is in place
+            _register_blob(name, size)
+            self._store(name, content)
+        return name
+
+    def _store(self, name, content):
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            # Duplicate upload: metadata only
+            if hasattr(content, 'temporary_file_path'):
+                os.remove(content.temporary_file_path())
+        else:
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            if hasattr(content, 'temporary_file_path'):
+                file_move_safe(content.temporary_file_path(), full_path, allow_overwrite=True)
+            else:
+                # Write beside the target and rename, so readers never see a partial file
+                fd, partial = tempfile.mkstemp(dir=os.path.dirname(full_path), suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'wb') as fh:
+                        for chunk in content.chunks(HASH_BLOCK_SIZE):
+                            fh.write(chunk)
+                    os.replace(partial, full_path)
+                except BaseException:
+                    if os.path.exists(partial):
+                        os.remove(partial)
+                    raise
+            if self.file_permissions_mode is not None:
+                os.chmod(full_path, self.file_permissions_mode)
+
+
+def _register_blob(name, size):
+    """Create or touch the blob row of `name`, locking it until commit"""
+    from config.products.models import MediaBlob
+
+    # The touch keeps gc_media's grace period from collecting a blob that is
+    # being reused; it waits while a collection holds the row
+    if MediaBlob.objects.filter(name=name).update(updated_at=timezone.now()):
+        return
+    try:
+        with transaction.atomic():
+            MediaBlob.objects.create(name=name, size=size)
+    except IntegrityError:
+        # Registered by a concurrent save of the same content
+        MediaBlob.objects.filter(name=name).update(updated_at=timezone.now())
+
+
+_storage = ContentAddressedStorage()
+
+
+def media_storage():
+    """Storage callable for the content-addressed file fields"""
+    return _storage
+
+
+def stored_names(instance):
+    """{field: committed storage name} for the media fields loaded on `instance`"""
+    names = {}
+    for field in MEDIA_FIELDS.get(instance._meta.label, ()):
+        # __dict__ so deferred fields are never loaded just to be tracked
+        if field not in instance.__dict__:
+            continue
+        value = instance.__dict__[field]
+        if isinstance(value, FieldFile):
+            value = value.name if value._committed else None
+        names[field] = value if isinstance(value, str) and value else None
+    return names
+
+
+def acquire(names):
+    _adjust(names, 1)
+
+
+def release(names):
+    _adjust(names, -1)
+
+
+def _adjust(names, delta):
+    from config.products.models import MediaBlob
+
+    for name in names:
+        if name:
+            MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + delta)
+
+
+def delete_file(name):
+    """Remove a stored file and any image variants rendered from it"""
+    from config.products import images
+
+    paths = [name]
+    if not name.startswith('product_videos/'):
+        paths += [images.variant_name(name, variant) for variant in images.VARIANT_SIZES]
+    for path in paths:
+        if _storage.exists(path):
+            _storage.delete(path)
+
+
+def reference_counts(names):
+    """Counter of how many media fields point at each of `names`"""
+    from django.apps import apps
+
+    counts = Counter()
+    for label, fields in MEDIA_FIELDS.items():
+        model = apps.get_model(label)
+        for field in fields:
+            counts.update(dict(
+                model.objects.filter(**{f'{field}__in': names}).order_by()
+                .values_list(field).annotate(n=Count('pk'))
+            ))
+    return counts
+
+
+def collect_garbage(grace, batch_size=500, dry_run=False):
+    """Delete blobs with no references untouched for `grace`; yields deleted names.
+
+    Walks the candidates by primary key in batches rather than holding one
+    cursor open, so it streams over any number of blobs.
+    """
+    from config.products.models import MediaBlob
+
+    cutoff = timezone.now() - grace
+    candidates = MediaBlob.objects.filter(refcount__lte=0, updated_at__lt=cutoff).order_by('pk')
+    last_pk = 0
+    while True:
+        batch = list(candidates.filter(pk__gt=last_pk).values_list('pk', 'name')[:batch_size])
+        if not batch:
+            return
+        last_pk = batch[-1][0]
+        if not dry_run:
+            with transaction.atomic():
+                # Re-checked under lock: a blob reacquired meanwhile survives
+                batch = list(
+                    candidates.filter(pk__in=[pk for pk, _ in batch]).select_for_update()
+                    .values_list('pk', 'name')
+                )
+                # A drifted refcount mustn't cost a file that is still in use
+                in_use = reference_counts([name for _, name in batch])
+                batch = [(pk, name) for pk, name in batch if name not in in_use]
+                MediaBlob.objects.filter(pk__in=[pk for pk, _ in batch]).delete()
+                # Still under the row locks, see the module docstring
+                for _, name in batch:
+                    delete_file(name)
+        for _, name in batch:
+            yield name
+
+
+def delete_untracked(name):
+    """Delete a file find_orphans reported, unless a save registered it
+    meanwhile; returns whether it was deleted"""
+    from config.products.models import MediaBlob
+
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                # Claims the name: a save of the same content waits on the row
+                MediaBlob.objects.create(name=name, size=0)
+        except IntegrityError:
+            return False
+        delete_file(name)
+        MediaBlob.objects.filter(name=name).delete()
+    return True
+
+
+def backfill_blobs(batch_size=500):
+    """Create blob rows for referenced files stored before blobs existed;
+    yields the number of rows created per batch"""
+    from django.apps import apps
+    from config.products.models import MediaBlob
+
+    for label, fields in MEDIA_FIELDS.items():
+        model = apps.get_model(label)
+        for field in fields:
+            names = (
+                model.objects.filter(**{f'{field}__isnull': False}).exclude(**{field: ''})
+                .order_by(field).values_list(field, flat=True).distinct()
+            )
+            last = ''
+            while True:
+                batch = list(names.filter(**{f'{field}__gt': last})[:batch_size])
+                if not batch:
+                    break
+                last = batch[-1]
+                known = set(MediaBlob.objects.filter(name__in=batch).values_list('name', flat=True))
+                missing = [name for name in batch if name not in known and _storage.exists(name)]
+                counts = reference_counts(missing)
+                MediaBlob.objects.bulk_create([
+                    MediaBlob(name=name, size=_storage.size(name), refcount=counts[name]) for name in missing
+                ], ignore_conflicts=True)
+                yield len(missing)
+
+
+def _walk(directory):
+    """Stream stored file names under a media directory"""
+    root = _storage.path(directory)
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d != 'variants']
+        for filename in filenames:
+            if not filename.endswith('.tmp'):
+                relative = os.path.relpath(os.path.join(dirpath, filename), root)
+                yield posixpath.join(directory, relative.replace(os.sep, '/'))
+
+
+def find_orphans(grace, batch_size=500):
+    """Stream media files that neither a MediaBlob nor any model field references"""
+    from config.products.models import MediaBlob
+
+    cutoff = (timezone.now() - grace).timestamp()
+    batch = []
+
+    def orphans_in(names):
+        known = set(MediaBlob.objects.filter(name__in=names).values_list('name', flat=True))
+        known.update(reference_counts(names))
+        return [name for name in names if name not in known]
+
+    for directory in ('products', 'product_images', 'product_videos'):
+        for name in _walk(directory):
+            if os.path.getmtime(_storage.path(name)) < cutoff:
+                batch.append(name)
+            if len(batch) >= batch_size:
+                yield from orphans_in(batch)
+                batch = []
+    if batch:
+        yield from orphans_in(batch)
@@ -1,3 +1,711 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+import os
+import shutil
+import tempfile
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from config.accounts.models import DealerProfile, SubscriptionPlan, User
+from config.accounts.tests import use_shared_cache
+from PIL import Image
+
+from config.products import cache as catalog_cache, images, moderation, snapshots, storage, uploads
+from config.products.expiry import expire_listings
+from config.products.models import Category, MediaBlob, Product, ProductImage, ProductReview, VideoUpload
+
+
+class CatalogTestCase(TestCase):
+    """Shared fixtures for product API tests"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.dealer = User.objects.create_user(username='dealer', password='pass12345', role='dealer')
+        self.category = Category.objects.create(name='Electronics', slug='electronics')
+
+    def make_product(self, slug, dealer=None, status='approved', **kwargs):
+        return Product.objects.create(
+            category=kwargs.pop('category', self.category),
+            dealer=dealer or self.dealer,
+            name=slug.title(),
+            slug=slug,
+            description='Test product',
+            price_egp=kwargs.pop('price_egp', Decimal('100.00')),
+            image=kwargs.pop('image', 'products/test.jpg'),
+            status=status,
+            **kwargs
+        )
+
+
+class CatalogCacheTests(CatalogTestCase):
+    def test_anonymous_list_is_served_from_cache(self):
+        self.make_product('laptop')
+        self.client.get('/api/shop/products/')
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/shop/products/')
+        self.assertEqual(response.data['count'], 1)
+
+    def test_query_params_are_normalized(self):
+        self.make_product('laptop')
+        self.client.get('/api/shop/products/?category=%d&search=' % self.category.id)
+
+        with self.assertNumQueries(0):
+            self.client.get('/api/shop/products/?_=123&category=%d' % self.category.id)
+
+    def test_product_save_invalidates_list_and_detail(self):
+        product = self.make_product('laptop')
+        self.client.get('/api/shop/products/')
+        self.client.get('/api/shop/products/laptop/')
+
+        product.status = 'suspended'
+        product.save()
+
+        self.assertEqual(self.client.get('/api/shop/products/').data['count'], 0)
+        self.assertEqual(self.client.get('/api/shop/products/laptop/').status_code, 404)
+
+    def test_review_invalidates_rating(self):
+        product = self.make_product('laptop')
+        self.assertIsNone(self.client.get('/api/shop/products/laptop/').data['avg_rating'])
+
+        ProductReview.objects.create(product=product, user=self.dealer, rating=4, title='Good', comment='Nice')
+
+        self.assertEqual(self.client.get('/api/shop/products/laptop/').data['avg_rating'], 4)
+        self.assertEqual(self.client.get('/api/shop/products/').data['results'][0]['review_count'], 1)
+
+    def test_category_change_invalidates_everything(self):
+        self.make_product('laptop')
+        self.client.get('/api/shop/products/laptop/')
+
+        self.category.name = 'Computers'
+        self.category.save()
+
+        response = self.client.get('/api/shop/products/laptop/')
+        self.assertEqual(response.data['category']['name'], 'Computers')
+
+    def test_authenticated_requests_bypass_cache(self):
+        self.make_product('laptop', status='pending')
+        self.client.get('/api/shop/products/')
+        self.client.force_authenticate(self.dealer)
+
+        self.assertEqual(self.client.get('/api/shop/products/').data['count'], 1)
+
+
+class CategorySnapshotTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        use_shared_cache(self)
+        self.admin = User.objects.create_user(username='admin', password='pass12345', role='admin', is_staff=True)
+        for i in range(12):
+            self.make_product(f'item-{i}', price_egp=Decimal(100 - i))
+
+    def test_category_pages_are_served_from_snapshot(self):
+        snapshots.refresh_category(self.category.id)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(f'/api/shop/products/?category={self.category.id}&ordering=price_egp&page=2')
+        self.assertEqual(response.data['count'], 12)
+        self.assertEqual([p['slug'] for p in response.data['results']], ['item-1', 'item-0'])
+        self.assertTrue(response.data['results'][0]['image'].startswith('http://testserver/media/'))
+        self.assertIsNone(response.data['next'])
+        self.assertNotIn('page=', response.data['previous'])
+
+    def test_snapshot_matches_live_listing(self):
+        url = f'/api/shop/products/?category={self.category.id}'
+        live = self.client.get(url).data
+        cache.clear()
+        snapshots.refresh_category(self.category.id)
+
+        self.assertEqual(self.client.get(url).data, live)
+
+    def test_moderation_refreshes_category_snapshot(self):
+        snapshots.refresh_category(self.category.id)
+        self.client.force_authenticate(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/shop/products/item-0/suspend/')
+        self.client.force_authenticate(None)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(f'/api/shop/products/?category={self.category.id}')
+        self.assertEqual(response.data['count'], 11)
+
+    def test_catalog_bump_drops_snapshots(self):
+        snapshots.refresh_category(self.category.id)
+        Product.objects.filter(slug='item-0').update(status='suspended')
+        catalog_cache.invalidate_catalog()
+
+        self.assertEqual(self.client.get(f'/api/shop/products/?category={self.category.id}').data['count'], 11)
+
+    def test_local_cache_serves_no_snapshots(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            snapshots.refresh_category(self.category.id)
+            Product.objects.filter(slug='item-0').update(status='suspended')
+
+            self.assertEqual(self.client.get(f'/api/shop/products/?category={self.category.id}').data['count'], 11)
+
+    def test_filtered_requests_bypass_snapshot(self):
+        snapshots.refresh_category(self.category.id)
+
+        response = self.client.get(f'/api/shop/products/?category={self.category.id}&search=item-11')
+        self.assertEqual(response.data['count'], 1)
+
+
+class DealerVisibilityTests(CatalogTestCase):
+    def test_dealer_sees_public_and_own_products_only(self):
+        other = User.objects.create_user(username='other', password='pass12345', role='dealer')
+        self.make_product('own-pending', status='pending')
+        self.make_product('own-inactive', is_active=False)
+        self.make_product('other-approved', dealer=other)
+        self.make_product('other-rejected', dealer=other, status='rejected')
+        self.make_product('other-suspended', dealer=other, status='suspended')
+        self.make_product('other-inactive', dealer=other, is_active=False)
+
+        visible = Product.objects.visible_to_dealer(self.dealer)
+        self.assertEqual(
+            sorted(visible.values_list('slug', flat=True)),
+            ['other-approved', 'own-inactive', 'own-pending'],
+        )
+
+        self.client.force_authenticate(self.dealer)
+        response = self.client.get(f'/api/shop/products/?dealer={other.id}')
+        self.assertEqual([p['slug'] for p in response.data['results']], ['other-approved'])
+
+
+class ListingExpiryTests(CatalogTestCase):
+    def test_expired_listings_are_hidden_in_batches(self):
+        past = timezone.now() - timedelta(minutes=1)
+        for i in range(5):
+            self.make_product(f'old-{i}', expires_at=past)
+        self.make_product('fresh', expires_at=timezone.now() + timedelta(days=1))
+        self.make_product('pending', status='pending', expires_at=past)
+        self.assertEqual(self.client.get('/api/shop/products/').data['count'], 6)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(expire_listings(batch_size=2), 5)
+
+        self.assertEqual(Product.objects.filter(status='expired').count(), 5)
+        self.assertEqual(Product.objects.get(slug='pending').status, 'pending')
+        response = self.client.get('/api/shop/products/')
+        self.assertEqual([p['slug'] for p in response.data['results']], ['fresh'])
+        self.assertEqual(self.client.get('/api/shop/products/old-0/').status_code, 404)
+
+
+class BulkModerationTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_user(username='admin', password='pass12345', role='admin', is_staff=True)
+        self.client.force_authenticate(self.admin)
+
+    def test_bulk_approve_by_filter_sets_expiry_per_duration(self):
+        week = self.make_product('week', status='pending', listing_duration_days=7)
+        month = self.make_product('month', status='pending', listing_duration_days=30)
+        forever = self.make_product('forever', status='pending', listing_duration_days=0)
+        self.make_product('rejected', status='rejected')
+
+        with self.assertNumQueries(7):  # savepoint, durations, categories, statuses, UPDATE, counters, release
+            response = self.client.post('/api/admin/products/bulk_approve/', {'status': 'pending'}, format='json')
+        self.assertEqual(response.data['count'], 3)
+
+        for product in (week, month, forever):
+            product.refresh_from_db()
+            self.assertEqual(product.status, 'approved')
+            self.assertEqual(product.reviewed_by, self.admin)
+        self.assertEqual((week.expires_at - week.reviewed_at).days, 7)
+        self.assertEqual((month.expires_at - month.reviewed_at).days, 30)
+        self.assertIsNone(forever.expires_at)
+        self.assertEqual(Product.objects.get(slug='rejected').status, 'rejected')
+
+    def test_bulk_reject_and_suspend_by_ids(self):
+        a = self.make_product('a', status='pending')
+        b = self.make_product('b', status='pending')
+        c = self.make_product('c')
+
+        response = self.client.post('/api/admin/products/bulk_reject/', {'ids': [a.id, b.id], 'reason': 'Blurry'}, format='json')
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(Product.objects.get(pk=a.pk).rejection_reason, 'Blurry')
+
+        response = self.client.post('/api/admin/products/bulk_suspend/', {'ids': [c.id]}, format='json')
+        self.assertEqual(Product.objects.get(pk=c.pk).status, 'suspended')
+
+    def test_bulk_requires_a_selection(self):
+        self.make_product('a', status='pending')
+        response = self.client.post('/api/admin/products/bulk_approve/', {}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Product.objects.get(slug='a').status, 'pending')
+
+    def test_bulk_moderation_invalidates_catalog_once(self):
+        self.make_product('a', status='pending')
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/api/shop/products/').data['count'], 0)
+
+        self.client.force_authenticate(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/admin/products/bulk_approve/', {'status': 'pending'}, format='json')
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/api/shop/products/').data['count'], 1)
+
+
+class ActiveProductCounterTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_user(username='admin', password='pass12345', role='admin', is_staff=True)
+
+    def active(self, dealer=None):
+        return DealerProfile.objects.get(user=dealer or self.dealer).active_products
+
+    def test_counter_follows_every_transition(self):
+        a = self.make_product('a', status='pending')
+        b = self.make_product('b', status='pending')
+        self.make_product('c')
+        self.assertEqual(self.active(), 1)
+
+        moderation.approve(Product.objects.filter(pk__in=[a.pk, b.pk]), self.admin)
+        self.assertEqual(self.active(), 3)
+        # Re-approving an approved product changes nothing
+        moderation.approve(Product.objects.filter(pk=a.pk), self.admin)
+        self.assertEqual(self.active(), 3)
+
+        moderation.reject(Product.objects.filter(pk=a.pk), self.admin, 'Blurry')
+        moderation.suspend(Product.objects.filter(slug='c'))
+        self.assertEqual(self.active(), 1)
+
+        Product.objects.filter(pk=b.pk).update(expires_at=timezone.now() - timedelta(minutes=1))
+        expire_listings()
+        self.assertEqual(self.active(), 0)
+
+        d = self.make_product('d')
+        self.assertEqual(self.active(), 1)
+        d.delete()
+        self.assertEqual(self.active(), 0)
+
+    def test_quota_check_does_not_count_products(self):
+        plan = SubscriptionPlan.objects.create(name='Basic', price_egp=Decimal('10.00'), max_products=2)
+        profile = DealerProfile.objects.get(user=self.dealer)
+        profile.subscription_plan = plan
+        profile.subscription_end_date = timezone.now() + timedelta(days=30)
+        profile.has_used_free_product = True
+        profile.save()
+        self.make_product('a')
+        self.make_product('b')
+
+        profile = DealerProfile.objects.get(user=self.dealer)
+        profile.get_plan()  # loads the plan registry
+        with self.assertNumQueries(0):
+            self.assertEqual(profile.can_publish_product(), (False, 'Max products (2) reached'))
+
+    def test_stale_profile_save_keeps_the_counter(self):
+        profile = DealerProfile.objects.get(user=self.dealer)
+        self.make_product('a')
+        profile.business_name = 'Shop'
+        profile.save()
+        self.assertEqual(self.active(), 1)
+
+    def test_recount_repairs_drift(self):
+        self.make_product('a')
+        self.make_product('b')
+        other = User.objects.create_user(username='other', password='pass12345', role='dealer')
+        DealerProfile.objects.filter(user=self.dealer).update(active_products=7)
+
+        out = StringIO()
+        call_command('recount_active_products', batch_size=1, stdout=out)
+        self.assertIn('Checked 2 dealers, fixed 1 counters', out.getvalue())
+        self.assertEqual((self.active(), self.active(other)), (2, 0))
+
+
+class ModerationQueueTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_user(username='admin', password='pass12345', role='admin', is_staff=True)
+        self.other_admin = User.objects.create_user(username='admin2', password='pass12345', role='admin', is_staff=True)
+        for i in range(5):
+            self.make_product(f'pending-{i}', status='pending')
+        self.make_product('live')
+
+    def test_claims_do_not_overlap(self):
+        first = list(moderation.claim_batch(self.admin, size=3))
+        second = list(moderation.claim_batch(self.other_admin, size=3))
+
+        self.assertEqual([p.slug for p in first], ['pending-0', 'pending-1', 'pending-2'])
+        self.assertEqual([p.slug for p in second], ['pending-3', 'pending-4'])
+        self.assertEqual(list(moderation.claim_batch(self.admin, size=3)), [])
+
+    def test_expired_lease_is_reclaimable(self):
+        moderation.claim_batch(self.admin, size=5)
+        Product.objects.filter(slug='pending-0').update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+        claimed = list(moderation.claim_batch(self.other_admin, size=5))
+        self.assertEqual([p.slug for p in claimed], ['pending-0'])
+        self.assertEqual(claimed[0].claimed_by, self.other_admin)
+
+    def test_decision_and_release_end_lease(self):
+        claimed = list(moderation.claim_batch(self.admin, size=2))
+        moderation.approve(Product.objects.filter(pk=claimed[0].pk), self.admin)
+
+        self.assertIsNone(Product.objects.get(pk=claimed[0].pk).claimed_by)
+        self.assertEqual(moderation.release(self.admin), 1)
+        self.assertEqual(len(moderation.claim_batch(self.other_admin, size=10)), 4)
+
+    def test_claimed_products_are_left_to_their_moderator(self):
+        claimed = list(moderation.claim_batch(self.admin, size=2))
+        self.client.force_authenticate(self.other_admin)
+
+        listed = self.client.get('/api/admin/products/?status=pending').data['results']
+        self.assertEqual(sorted(p['slug'] for p in listed), ['pending-2', 'pending-3', 'pending-4'])
+
+        response = self.client.post(f'/api/admin/products/{claimed[0].pk}/approve/')
+        self.assertEqual((response.status_code, response.data['ids']), (409, [claimed[0].pk]))
+        response = self.client.post(
+            '/api/admin/products/bulk_reject/', {'ids': [p.pk for p in Product.objects.filter(status='pending')]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Product.objects.filter(status='pending').count(), 5)
+
+        Product.objects.filter(pk=claimed[0].pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.client.post(f'/api/admin/products/{claimed[0].pk}/approve/').status_code, 200)
+
+    def test_queue_endpoints(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.post('/api/admin/products/queue/claim/', {'size': 2}, format='json')
+        self.assertEqual(response.data['count'], 2)
+
+        ids = [p['id'] for p in response.data['results']]
+        self.client.post('/api/admin/products/bulk_approve/', {'ids': ids[:1]}, format='json')
+        self.client.post('/api/admin/products/bulk_reject/', {'ids': ids[1:]}, format='json')
+
+        stats = self.client.get('/api/admin/products/queue/stats/').data
+        self.assertEqual(stats['pending'], 3)
+        self.assertEqual(stats['moderators'][0]['moderator'], 'admin')
+        self.assertEqual(stats['moderators'][0]['approved'], 1)
+        self.assertEqual(stats['moderators'][0]['rejected'], 1)
+        self.assertEqual(stats['moderators'][0]['claimed'], 0)
+
+
+def make_upload(name='photo.png', size=(1600, 1200)):
+    buffer = BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class ImageVariantTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=self.media_root, IMAGE_PROCESSING_ASYNC=False)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_upload_renders_webp_variants_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = self.make_product('camera', image=make_upload())
+            ProductImage.objects.create(product=product, image=make_upload('side.png'))
+        product.refresh_from_db()
+
+        self.assertEqual(product.image_variants['source'], product.image.name)
+        with Image.open(f"{self.media_root}/{product.image_variants['thumb']}") as thumb:
+            self.assertEqual((thumb.format, thumb.size), ('WEBP', (320, 240)))
+
+        item = self.client.get('/api/shop/products/').data['results'][0]
+        self.assertTrue(item['thumbnail'].endswith('_thumb.webp'))
+        detail = self.client.get('/api/shop/products/camera/').data
+        self.assertTrue(detail['image_medium'].endswith('_medium.webp'))
+        self.assertTrue(detail['additional_images'][0]['thumbnail'].endswith('_thumb.webp'))
+
+    def test_variants_are_served_by_exact_source_name(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = self.make_product('camera', image=make_upload())
+        product.refresh_from_db()
+        url = f"/media/{product.image_variants['thumb']}"
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertFalse([q['sql'] for q in ctx.captured_queries if ' LIKE ' in q['sql']])
+
+        Product.objects.filter(pk=product.pk).update(status='pending')
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_thumbnail_falls_back_to_original_until_rendered(self):
+        self.make_product('camera', image=make_upload())
+
+        item = self.client.get('/api/shop/products/').data['results'][0]
+        self.assertEqual(item['thumbnail'], item['image'])
+
+    def test_backfill_command_renders_missing_variants(self):
+        product = self.make_product('camera', image=make_upload())
+        self.make_product('missing-file')  # image path with no file behind it
+
+        with self.assertLogs('config.products.images', 'ERROR'):
+            call_command('process_product_images', workers=1, stdout=StringIO())
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants['source'], product.image.name)
+        self.assertFalse(images.needs_processing(product))
+
+
+@override_settings(VIDEO_UPLOAD_CHUNK_SIZE=4)
+class ChunkedVideoUploadTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root, upload_dir = tempfile.mkdtemp(), tempfile.mkdtemp()
+        for path in (media_root, upload_dir):
+            self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=media_root, CHUNKED_UPLOAD_DIR=upload_dir)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        plan = SubscriptionPlan.objects.create(name='pro', price_egp=Decimal('100'), max_products=50, allows_videos=True)
+        DealerProfile.objects.update_or_create(user=self.dealer, defaults={'subscription_plan': plan})
+        self.product = self.make_product('camera')
+        self.client.force_authenticate(self.dealer)
+
+    def start(self, filename='clip.mp4', size=10):
+        return self.client.post('/api/shop/video-uploads/', {
+            'product': 'camera', 'filename': filename, 'size': size,
+        }, format='json')
+
+    def put_chunk(self, upload_id, index, body):
+        return self.client.generic(
+            'PUT', f'/api/shop/video-uploads/{upload_id}/chunks/{index}/', body,
+            content_type='application/octet-stream',
+        )
+
+    def test_resumed_upload_is_assembled_and_attached(self):
+        response = self.start()
+        self.assertEqual(response.data['total_chunks'], 3)
+        upload_id = response.data['id']
+
+        self.put_chunk(upload_id, 2, b'89')
+        self.put_chunk(upload_id, 0, b'0123')
+        # ...connection drops; the client asks what is left
+        self.assertEqual(self.client.get(f'/api/shop/video-uploads/{upload_id}/').data['missing'], [1])
+        self.assertEqual(self.client.post(f'/api/shop/video-uploads/{upload_id}/complete/').status_code, 400)
+
+        self.put_chunk(upload_id, 1, b'4567')
+        response = self.client.post(f'/api/shop/video-uploads/{upload_id}/complete/')
+        self.assertEqual(response.status_code, 200)
+
+        self.product.refresh_from_db()
+        with self.product.video.open('rb') as fh:
+            self.assertEqual(fh.read(), b'0123456789')
+        self.assertFalse(uploads.upload_dir(VideoUpload.objects.get(pk=upload_id)).exists())
+        self.assertEqual(self.client.post(f'/api/shop/video-uploads/{upload_id}/complete/').status_code, 400)
+
+    def test_chunk_size_is_enforced(self):
+        upload_id = self.start().data['id']
+        self.assertEqual(self.put_chunk(upload_id, 0, b'01').status_code, 400)
+        self.assertEqual(self.put_chunk(upload_id, 3, b'0123').status_code, 400)
+
+    def test_extension_ownership_and_plan_are_checked(self):
+        self.assertEqual(self.start(filename='clip.exe').status_code, 400)
+
+        other = User.objects.create_user(username='other', password='pass12345', role='dealer')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.start().status_code, 403)
+
+        DealerProfile.objects.filter(user=self.dealer).update(subscription_plan=None)
+        self.client.force_authenticate(self.dealer)
+        self.assertEqual(self.start().status_code, 403)
+
+
+class MediaServingTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=self.media_root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        os.makedirs(f'{self.media_root}/product_videos')
+        with open(f'{self.media_root}/product_videos/demo.mp4', 'wb') as fh:
+            fh.write(bytes(range(256)) * 4)
+        self.product = self.make_product('camera', video='product_videos/demo.mp4')
+
+    def test_range_requests(self):
+        response = self.client.get('/media/product_videos/demo.mp4', HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(10, 20)))
+
+        response = self.client.get('/media/product_videos/demo.mp4', HTTP_RANGE='bytes=-4')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(252, 256)))
+
+        response = self.client.get('/media/product_videos/demo.mp4', HTTP_RANGE='bytes=2000-')
+        self.assertEqual(response.status_code, 416)
+
+        response = self.client.get('/media/product_videos/demo.mp4')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(len(b''.join(response.streaming_content)), 1024)
+
+    def test_unpublished_media_is_owner_only(self):
+        Product.objects.filter(pk=self.product.pk).update(status='pending')
+        self.assertEqual(self.client.get('/media/product_videos/demo.mp4').status_code, 404)
+
+        self.client.force_login(self.dealer)
+        response = self.client.get('/media/product_videos/demo.mp4')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+    def test_unreferenced_and_traversal_paths_are_not_served(self):
+        with open(f'{self.media_root}/product_videos/orphan.mp4', 'wb') as fh:
+            fh.write(b'x')
+        self.assertEqual(self.client.get('/media/product_videos/orphan.mp4').status_code, 404)
+        self.assertEqual(self.client.get('/media/product_videos/../../settings.py').status_code, 404)
+
+    @override_settings(MEDIA_SERVE_MODE='x-accel', MEDIA_ACCEL_PREFIX='/protected-media/')
+    def test_x_accel_offload(self):
+        response = self.client.get('/media/product_videos/demo.mp4')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/product_videos/demo.mp4')
+        self.assertEqual(response.content, b'')
+
+
+class ContentAddressedMediaTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=self.media_root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_duplicate_uploads_share_one_file(self):
+        first = self.make_product('first', image=make_upload('a.png'))
+        second = self.make_product('second', image=make_upload('b.png'))
+        ProductImage.objects.create(product=second, image=make_upload('c.png'))
+
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r'^products/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        self.assertEqual(MediaBlob.objects.get(name=first.image.name).refcount, 2)
+        self.assertEqual(len(os.listdir(os.path.dirname(first.image.path))), 1)
+
+    def test_references_follow_replacements_and_deletes(self):
+        product = self.make_product('first', image=make_upload('a.png'))
+        old_name = product.image.name
+
+        product = Product.objects.get(pk=product.pk)
+        product.image = make_upload('b.png', size=(10, 10))
+        product.save()
+        self.assertEqual(MediaBlob.objects.get(name=old_name).refcount, 0)
+        self.assertEqual(MediaBlob.objects.get(name=product.image.name).refcount, 1)
+
+        Product.objects.get(pk=product.pk).delete()
+        self.assertEqual(MediaBlob.objects.get(name=product.image.name).refcount, 0)
+
+    def test_gc_deletes_only_unreferenced_blobs_past_grace(self):
+        kept = self.make_product('kept', image=make_upload('a.png'))
+        dropped = self.make_product('dropped', image=make_upload('b.png', size=(10, 10)))
+        dropped_name = dropped.image.name
+        dropped.delete()
+        with open(f'{self.media_root}/products/stray.png', 'wb') as fh:
+            fh.write(b'stray')
+
+        call_command('gc_media', scan=True, stdout=StringIO())
+        self.assertTrue(MediaBlob.objects.filter(name=dropped_name).exists())  # still in its grace period
+
+        MediaBlob.objects.update(updated_at=timezone.now() - timedelta(days=2))
+        os.utime(f'{self.media_root}/products/stray.png', (0, 0))
+        call_command('gc_media', scan=True, stdout=StringIO())
+
+        self.assertFalse(MediaBlob.objects.filter(name=dropped_name).exists())
+        self.assertFalse(os.path.exists(f'{self.media_root}/{dropped_name}'))
+        self.assertFalse(os.path.exists(f'{self.media_root}/products/stray.png'))
+        self.assertTrue(os.path.exists(kept.image.path))
+
+    def test_gc_spares_referenced_files_and_saves_restore_collected_ones(self):
+        product = self.make_product('first', image=make_upload('a.png'))
+        name = product.image.name
+        # A drifted counter: the file is still in use
+        MediaBlob.objects.update(refcount=0, updated_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(list(storage.collect_garbage(timedelta(hours=1))), [])
+        self.assertTrue(os.path.exists(product.image.path))
+
+        product.delete()
+        MediaBlob.objects.update(updated_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(list(storage.collect_garbage(timedelta(hours=1))), [name])
+        # Same content again: no row, so the file is written again
+        again = self.make_product('again', image=make_upload('a.png'))
+        self.assertEqual(again.image.name, name)
+        self.assertTrue(os.path.exists(again.image.path))
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 1)
+
+    def test_backfill_registers_files_stored_before_blobs(self):
+        os.makedirs(f'{self.media_root}/products')
+        with open(f'{self.media_root}/products/legacy.jpg', 'wb') as fh:
+            fh.write(b'legacy')
+        self.make_product('first', image='products/legacy.jpg')
+        self.make_product('second', image='products/legacy.jpg')
+        self.make_product('gone', image='products/missing.jpg')
+
+        call_command('gc_media', backfill=True, stdout=StringIO())
+        blob = MediaBlob.objects.get(name='products/legacy.jpg')
+        self.assertEqual((blob.refcount, blob.size), (2, 6))
+        self.assertFalse(MediaBlob.objects.filter(name='products/missing.jpg').exists())
+        self.assertEqual(sum(storage.backfill_blobs()), 0)
+
+    def test_untracked_file_registered_meanwhile_is_kept(self):
+        product = self.make_product('first', image=make_upload('a.png'))
+        self.assertFalse(storage.delete_untracked(product.image.name))
+        self.assertTrue(os.path.exists(product.image.path))
+
+
+class AdditionalImageDiffTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=self.media_root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.product = self.make_product('camera')
+        self.images = [
+            ProductImage.objects.create(product=self.product, image=make_upload(f'{i}.png', size=(10 + i, 10)), position=i)
+            for i in range(3)
+        ]
+        self.client.force_authenticate(self.dealer)
+
+    def test_diff_removes_reorders_and_appends(self):
+        first, second, third = self.images
+        mtimes = {image.pk: os.path.getmtime(image.image.path) for image in (second, third)}
+
+        response = self.client.patch('/api/shop/products/camera/', {
+            'remove_image_ids': [first.pk],
+            'image_order': [third.pk, second.pk],
+            'additional_images': [make_upload('new.png', size=(20, 20))],
+        }, format='multipart')
+        self.assertEqual(response.status_code, 200)
+
+        remaining = list(self.product.additional_images.all())
+        self.assertEqual([image.pk for image in remaining[:2]], [third.pk, second.pk])
+        self.assertEqual([image.position for image in remaining], [0, 1, 2])
+        self.assertFalse(ProductImage.objects.filter(pk=first.pk).exists())
+        self.assertEqual(MediaBlob.objects.get(name=first.image.name).refcount, 0)
+        self.assertEqual(MediaBlob.objects.get(name=remaining[2].image.name).refcount, 1)
+        for image in (second, third):
+            self.assertEqual(os.path.getmtime(image.image.path), mtimes[image.pk])
+
+    def test_appending_keeps_existing_images(self):
+        self.client.patch('/api/shop/products/camera/', {
+            'additional_images': [make_upload('new.png', size=(20, 20))],
+        }, format='multipart')
+        self.assertEqual(self.product.additional_images.count(), 4)
+        self.assertEqual(self.product.additional_images.last().position, 3)
+
+    def test_foreign_or_incomplete_ids_are_rejected(self):
+        other = self.make_product('other')
+        foreign = ProductImage.objects.create(product=other, image=make_upload('x.png'))
+
+        response = self.client.patch('/api/shop/products/camera/', {'remove_image_ids': [foreign.pk]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.patch('/api/shop/products/camera/', {'image_order': [self.images[0].pk]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.product.additional_images.count(), 3)
@@ -0,0 +1,169 @@
+"""
+Chunked, resumable product video uploads.
+
+Each chunk is a raw request body streamed straight to
+``CHUNKED_UPLOAD_DIR/<upload id>/<index>.part``. Nothing goes through the
+multipart parser and nothing is buffered in memory. A chunk is written to a
+temporary name first and renamed into place once it has the expected size,
+so an interrupted request never leaves a partial chunk that looks complete.
+Clients resume by asking which chunks are missing.
+
+Completion concatenates the parts in the kernel (copy_file_range, falling
+back to sendfile), hands the result to the content-addressed media storage,
+which renames it into place, and attaches it to the product in one save.
+"""
+from datetime import timedelta
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from config.products.storage import LocalFile
+
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """A chunk or completion request that can't be accepted"""
+
+
+def upload_dir(upload):
+    return Path(settings.CHUNKED_UPLOAD_DIR) / str(upload.id)
+
+
+def chunk_path(upload, index):
+    return upload_dir(upload) / f'{index}.part'
+
+
+def received_chunks(upload):
+    """Indexes of chunks already stored with their full size"""
+    return [
+        index for index in range(upload.total_chunks)
+        if _stored_size(chunk_path(upload, index)) == upload.expected_chunk_size(index)
+    ]
+
+
+def missing_chunks(upload):
+    received = set(received_chunks(upload))
+    return [index for index in range(upload.total_chunks) if index not in received]
+
+
+def _stored_size(path):
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return None
+
+
+def write_chunk(upload, index, stream, length):
+    """Stream `length` bytes of `stream` into chunk `index`"""
+    if upload.status != 'uploading':
+        raise UploadError('Upload is already complete')
+    if not 0 <= index < upload.total_chunks:
+        raise UploadError(f'Chunk index must be between 0 and {upload.total_chunks - 1}')
+    expected = upload.expected_chunk_size(index)
+    if length != expected:
+        raise UploadError(f'Chunk {index} must be exactly {expected} bytes')
+
+    directory = upload_dir(upload)
+    directory.mkdir(parents=True, exist_ok=True)
+    partial = directory / f'{index}.part.{uuid.uuid4().hex}.tmp'
+    written = 0
+    try:
+        with open(partial, 'wb') as fh:
+            while written < length:
+                block = stream.read(min(STREAM_BLOCK_SIZE, length - written))
+                if not block:
+                    break
+                fh.write(block)
+                written += len(block)
+        if written != expected:
+            raise UploadError(f'Chunk {index} ended after {written} of {expected} bytes')
+        os.replace(partial, chunk_path(upload, index))
+    finally:
+        if partial.exists():
+            partial.unlink()
+    upload.save(update_fields=['updated_at'])
+    return written
+
+
+def _copy_range(source, target, count):
+    """Append `count` bytes of `source` to `target` without a userspace copy"""
+    offset = 0
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    while offset < count:
+        try:
+            if copy_file_range:
+                sent = copy_file_range(source.fileno(), target.fileno(), count - offset, offset)
+            else:
+                sent = os.sendfile(target.fileno(), source.fileno(), offset, count - offset)
+        except OSError:
+            # Cross-device or unsupported filesystem: fall back to a buffered copy
+            source.seek(offset)
+            shutil.copyfileobj(source, target, STREAM_BLOCK_SIZE)
+            return
+        if sent == 0:
+            raise UploadError('Chunk shrank while assembling')
+        offset += sent
+
+
+def assemble(upload):
+    """Concatenate every chunk into one file beside them; returns its path"""
+    missing = missing_chunks(upload)
+    if missing:
+        raise UploadError(f'Missing chunks: {missing}')
+
+    target_path = upload_dir(upload) / f'assembled.{upload.extension}'
+    with open(target_path, 'wb') as target:
+        for index in range(upload.total_chunks):
+            with open(chunk_path(upload, index), 'rb') as source:
+                _copy_range(source, target, upload.expected_chunk_size(index))
+    if target_path.stat().st_size != upload.size:
+        target_path.unlink()
+        raise UploadError('Assembled file size does not match the declared size')
+    return target_path
+
+
+def complete(upload):
+    """Assemble the chunks and attach the video to the product in one save"""
+    uploads = type(upload).objects.filter(pk=upload.pk)
+    # Flip the status first so concurrent completions can't both assemble
+    if not uploads.filter(status='uploading').update(status='complete', updated_at=timezone.now()):
+        raise UploadError('Upload is already complete')
+    try:
+        path = assemble(upload)
+    except Exception:
+        uploads.update(status='uploading')
+        raise
+    upload.status = 'complete'
+
+    product = upload.product
+    # The content-addressed storage renames the file into the media tree
+    # (or drops it if the same video is already stored)
+    with LocalFile(open(path, 'rb')) as video:
+        product.video.save(f'{upload.id}.{upload.extension}', video, save=False)
+    product.save(update_fields=['video', 'updated_at'])
+    discard_chunks(upload)
+    return product
+
+
+def discard_chunks(upload):
+    shutil.rmtree(upload_dir(upload), ignore_errors=True)
+
+
+def clear_stale(hours):
+    """Drop unfinished uploads untouched for `hours`; returns how many"""
+    from config.products.models import VideoUpload
+
+    stale = VideoUpload.objects.filter(
+        status='uploading', updated_at__lt=timezone.now() - timedelta(hours=hours)
+    )
+    count = 0
+    for upload in stale.iterator():
+        discard_chunks(upload)
+        upload.delete()
+        count += 1
+    return count
@@ -1,10 +1,11 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from config.products.views import CategoryViewSet, ProductViewSet
+from config.products.views import CategoryViewSet, ProductViewSet, VideoUploadViewSet
 
 router = DefaultRouter()
 router.register(r'categories', CategoryViewSet, basename='category')
 router.register(r'products', ProductViewSet, basename='product')
+router.register(r'video-uploads', VideoUploadViewSet, basename='video-upload')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -1,4 +1,4 @@
-from rest_framework import viewsets, permissions, status, generics
+from rest_framework import viewsets, mixins, permissions, status, generics
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.exceptions import PermissionDenied
@@ -9,12 +9,15 @@ from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from datetime import timedelta
 
-from config.products.models import Product, Category, ProductImage, ProductReview
+from django.conf import settings
+
+from config.products.models import Product, Category, ProductImage, ProductReview, VideoUpload
 from config.products.serializers import (
     CategorySerializer, ProductListSerializer, ProductDetailSerializer,
-    ProductCreateUpdateSerializer, ProductReviewSerializer
+    ProductCreateUpdateSerializer, ProductReviewSerializer, VideoUploadSerializer
 )
-from config.permissions import IsDealer, IsDealerOwner, IsAdmin, IsOwnerOrAdmin
+from config.products import cache as catalog_cache, snapshots, moderation, uploads
+from config.permissions import IsDealer, IsDealerOwner, IsAdmin, IsOwnerOrAdmin, is_admin_user
 from config.accounts.models import DealerProfile
 from config.wallet_utils import WalletManager
 
@@ -45,12 +48,17 @@ class ProductViewSet(viewsets.ModelViewSet):
             return ProductDetailSerializer
         return ProductListSerializer
     
+    def handle_exception(self, exc):
+        if isinstance(exc, moderation.LeaseHeld):
+            return Response({'detail': str(exc), 'ids': exc.ids}, status=status.HTTP_409_CONFLICT)
+        return super().handle_exception(exc)
+    
     def get_queryset(self):
         """Filter products based on user role"""
         if self.action == 'retrieve' or self.action == 'list':
             # Public users see only approved products
             if not self.request.user.is_authenticated:
-                return Product.objects.filter(status='approved', is_active=True)
+                return Product.objects.public()
             
             # Admin sees all
             user = self.request.user
@@ -59,16 +67,44 @@ class ProductViewSet(viewsets.ModelViewSet):
             
             # Dealers see their own products + approved others
             if getattr(user, 'role', None) == 'dealer':
-                return Product.objects.filter(
-                    status__in=['approved', 'rejected', 'suspended']
-                ) | Product.objects.filter(dealer=self.request.user)
+                return Product.objects.visible_to_dealer(user)
             
             # Clients see approved products
-            return Product.objects.filter(status='approved', is_active=True)
+            return Product.objects.public()
         
         # For edit actions, return all
         return Product.objects.all()
-    
+
+    def list(self, request, *args, **kwargs):
+        """List products - anonymous responses are served from the catalog cache"""
+        if request.user.is_authenticated or not catalog_cache.is_enabled():
+            return super().list(request, *args, **kwargs)
+
+        data = snapshots.get_page(request)
+        if data is not None:
+            return Response(data)
+
+        key = catalog_cache.list_key(request)
+        data = catalog_cache.get_cached(key)
+        if data is None:
+            response = super().list(request, *args, **kwargs)
+            catalog_cache.set_cached(key, response.data)
+            return response
+        return Response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        """Product details - anonymous responses are served from the catalog cache"""
+        if request.user.is_authenticated or not catalog_cache.is_enabled():
+            return super().retrieve(request, *args, **kwargs)
+
+        key = catalog_cache.detail_key(request, kwargs[self.lookup_field])
+        data = catalog_cache.get_cached(key)
+        if data is None:
+            response = super().retrieve(request, *args, **kwargs)
+            catalog_cache.set_cached(key, response.data)
+            return response
+        return Response(data)
+
     def get_permissions(self):
         """Set permissions per action"""
         if self.action in ['list', 'retrieve']:
@@ -101,7 +137,8 @@ class ProductViewSet(viewsets.ModelViewSet):
         
         # Check if user can upload videos
         if serializer.validated_data.get('video'):
-            if not dealer_profile.subscription_plan or not dealer_profile.subscription_plan.allows_videos:
+            plan = dealer_profile.get_plan()
+            if not plan or not plan.allows_videos:
                 raise PermissionDenied('Video uploads only available for Pro and Enterprise plans')
         
         # Save product
@@ -146,16 +183,8 @@ class ProductViewSet(viewsets.ModelViewSet):
     def approve(self, request, slug=None):
         """Admin approves a product"""
         product = self.get_object()
-        product.status = 'approved'
-        product.reviewed_by = request.user
-        product.reviewed_at = timezone.now()
-        product.publish_date = timezone.now()
-        
-        # Set expiry date
-        if product.listing_duration_days:
-            product.expires_at = timezone.now() + timedelta(days=product.listing_duration_days)
-        
-        product.save()
+        moderation.approve(Product.objects.filter(pk=product.pk), request.user)
+        product.refresh_from_db()
         
         return Response({
             'detail': 'Product approved',
@@ -168,11 +197,7 @@ class ProductViewSet(viewsets.ModelViewSet):
         product = self.get_object()
         reason = request.data.get('reason', 'Not specified')
         
-        product.status = 'rejected'
-        product.rejection_reason = reason
-        product.reviewed_by = request.user
-        product.reviewed_at = timezone.now()
-        product.save()
+        moderation.reject(Product.objects.filter(pk=product.pk), request.user, reason)
         
         return Response({
             'detail': 'Product rejected',
@@ -185,8 +210,7 @@ class ProductViewSet(viewsets.ModelViewSet):
         product = self.get_object()
         reason = request.data.get('reason', 'Not specified')
         
-        product.status = 'suspended'
-        product.save()
+        moderation.suspend(Product.objects.filter(pk=product.pk), request.user)
         
         return Response({'detail': f'Product suspended: {reason}'})
     
@@ -227,3 +251,65 @@ class ProductViewSet(viewsets.ModelViewSet):
         serializer = ProductReviewSerializer(review)
         return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
+
+
+class VideoUploadViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                         mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    """Chunked, resumable product video uploads (see config/products/uploads.py)"""
+    serializer_class = VideoUploadSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        if is_admin_user(self.request.user):
+            return VideoUpload.objects.all()
+        return VideoUpload.objects.filter(dealer=self.request.user)
+    
+    def perform_create(self, serializer):
+        """Same ownership and plan rules as uploading a video with the product"""
+        user = self.request.user
+        product = serializer.validated_data['product']
+        if not is_admin_user(user):
+            if product.dealer != user:
+                raise PermissionDenied('You can only upload videos to your own products')
+            allows_videos = DealerProfile.objects.filter(user=user).values_list(
+                'subscription_plan__allows_videos', flat=True
+            ).first()
+            if not allows_videos:
+                raise PermissionDenied('Video uploads only available for Pro and Enterprise plans')
+        
+        serializer.save(dealer=user, chunk_size=settings.VIDEO_UPLOAD_CHUNK_SIZE)
+    
+    def retrieve(self, request, *args, **kwargs):
+        """Upload state; `missing` lists the chunks a resuming client must (re)send"""
+        upload = self.get_object()
+        data = self.get_serializer(upload).data
+        data['missing'] = uploads.missing_chunks(upload) if upload.status == 'uploading' else []
+        return Response(data)
+    
+    @action(detail=True, methods=['put'], url_path=r'chunks/(?P<index>\d+)')
+    def chunk(self, request, pk=None, index=None):
+        """Store one chunk; the request body is the raw chunk bytes"""
+        upload = self.get_object()
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+            uploads.write_chunk(upload, int(index), request.stream, length)
+        except (uploads.UploadError, ValueError) as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({'index': int(index), 'missing': uploads.missing_chunks(upload)})
+    
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        """Assemble the chunks and attach the video to the product"""
+        upload = self.get_object()
+        try:
+            product = uploads.complete(upload)
+        except uploads.UploadError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(ProductDetailSerializer(product, context={'request': request}).data)
+    
+    def perform_destroy(self, instance):
+        """Abort an upload and drop its chunks"""
+        uploads.discard_chunks(instance)
+        instance.delete()
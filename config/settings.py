@@ -142,7 +142,7 @@ AUTH_USER_MODEL = 'accounts.User'
 # REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'config.accounts.authentication.ClaimsJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
@@ -152,7 +152,11 @@ REST_FRAMEWORK = {
         'django_filters.rest_framework.DjangoFilterBackend',
     ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 10
+    'PAGE_SIZE': 10,
+    # Reverse proxies in front of the app. Client IPs (login throttles) come
+    # from that many X-Forwarded-For hops; 0 uses REMOTE_ADDR and ignores the
+    # header, which clients could otherwise set to anything
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', '0')),
 }
 
 # JWT Configuration
@@ -161,6 +165,7 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'ROTATE_REFRESH_TOKENS': False,
     'BLACKLIST_AFTER_ROTATION': True,
+    'TOKEN_REFRESH_SERIALIZER': 'config.accounts.serializers.TokenRefreshSerializer',
 }
 
 # CORS Configuration
@@ -180,6 +185,15 @@ MAX_UPLOAD_SIZE = 52428800  # 50MB
 ALLOWED_VIDEO_EXTENSIONS = ['mp4', 'avi', 'mov', 'mkv', 'webm']
 ALLOWED_IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif', 'webp']
 
+# Media serving (see config/products/media.py): 'django', 'x-accel' (nginx) or 'x-sendfile' (Apache)
+MEDIA_SERVE_MODE = os.environ.get('MEDIA_SERVE_MODE', 'django')
+MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-media/')
+
+# Chunked video uploads (see config/products/uploads.py)
+MAX_VIDEO_UPLOAD_SIZE = int(os.environ.get('MAX_VIDEO_UPLOAD_SIZE', str(2 * 1024 ** 3)))  # 2GB
+VIDEO_UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024  # 5MB per chunk
+CHUNKED_UPLOAD_DIR = os.environ.get('CHUNKED_UPLOAD_DIR', str(BASE_DIR / 'chunked_uploads'))
+
 # Security Settings
 SECURE_HSTS_SECONDS = 0 if DEBUG else 31536000
 SECURE_HSTS_INCLUDE_SUBDOMAINS = not DEBUG
@@ -188,7 +202,9 @@ SESSION_COOKIE_SECURE = not DEBUG
 CSRF_COOKIE_SECURE = not DEBUG
 SECURE_SSL_REDIRECT = not DEBUG
 
-# Cache Configuration (for atomic operations)
+# Cache Configuration (for atomic operations). LocMemCache is per process:
+# login throttles, token revocation and catalog snapshots only hold across
+# workers with a shared backend (see config/accounts/tokens.py cache_is_shared)
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
@@ -196,6 +212,75 @@ CACHES = {
     }
 }
 
+# Anonymous catalog response cache (see config/products/cache.py)
+CATALOG_CACHE_ENABLED = os.environ.get('CATALOG_CACHE_ENABLED', 'True') == 'True'
+CATALOG_CACHE_TIMEOUT = int(os.environ.get('CATALOG_CACHE_TIMEOUT', '300'))  # seconds
+CATALOG_SNAPSHOT_PAGES = 5  # pages per category/ordering kept in config/products/snapshots.py
+
+# Product image variants (see config/products/images.py)
+IMAGE_PROCESSING_ASYNC = os.environ.get('IMAGE_PROCESSING_ASYNC', 'True') == 'True'
+IMAGE_PROCESSING_WORKERS = int(os.environ.get('IMAGE_PROCESSING_WORKERS', '2'))
+
+# Password hashing; the first hasher is preferred and older hashes are
+# upgraded on login (see config/accounts/hashers.py and login.py)
+PASSWORD_HASHERS = [
+    'config.accounts.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', '0')) or None  # None = Django's default
+
+# Login hashing pool and throttling (see config/accounts/login.py and throttles.py)
+LOGIN_HASH_WORKERS = int(os.environ.get('LOGIN_HASH_WORKERS', '4'))
+LOGIN_MAX_CONCURRENT_HASHES = int(os.environ.get('LOGIN_MAX_CONCURRENT_HASHES', '16'))
+LOGIN_HASH_WAIT_SECONDS = 2
+LOGIN_THROTTLE = {
+    'ip': {'capacity': 20, 'per_minute': 10},
+    'username': {'capacity': 5, 'per_minute': 2},
+    'username_probe': {'capacity': 30, 'per_minute': 30},  # register form availability check
+}
+
+# Outbound email queue drained by send_queued_email (see config/accounts/outbox.py)
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+EMAIL_OUTBOX_RETRY_SECONDS = 60  # doubled after every failed attempt
+EMAIL_OUTBOX_LEASE_SECONDS = 300
+EMAIL_OUTBOX_RETENTION_DAYS = 30  # prune_outbox deletes finished rows after this
+
+# Users per bulk_provision request; passwords are hashed in the request, so
+# larger imports go through manage.py provision_users (see config/accounts/provisioning.py)
+BULK_PROVISION_MAX_USERS = 200
+
+# Approved listings a dealer keeps when their plan lapses; the rest are
+# suspended (see config/accounts/subscriptions.py)
+LAPSED_DEALER_PRODUCT_LIMIT = 1
+# renew_subscriptions renews auto_renew plans ending within this many hours
+SUBSCRIPTION_RENEWAL_WINDOW_HOURS = 24
+# Seconds a worker keeps its copy of the subscription plans at most (see
+# config/accounts/plans.py)
+PLAN_REGISTRY_MAX_AGE = 60
+
+# Payment gateway (see config/payments/payment_gateway.py). For a real
+# provider use HTTPPaymentGateway with OPTIONS base_url, api_key, pool_size,
+# connect_timeout, read_timeout and pool_timeout (seconds).
+PAYMENT_GATEWAY = {
+    'BACKEND': 'config.payments.payment_gateway.MockPaymentGateway',
+    'OPTIONS': {},
+}
+
+# Order payments left unfinished are driven by process_payments (see
+# config/payments/saga.py)
+PAYMENT_MAX_ATTEMPTS = 8
+PAYMENT_RETRY_SECONDS = 30  # doubled after every unanswered gateway call
+PAYMENT_LEASE_SECONDS = 120
+
+# Authenticated user cache lifetime in seconds (see config/accounts/authentication.py)
+AUTH_USER_CACHE_TIMEOUT = int(os.environ.get('AUTH_USER_CACHE_TIMEOUT', '60'))
+
+# Moderation queue lease length (see config/products/moderation.py)
+MODERATION_LEASE_SECONDS = int(os.environ.get('MODERATION_LEASE_SECONDS', '600'))
+
 
 MIDDLEWARE = ['corsheaders.middleware.CorsMiddleware'] + MIDDLEWARE
 CORS_ALLOW_ALL_ORIGINS = True  # development only
@@ -9,10 +9,11 @@ SECURITY ARCHITECTURE:
 - Login endpoint returns redirect_url based on user.role for correct post-login navigation
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from config.dashboard.views import dashboard_redirect
+from config.products.media import serve_media
 
 
 urlpatterns = [
@@ -35,9 +36,11 @@ urlpatterns = [
     path('api/payments/', include('config.payments.urls')),
     path('api/admin/', include('config.admin.urls')),
     path('api/support/', include('config.support.urls')),
+
+    # Media: access-checked, Range-aware, optionally offloaded to the web server
+    re_path(r'^%s(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'), serve_media, name='media'),
 ]
 
 
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
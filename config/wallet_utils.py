@@ -10,7 +10,17 @@ from config.payments.models import Transaction, GoldMassConversionRate
 
 
 class WalletManager:
-    """Manages wallet operations atomically"""
+    """Manages wallet operations atomically.
+    
+    Wallet rows are created lazily by the first credit. A user without a
+    row has a zero balance, so reads never write.
+    """
+    
+    WALLET_MODELS = {
+        'egp': EGPWallet,
+        'gold': GoldWallet,
+        'mass': MassWallet,
+    }
     
     @staticmethod
     def get_or_create_wallets(user):
@@ -22,17 +32,12 @@ class WalletManager:
     
     @staticmethod
     def get_balance(user, currency):
-        """Get wallet balance for a currency"""
-        if currency == 'egp':
-            wallet, _ = EGPWallet.objects.get_or_create(user=user)
-            return wallet.balance
-        elif currency == 'gold':
-            wallet, _ = GoldWallet.objects.get_or_create(user=user)
-            return wallet.balance
-        elif currency == 'mass':
-            wallet, _ = MassWallet.objects.get_or_create(user=user)
-            return wallet.balance
-        return Decimal('0.00')
+        """Get wallet balance for a currency (zero if the wallet doesn't exist yet)"""
+        model = WalletManager.WALLET_MODELS.get(currency)
+        if model is None:
+            return Decimal('0.00')
+        balance = model.objects.filter(user=user).values_list('balance', flat=True).first()
+        return balance if balance is not None else Decimal('0.00')
     
     @staticmethod
     @transaction.atomic
@@ -42,30 +47,19 @@ class WalletManager:
         Returns: (success: bool, transaction: Transaction or None, error: str or None)
         """
         try:
-            if currency == 'egp':
-                wallet = EGPWallet.objects.select_for_update().get(user=user)
-                if wallet.balance < amount:
-                    return False, None, f"Insufficient EGP balance. Required: {amount}, Available: {wallet.balance}"
-                wallet.balance = F('balance') - amount
-                wallet.save(update_fields=['balance', 'updated_at'])
-            
-            elif currency == 'gold':
-                wallet = GoldWallet.objects.select_for_update().get(user=user)
-                if wallet.balance < amount:
-                    return False, None, f"Insufficient Gold balance. Required: {amount}, Available: {wallet.balance}"
-                wallet.balance = F('balance') - amount
-                wallet.save(update_fields=['balance', 'updated_at'])
+            model = WalletManager.WALLET_MODELS.get(currency)
+            if model is None:
+                return False, None, f"Invalid currency: {currency}"
             
-            elif currency == 'mass':
-                wallet = MassWallet.objects.select_for_update().get(user=user)
-                if wallet.balance < amount:
-                    return False, None, f"Insufficient Mass balance. Required: {amount}, Available: {wallet.balance}"
+            wallet = model.objects.select_for_update().filter(user=user).first()
+            available = wallet.balance if wallet else Decimal('0.00')
+            if available < amount:
+                label = 'EGP' if currency == 'egp' else currency.title()
+                return False, None, f"Insufficient {label} balance. Required: {amount}, Available: {available}"
+            if wallet:
                 wallet.balance = F('balance') - amount
                 wallet.save(update_fields=['balance', 'updated_at'])
             
-            else:
-                return False, None, f"Invalid currency: {currency}"
-            
             # Create transaction record
             txn = Transaction.objects.create(
                 user=user,
@@ -79,12 +73,6 @@ class WalletManager:
             
             return True, txn, None
         
-        except EGPWallet.DoesNotExist:
-            return False, None, "EGP wallet not found"
-        except GoldWallet.DoesNotExist:
-            return False, None, "Gold wallet not found"
-        except MassWallet.DoesNotExist:
-            return False, None, "Mass wallet not found"
         except Exception as e:
             return False, None, str(e)
     
@@ -92,28 +80,20 @@ class WalletManager:
     @transaction.atomic
     def add_to_wallet(user, amount, currency, description, transaction_type='purchase', **kwargs):
         """
-        Add to wallet atomically.
+        Add to wallet atomically, creating the wallet on the first credit.
         Returns: (success: bool, transaction: Transaction or None, error: str or None)
         """
         try:
-            if currency == 'egp':
-                wallet = EGPWallet.objects.select_for_update().get(user=user)
-                wallet.balance = F('balance') + amount
-                wallet.save(update_fields=['balance', 'updated_at'])
-            
-            elif currency == 'gold':
-                wallet = GoldWallet.objects.select_for_update().get(user=user)
-                wallet.balance = F('balance') + amount
-                wallet.save(update_fields=['balance', 'updated_at'])
-            
-            elif currency == 'mass':
-                wallet = MassWallet.objects.select_for_update().get(user=user)
-                wallet.balance = F('balance') + amount
-                wallet.save(update_fields=['balance', 'updated_at'])
-            
-            else:
+            model = WalletManager.WALLET_MODELS.get(currency)
+            if model is None:
                 return False, None, f"Invalid currency: {currency}"
             
+            # get_or_create copes with a concurrent first credit
+            model.objects.get_or_create(user=user)
+            wallet = model.objects.select_for_update().get(user=user)
+            wallet.balance = F('balance') + amount
+            wallet.save(update_fields=['balance', 'updated_at'])
+            
             # Create transaction record
             txn = Transaction.objects.create(
                 user=user,
@@ -127,8 +107,6 @@ class WalletManager:
             
             return True, txn, None
         
-        except (EGPWallet.DoesNotExist, GoldWallet.DoesNotExist, MassWallet.DoesNotExist) as e:
-            return False, None, f"Wallet not found: {str(e)}"
         except Exception as e:
             return False, None, str(e)
     